@@ -9,6 +9,12 @@ const API_BASE_URL = USE_NGROK
   ? `${NGROK_URL}/api`
   : 'http://localhost:4000/api';
 
+// Annotated images come back as server-relative artifact URLs
+const SERVER_URL = API_BASE_URL.replace(/\/api$/, '');
+
+const resolveImageUris = (uris: string[]): string[] =>
+  uris.map((uri) => (uri.startsWith('/') ? `${SERVER_URL}${uri}` : uri));
+
 export interface DetectionResult {
   class_name: string;
   confidence: number;
@@ -119,7 +125,7 @@ class ApiService {
     console.log('Multiframe analysis complete:', multiframeData.validated_detections.length, 'detections');
 
     const enrichedDetections = multiframeData.validated_detections;
-    const annotatedImageUris = multiframeData.annotated_images || [];
+    const annotatedImageUris = resolveImageUris(multiframeData.annotated_images || []);
 
     const primaryDetection = enrichedDetections[0];
     const summary = primaryDetection 
@@ -212,7 +218,7 @@ class ApiService {
     console.log('Video analysis complete:', data.validated_detections.length, 'detections');
 
     const enrichedDetections = data.validated_detections;
-    const annotatedImageUris = data.annotated_images || [];
+    const annotatedImageUris = resolveImageUris(data.annotated_images || []);
 
     const primaryDetection = enrichedDetections[0];
     const summary = primaryDetection
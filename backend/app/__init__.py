@@ -21,12 +21,27 @@ def create_app():
     
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
-    from app.routes import detection, tagging, multiframe, georeport, health
+    from app.routes import detection, tagging, multiframe, georeport, health, jobs, artifacts
     
     app.register_blueprint(detection.bp)
     app.register_blueprint(tagging.bp)
     app.register_blueprint(multiframe.bp)
     app.register_blueprint(georeport.bp)
     app.register_blueprint(health.bp)
+    app.register_blueprint(jobs.bp)
+    app.register_blueprint(artifacts.bp)
+    
+    # Resume jobs queued or interrupted before the last shutdown
+    from app.services.job_queue import get_job_queue
+    get_job_queue().start()
+    
+    if os.getenv('MODEL_WARMUP', 'False').lower() == 'true':
+        from app.services.model_registry import get_registry
+        
+        sizes = [int(s) for s in os.getenv('MODEL_WARMUP_IMGSZ', '').split(',') if s.strip()]
+        get_registry().start_warmup(
+            sizes=sizes or None,
+            runs=int(os.getenv('MODEL_WARMUP_RUNS', 2))
+        )
     
     return app
@@ -0,0 +1,57 @@
+"""
+Content-addressed artifact endpoints serving lazily rendered annotated images.
+"""
+
+import re
+from flask import Blueprint, Response, request, jsonify
+from app.services.artifact_store import get_artifact_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('artifacts', __name__, url_prefix='/api/artifacts')
+
+ARTIFACT_KEY = re.compile(r'[0-9a-f]{64}')
+
+
+def artifact_url(key):
+    """Build the URL an artifact is served from."""
+    return f'/api/artifacts/{key}'
+
+
+@bp.route('/<key>', methods=['GET'])
+def get_artifact(key):
+    """
+    Get an annotated image, rendering it on first request.
+    
+    Artifacts never change, so the key doubles as a strong ETag and responses
+    may be cached indefinitely. A request whose If-None-Match carries the key
+    gets 304 without the artifact being looked up or rendered.
+    
+    Response:
+        image/jpeg body, or 404 if the artifact is unknown or has expired
+    """
+    try:
+        if not ARTIFACT_KEY.fullmatch(key):
+            return jsonify({'error': f'Artifact {key} not found'}), 404
+        
+        if request.if_none_match.contains(key):
+            response = Response(status=304)
+        else:
+            data = get_artifact_store().get(key)
+            
+            if data is None:
+                return jsonify({'error': f'Artifact {key} not found'}), 404
+            
+            response = Response(data, mimetype='image/jpeg')
+        
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        
+        return response
+    
+    except Exception as e:
+        logger.error(f"Artifact error: {e}")
+        return jsonify({'error': str(e)}), 500
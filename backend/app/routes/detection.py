@@ -2,26 +2,31 @@
 Detection endpoints for YOLOv8-based urban issue detection.
 """
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from werkzeug.utils import secure_filename
 import os
+import json
 import cv2
 import numpy as np
-from app.services.yolo_detector import YOLODetector
+from app.services.model_registry import get_registry
+from app.services.detection_cache import get_detection_cache
+from app.services.job_queue import register_handler
+from app.routes.jobs import submit_job
 import logging
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('detection', __name__, url_prefix='/api/detect')
 
-_detector = None
+NDJSON = 'application/x-ndjson'
 
 def get_detector():
-    """Get or create YOLODetector instance."""
-    global _detector
-    if _detector is None:
-        _detector = YOLODetector()
-    return _detector
+    """Get the shared YOLODetector from the model registry."""
+    return get_registry().get('yolo_detector')
+
+def get_scheduler():
+    """Get the micro-batching InferenceScheduler for the shared detector."""
+    return get_registry().scheduler('yolo_detector')
 
 
 @bp.route('/single', methods=['POST'])
@@ -32,13 +37,23 @@ def detect_single():
     Request:
         - file: Image file (multipart/form-data)
         - conf_threshold: Optional confidence threshold (default: 0.25)
-        
+        - tiled: Optional "true" to detect on overlapping tiles (small objects in large photos)
+        - latency_budget_ms: Optional latency budget; may lower the inference image size
+          (also accepted as the X-Latency-Budget-Ms header)
+    
     Response:
         {
             "success": true,
             "detections": [...],
             "num_detections": int,
-            "image_shape": [height, width, channels]
+            "image_shape": [height, width],
+            "cached": bool,
+            "inference": {
+                "imgsz": int,
+                "latency_budget_ms": float | null,
+                "estimated_ms": float | null,
+                "queue_depth": int
+            }
         }
     """
     try:
@@ -51,20 +66,71 @@ def detect_single():
             return jsonify({'error': 'Empty filename'}), 400
         
         conf_threshold = request.form.get('conf_threshold', type=float)
+        tiled = request.form.get('tiled', 'false').lower() == 'true'
+        
+        latency_budget_ms = request.headers.get(
+            'X-Latency-Budget-Ms',
+            request.form.get('latency_budget_ms')
+        )
+        if latency_budget_ms is not None:
+            try:
+                latency_budget_ms = float(latency_budget_ms)
+            except ValueError:
+                return jsonify({'error': 'latency_budget_ms must be a number'}), 400
         
         file_bytes = file.read()
         
         detector = get_detector()
         
-        detections, image = detector.detect_from_bytes(file_bytes, conf_threshold)
+        if conf_threshold is None:
+            conf_threshold = detector.conf_threshold
+        
+        scheduler = get_scheduler()
+        
+        # Tiles always run at the full size; the budget only applies to whole frames
+        inference = detector.select_imgsz(
+            None if tiled else latency_budget_ms,
+            queue_depth=scheduler.queue_depth(),
+            replicas=scheduler.pool.size,
+            overhead_ms=scheduler.max_wait * 1000.0
+        )
+        imgsz = inference['imgsz']
+        
+        cache = get_detection_cache()
+        key = cache.make_key(
+            file_bytes,
+            detector.model_version,
+            conf_threshold=conf_threshold,
+            tiled=tiled,
+            imgsz=imgsz
+        )
+        
+        def run_detection():
+            image = detector.decode_image(file_bytes)
+            
+            if tiled:
+                with get_registry().acquire('yolo_detector') as replica:
+                    detections = replica.detect_tiled(image, conf_threshold)
+            else:
+                detections = scheduler.detect(image, conf_threshold, imgsz=imgsz).to_dicts()
+            
+            return {
+                'detections': detections,
+                'image_shape': list(image.shape[:2])  # [height, width]
+            }
+        
+        result, cached = cache.get_or_compute(key, run_detection)
+        detections = result['detections']
         
         return jsonify({
             'success': True,
             'detections': detections,
             'num_detections': len(detections),
-            'image_shape': image.shape[:2]  # [height, width]
+            'image_shape': result['image_shape'],
+            'cached': cached,
+            'inference': inference
         })
-        
+    
     except Exception as e:
         logger.error(f"Detection error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -78,7 +144,8 @@ def detect_batch():
     Request:
         - files: Multiple image files (multipart/form-data)
         - conf_threshold: Optional confidence threshold
-        
+        - async: Optional "true" to queue a background job and return 202 with its id
+    
     Response:
         {
             "success": true,
@@ -93,6 +160,11 @@ def detect_batch():
             "total_images": int,
             "total_detections": int
         }
+    
+    With "Accept: application/x-ndjson" the response is streamed instead: one
+    JSON line per image ({"index", "filename", "detections", "num_detections"}
+    or "error") as soon as it is processed, then a summary line
+    {"success", "total_images", "total_detections"}.
     """
     try:
         if 'files' not in request.files:
@@ -105,43 +177,235 @@ def detect_batch():
         
         conf_threshold = request.form.get('conf_threshold', type=float)
         
-        detector = get_detector()
+        named_files = [
+            (secure_filename(file.filename), file)
+            for file in files
+            if file.filename != ''
+        ]
         
-        results = []
-        total_detections = 0
+        if request.form.get('async', 'false').lower() == 'true':
+            return submit_job('detect_batch', {'conf_threshold': conf_threshold}, named_files)
         
-        for file in files:
-            if file.filename == '':
-                continue
-            
-            try:
-                file_bytes = file.read()
-                detections, _ = detector.detect_from_bytes(file_bytes, conf_threshold)
-                
-                results.append({
-                    'filename': secure_filename(file.filename),
-                    'detections': detections,
-                    'num_detections': len(detections)
-                })
-                
-                total_detections += len(detections)
-                
-            except Exception as e:
-                logger.error(f"Error processing {file.filename}: {e}")
-                results.append({
-                    'filename': secure_filename(file.filename),
-                    'error': str(e)
-                })
+        # Uploads are read one chunk at a time as results are produced
+        named_bytes = ((filename, file.read()) for filename, file in named_files)
         
-        return jsonify({
-            'success': True,
-            'results': results,
-            'total_images': len(results),
-            'total_detections': total_detections
-        })
+        if request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON:
+            return Response(
+                stream_with_context(_stream_batch(named_bytes, conf_threshold)),
+                mimetype=NDJSON
+            )
         
+        return jsonify(run_batch_detection(named_bytes, conf_threshold))
+    
+    except Exception as e:
+        logger.error(f"Batch detection error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+def _stream_batch(named_bytes, conf_threshold):
+    """Yield /batch results as NDJSON lines followed by a summary line."""
+    total_images = 0
+    total_detections = 0
+    
+    try:
+        for entry in iter_batch_detection(named_bytes, conf_threshold, ramp_up=True):
+            yield json.dumps({'index': total_images, **entry}) + '\n'
+            total_images += 1
+            total_detections += entry.get('num_detections', 0)
+    
     except Exception as e:
         logger.error(f"Batch detection error: {e}")
+        yield json.dumps({'error': str(e)}) + '\n'
+        return
+    
+    yield json.dumps({
+        'success': True,
+        'total_images': total_images,
+        'total_detections': total_detections
+    }) + '\n'
+
+
+def iter_batch_detection(named_bytes, conf_threshold=None, ramp_up=False):
+    """
+    Detect urban issues in several encoded images, yielding results in input order.
+    
+    Images are consumed from named_bytes in chunks of max_batch_size, so only
+    one chunk of uploads and decoded frames is held in memory at a time. In
+    each chunk, cached images are answered from the detection cache and the
+    rest run through one batched forward pass.
+    
+    Args:
+        named_bytes: Iterable of (filename, encoded image bytes), read lazily
+        conf_threshold: Optional confidence threshold
+        ramp_up: Start with a chunk of one image and double the chunk size up to
+            max_batch_size, so the first results arrive after a single-image
+            forward pass (for streamed responses)
+    
+    Yields:
+        /batch result entries: {"filename", "detections", "num_detections"} or {"filename", "error"}
+    """
+    detector = get_detector()
+    
+    if conf_threshold is None:
+        conf_threshold = detector.conf_threshold
+    
+    chunk_size = 1 if ramp_up else detector.max_batch_size
+    chunk = []
+    
+    for item in named_bytes:
+        chunk.append(item)
+        
+        if len(chunk) == chunk_size:
+            yield from _detect_chunk(detector, chunk, conf_threshold)
+            chunk = []
+            chunk_size = min(chunk_size * 2, detector.max_batch_size)
+    
+    if chunk:
+        yield from _detect_chunk(detector, chunk, conf_threshold)
+
+
+def _detect_chunk(detector, named_bytes, conf_threshold):
+    """Detect one chunk of encoded images with a single forward pass."""
+    cache = get_detection_cache()
+    
+    results = []
+    decoded = []
+    waiting = []
+    
+    for filename, file_bytes in named_bytes:
+        index = len(results)
+        results.append({'filename': filename})
+        
+        # Same parameters as /single, so the two endpoints share cached results
+        key = cache.make_key(
+            file_bytes,
+            detector.model_version,
+            conf_threshold=conf_threshold,
+            tiled=False,
+            imgsz=detector.imgsz
+        )
+        status, value = cache.claim(key)
+        
+        if status == cache.HIT:
+            results[index].update(_batch_entry(value))
+        elif status == cache.WAIT:
+            waiting.append((index, value))
+        else:
+            try:
+                image = detector.decode_image(file_bytes)
+                decoded.append((index, key, image))
+            except Exception as e:
+                logger.error(f"Error processing {filename}: {e}")
+                cache.fail(key, e)
+                results[index]['error'] = str(e)
+    
+    if decoded:
+        try:
+            with get_registry().acquire('yolo_detector') as replica:
+                batch_detections = replica.detect_batch(
+                    [image for _, _, image in decoded],
+                    conf_threshold,
+                    detector.imgsz
+                )
+            
+            for (index, key, image), detections in zip(decoded, batch_detections):
+                value = {
+                    'detections': detections,
+                    'image_shape': list(image.shape[:2])
+                }
+                cache.complete(key, value)
+                results[index].update(_batch_entry(value))
+        
+        except Exception as e:
+            logger.error(f"Batch inference error: {e}")
+            for index, key, _ in decoded:
+                cache.fail(key, e)
+                results[index]['error'] = str(e)
+    
+    for index, future in waiting:
+        try:
+            results[index].update(_batch_entry(future.result()))
+        except Exception as e:
+            results[index]['error'] = str(e)
+    
+    return results
+
+
+def run_batch_detection(named_bytes, conf_threshold=None, total=None, progress=None):
+    """
+    Detect urban issues in several encoded images and collect the results.
+    
+    Args:
+        named_bytes: Iterable of (filename, encoded image bytes)
+        conf_threshold: Optional confidence threshold
+        total: Number of images, reported to progress
+        progress: Optional callback progress(done, total) after each image
+    
+    Returns:
+        /api/detect/batch response body
+    """
+    results = []
+    
+    for entry in iter_batch_detection(named_bytes, conf_threshold):
+        results.append(entry)
+        if progress:
+            progress(len(results), total or len(results))
+    
+    total_detections = sum(r.get('num_detections', 0) for r in results)
+    
+    return {
+        'success': True,
+        'results': results,
+        'total_images': len(results),
+        'total_detections': total_detections
+    }
+
+
+def _run_batch_job(params, files, progress):
+    """Job handler for asynchronous /batch requests."""
+    def read_files():
+        for filename, path in files:
+            with open(path, 'rb') as f:
+                yield filename, f.read()
+    
+    return run_batch_detection(read_files(), params.get('conf_threshold'), len(files), progress)
+
+
+register_handler('detect_batch', _run_batch_job)
+
+
+def _batch_entry(value):
+    """Shape a cached detection result as a /batch result entry."""
+    return {
+        'detections': value['detections'],
+        'num_detections': len(value['detections'])
+    }
+
+
+@bp.route('/cache', methods=['GET'])
+def cache_stats():
+    """
+    Get detection result cache statistics.
+    
+    Response:
+        {
+            "hits": int,
+            "misses": int,
+            "coalesced": int,
+            "evictions": int,
+            "expirations": int,
+            "entries": int,
+            "inflight": int,
+            "hit_rate": float,
+            "max_entries": int,
+            "ttl_seconds": float
+        }
+    """
+    try:
+        return jsonify(get_detection_cache().get_stats())
+    
+    except Exception as e:
+        logger.error(f"Cache stats error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -155,7 +419,8 @@ def model_info():
             "model_path": str,
             "num_classes": int,
             "class_names": [...],
-            "default_conf_threshold": float
+            "default_conf_threshold": float,
+            "max_batch_size": int
         }
     """
     try:
@@ -163,7 +428,7 @@ def model_info():
         info = detector.get_model_info()
         
         return jsonify(info)
-        
+    
     except Exception as e:
         logger.error(f"Model info error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -3,6 +3,8 @@ Health check and system status endpoints.
 """
 
 from flask import Blueprint, jsonify
+from app.services.model_registry import get_registry
+from app.services.job_queue import get_job_queue
 import logging
 import os
 
@@ -16,9 +18,13 @@ def health_check():
     """
     Health check endpoint.
     
+    Returns 503 with status "warming_up" (or "unhealthy" if warm-up failed)
+    until model warm-up started by MODEL_WARMUP has finished.
+    
     Response:
         {
             "status": "healthy",
+            "ready": bool,
             "version": "1.0.0",
             "services": {
                 "yolo_detector": bool,
@@ -60,8 +66,28 @@ def health_check():
             logger.error(f"GeoReportClient check failed: {e}")
             services_status['georeport_client'] = False
         
+        registry = get_registry()
+        
+        if registry.warmup_state == registry.WARMUP_FAILED:
+            return jsonify({
+                'status': 'unhealthy',
+                'ready': False,
+                'version': '1.0.0',
+                'services': services_status,
+                'error': f"Model warm-up failed: {registry.warmup_error}"
+            }), 503
+        
+        if not registry.is_ready():
+            return jsonify({
+                'status': 'warming_up',
+                'ready': False,
+                'version': '1.0.0',
+                'services': services_status
+            }), 503
+        
         return jsonify({
             'status': 'healthy',
+            'ready': True,
             'version': '1.0.0',
             'services': services_status
         })
@@ -87,7 +113,11 @@ def system_status():
                 "tagging": {...},
                 "multiframe": {...},
                 "georeport": {...}
-            }
+            },
+            "models": {
+                "<name>": {"loaded": bool, "replicas": int, "in_use": int, ...}
+            },
+            "jobs": {"queued": int, "running": int, "succeeded": int, "failed": int, ...}
         }
     """
     try:
@@ -116,7 +146,9 @@ def system_status():
         
         return jsonify({
             'status': 'operational',
-            'components': components
+            'components': components,
+            'models': get_registry().get_stats(),
+            'jobs': get_job_queue().get_stats()
         })
         
     except Exception as e:
@@ -145,6 +177,8 @@ def root():
             'detection': {
                 'single': 'POST /api/detect/single',
                 'batch': 'POST /api/detect/batch',
+                'batch_stream': 'POST /api/detect/batch (Accept: application/x-ndjson)',
+                'cache': 'GET /api/detect/cache',
                 'info': 'GET /api/detect/info'
             },
             'tagging': {
@@ -156,7 +190,16 @@ def root():
             'multiframe': {
                 'analyze': 'POST /api/multiframe/analyze',
                 'analyze_detections': 'POST /api/multiframe/analyze-detections',
-                'validate': 'POST /api/multiframe/validate'
+                'analyze_video': 'POST /api/multiframe/analyze-video',
+                'validate': 'POST /api/multiframe/validate',
+                'open_session': 'POST /api/multiframe/sessions',
+                'session_frames': 'POST /api/multiframe/sessions/<session_id>/frames',
+                'session_status': 'GET /api/multiframe/sessions/<session_id>',
+                'discard_session': 'DELETE /api/multiframe/sessions/<session_id>',
+                'finalize_session': 'POST /api/multiframe/sessions/<session_id>/finalize'
+            },
+            'artifacts': {
+                'annotated_image': 'GET /api/artifacts/<hash>'
             },
             'georeport': {
                 'submit': 'POST /api/georeport/submit',
@@ -166,6 +209,10 @@ def root():
                 'services': 'GET /api/georeport/services',
                 'auto_route': 'POST /api/georeport/auto-route'
             },
+            'jobs': {
+                'status': 'GET /api/jobs/<job_id>',
+                'result': 'GET /api/jobs/<job_id>/result'
+            },
             'health': {
                 'health': 'GET /api/health',
                 'status': 'GET /api/status'
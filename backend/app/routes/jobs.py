@@ -0,0 +1,96 @@
+"""
+Background job endpoints for asynchronous batch and video analysis.
+"""
+
+from flask import Blueprint, jsonify
+from app.services.job_queue import get_job_queue, QueueFullError
+import logging
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+
+def submit_job(kind, params, files):
+    """
+    Queue a background job and build the 202 response pointing at it.
+    
+    Args:
+        kind: Registered job kind
+        params: JSON-serializable job parameters
+        files: List of (filename, bytes or file object) inputs
+    
+    Returns:
+        Flask response tuple
+    """
+    try:
+        job_id = get_job_queue().submit(kind, params, files)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}',
+        'result_url': f'/api/jobs/{job_id}/result'
+    }), 202
+
+
+@bp.route('/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Get the status and progress of a background job.
+    
+    Response:
+        {
+            "job_id": str,
+            "kind": "detect_batch" | "analyze_video",
+            "status": "queued" | "running" | "succeeded" | "failed",
+            "progress": {"done": int, "total": int, "fraction": float},
+            "error": str | null,
+            "created_at": float,
+            "started_at": float | null,
+            "finished_at": float | null
+        }
+    """
+    try:
+        job = get_job_queue().get(job_id)
+        
+        if job is None:
+            return jsonify({'error': f'Job {job_id} not found'}), 404
+        
+        return jsonify(job)
+    
+    except Exception as e:
+        logger.error(f"Job status error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """
+    Get the result of a background job.
+    
+    Returns the response body the synchronous endpoint would have returned
+    once the job has succeeded, 202 with the job status while it is queued or
+    running, and 500 with the error if it failed.
+    """
+    try:
+        queue = get_job_queue()
+        job = queue.get(job_id)
+        
+        if job is None:
+            return jsonify({'error': f'Job {job_id} not found'}), 404
+        
+        if job['status'] == queue.FAILED:
+            return jsonify({'error': job['error'], 'job_id': job_id, 'status': job['status']}), 500
+        
+        if job['status'] != queue.SUCCEEDED:
+            return jsonify(job), 202
+        
+        return jsonify(queue.get_result(job_id))
+    
+    except Exception as e:
+        logger.error(f"Job result error: {e}")
+        return jsonify({'error': str(e)}), 500
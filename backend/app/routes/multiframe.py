@@ -4,39 +4,230 @@ Multi-frame analysis endpoints for spatial correlation and validation.
 
 from flask import Blueprint, request, jsonify
 from app.services.multiframe_analyzer import MultiFrameAnalyzer
-from app.services.yolo_detector import YOLODetector
-from app.services.rag_tagger import RAGTagger
+from app.services.video_pipeline import VideoPipeline
+from app.services.optical_flow import KeyframeDetector
+from app.services.model_registry import get_registry
+from app.services.job_queue import register_handler
+from app.services.upload_sessions import get_session_store, SessionLimitError
+from app.services.artifact_store import get_artifact_store, register_renderer
+from app.services.detection_set import DetectionSet
+from app.routes.artifacts import artifact_url
+from app.routes.jobs import submit_job
+from werkzeug.utils import secure_filename
 import logging
 import cv2
 import numpy as np
 import tempfile
+import threading
 import os
-import base64
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('multiframe', __name__, url_prefix='/api/multiframe')
 
-_analyzer = None
-_detector = None
+VIDEO_ANNOTATE_WORKERS = int(os.getenv('VIDEO_ANNOTATE_WORKERS', 2))
 
-def get_analyzer():
-    """Get or create MultiFrameAnalyzer instance."""
-    global _analyzer
-    if _analyzer is None:
-        _analyzer = MultiFrameAnalyzer()
-    return _analyzer
+# Frames a multi-frame cluster stays open without a match (unset: whole request)
+MULTIFRAME_WINDOW = int(os.getenv('MULTIFRAME_WINDOW', 0)) or None
+
+VIDEO_SAMPLING_MODES = ('interval', 'scene')
+
+# Seconds finalizing an upload session waits for frames still being detected
+SESSION_FINALIZE_TIMEOUT = float(os.getenv('UPLOAD_SESSION_FINALIZE_TIMEOUT', 60))
+
+# Annotated images are JPEGs of this width, rendered when their URL is fetched
+ANNOTATED_IMAGE_WIDTH = 800
+ANNOTATED_IMAGE_QUALITY = 70
+
+# Part of every annotated image's artifact key; bump when rendering changes
+ANNOTATED_IMAGE_VERSION = 2
+
+# JPEG decode scales tried, largest first, when rendering uploaded photos
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+)
+
+_annotation_buffers = threading.local()
+
+_analyzers = {}
+
+def get_analyzer(matching='cluster'):
+    """Get or create the MultiFrameAnalyzer instance for a matching mode."""
+    if matching not in _analyzers:
+        _analyzers[matching] = MultiFrameAnalyzer(matching=matching, window=MULTIFRAME_WINDOW)
+    return _analyzers[matching]
+
+def invalid_matching(matching):
+    """Build the 400 response for an unknown matching mode, or None if it is valid."""
+    if matching not in MultiFrameAnalyzer.MATCHING_MODES:
+        return jsonify({
+            'error': f"matching must be one of {', '.join(MultiFrameAnalyzer.MATCHING_MODES)}"
+        }), 400
+    return None
 
 def get_detector():
-    """Get or create YOLODetector instance."""
-    global _detector
-    if _detector is None:
-        _detector = YOLODetector()
-    return _detector
+    """Get the shared YOLODetector from the model registry."""
+    return get_registry().get('yolo_detector')
+
+def get_scheduler():
+    """Get the micro-batching InferenceScheduler for the shared detector."""
+    return get_registry().scheduler('yolo_detector')
 
 def get_tagger():
-    """Get or create RAGTagger instance."""
-    return RAGTagger(use_vector_db=False)
+    """Get the shared RAGTagger from the model registry."""
+    return get_registry().get('rag_tagger')
+
+def parse_location(location_str):
+    """Parse the optional location form field, or None if missing or malformed."""
+    if not location_str:
+        return None
+    
+    import json
+    try:
+        return json.loads(location_str)
+    except:
+        logger.warning("Failed to parse location JSON")
+        return None
+
+def decode_for_annotation(data, width):
+    """
+    Decode an uploaded image at the smallest JPEG scale still wider than annotated images.
+    
+    Args:
+        data: Encoded image bytes as uploaded
+        width: Full-resolution width of the image
+    
+    Returns:
+        Decoded image, downscaled by 2, 4 or 8 where possible
+    """
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if width // factor >= ANNOTATED_IMAGE_WIDTH:
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+            if image is not None:
+                return image
+    
+    from app.services.yolo_detector import YOLODetector
+    return YOLODetector.decode_image(data)
+
+def annotation_buffer(shape):
+    """Get this thread's reusable image buffer for annotated images of a shape."""
+    buffer = getattr(_annotation_buffers, 'image', None)
+    
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, dtype=np.uint8)
+        _annotation_buffers.image = buffer
+    
+    return buffer
+
+def render_annotated_image(source, detections, source_shape):
+    """
+    Draw detections on a frame and encode it as an ANNOTATED_IMAGE_WIDTH wide JPEG.
+    
+    The frame is downscaled first and the boxes are scaled to match, so
+    drawing and encoding only touch output-sized pixels, in a buffer reused
+    by the rendering thread. No model is loaded, so any worker can render.
+    
+    Args:
+        source: Encoded image bytes as uploaded, or a decoded frame
+        detections: DetectionSet in source_shape coordinates
+        source_shape: Shape of the frame detections were run on
+    
+    Returns:
+        JPEG bytes
+    """
+    height, width = source_shape[:2]
+    image = decode_for_annotation(source, width) if isinstance(source, bytes) else source
+    
+    size = (ANNOTATED_IMAGE_WIDTH, int(ANNOTATED_IMAGE_WIDTH * height / width))
+    annotated = annotation_buffer((size[1], size[0], 3))
+    
+    if image.shape[:2] == annotated.shape[:2]:
+        np.copyto(annotated, image)
+    else:
+        interpolation = cv2.INTER_AREA if image.shape[1] > size[0] else cv2.INTER_LINEAR
+        cv2.resize(image, size, dst=annotated, interpolation=interpolation)
+    
+    scaled = detections.copy()
+    scaled.boxes = scaled.boxes * (ANNOTATED_IMAGE_WIDTH / width)
+    from app.services.yolo_detector import YOLODetector
+    YOLODetector.annotate_image(annotated, scaled, copy=False)
+    
+    _, buffer = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, ANNOTATED_IMAGE_QUALITY])
+    return buffer.tobytes()
+
+def annotated_image_url(source, detections, source_shape, source_key=None):
+    """
+    Register a frame's annotated image for rendering on first fetch, by any worker.
+    
+    Args:
+        source: Encoded image bytes as uploaded, or a decoded frame
+        detections: DetectionSet in source_shape coordinates
+        source_shape: Shape of the frame detections were run on
+        source_key: Optional precomputed ArtifactStore.make_key(source)
+    
+    Returns:
+        URL of the annotated image
+    """
+    store = get_artifact_store()
+    
+    if isinstance(source, bytes):
+        frame_shape = None
+        source_key = source_key or store.make_key(source)
+    else:
+        frame_shape = list(source.shape)
+        source = source.tobytes()
+        source_key = source_key or store.make_key(str(tuple(frame_shape)).encode(), source)
+    
+    key = store.make_key(
+        source_key.encode(),
+        f"{ANNOTATED_IMAGE_VERSION}:{ANNOTATED_IMAGE_WIDTH}:{ANNOTATED_IMAGE_QUALITY}".encode(),
+        detections.boxes.tobytes(),
+        detections.scores.tobytes(),
+        '\n'.join(detections.names()).encode()
+    )
+    
+    store.register(key, 'annotated_image', source, {
+        'boxes': detections.boxes.tolist(),
+        'scores': detections.scores.tolist(),
+        'names': detections.names(),
+        'source_shape': list(source_shape),
+        'frame_shape': frame_shape
+    })
+    
+    return artifact_url(key)
+
+def render_annotated_artifact(source, meta):
+    """Render an annotated image registered by annotated_image_url, possibly in another process."""
+    if meta['frame_shape']:
+        source = np.frombuffer(source, np.uint8).reshape(meta['frame_shape'])
+    
+    detections = DetectionSet.from_dicts(
+        {'bbox': box, 'class_name': name, 'confidence': score}
+        for box, name, score in zip(meta['boxes'], meta['names'], meta['scores'])
+    )
+    
+    return render_annotated_image(source, detections, meta['source_shape'])
+
+def annotated_video_frame_url(frame, detections):
+    """
+    Keep a downscaled copy of a video frame and register its annotated image.
+    
+    Only ANNOTATED_IMAGE_WIDTH wide copies of the frames outlive the video
+    pipeline, with the detections scaled to match.
+    """
+    scale = ANNOTATED_IMAGE_WIDTH / frame.shape[1]
+    thumbnail = cv2.resize(
+        frame,
+        (ANNOTATED_IMAGE_WIDTH, int(frame.shape[0] * scale)),
+        interpolation=cv2.INTER_AREA
+    )
+    
+    scaled = detections.copy()
+    scaled.boxes = scaled.boxes * scale
+    
+    return annotated_image_url(thumbnail, scaled, thumbnail.shape)
 
 
 @bp.route('/analyze', methods=['POST'])
@@ -48,13 +239,15 @@ def analyze_frames():
         - files: Multiple image files (multipart/form-data)
         - conf_threshold: Optional confidence threshold
         - min_frames_for_validation: Minimum frames needed to validate (default: 2)
+        - matching: Optional "cluster" (default) or "track" to link detections
+          by assignment between consecutive frames
         - location: Optional JSON string with {lat, lon, address}
-        
+    
     Response:
         {
             "success": true,
             "validated_detections": [...],
-            "annotated_images": ["data:image/jpeg;base64,..."],
+            "annotated_images": ["/api/artifacts/<hash>", ...],
             "statistics": {
                 "num_frames": int,
                 "total_detections_before": int,
@@ -76,36 +269,50 @@ def analyze_frames():
         
         conf_threshold = request.form.get('conf_threshold', type=float)
         min_frames = request.form.get('min_frames_for_validation', type=int, default=2)
+        matching = request.form.get('matching', 'cluster')
         location_str = request.form.get('location')
         
-        location = None
-        if location_str:
-            import json
-            try:
-                location = json.loads(location_str)
-            except:
-                logger.warning("Failed to parse location JSON")
+        error = invalid_matching(matching)
+        if error:
+            return error
+        
+        location = parse_location(location_str)
         
         detector = get_detector()
-        analyzer = MultiFrameAnalyzer(min_frames_for_validation=min_frames)
+        scheduler = get_scheduler()
+        analyzer = MultiFrameAnalyzer(
+            min_frames_for_validation=min_frames,
+            matching=matching,
+            window=MULTIFRAME_WINDOW
+        )
         tagger = get_tagger()
         
-        frame_detections = []
-        frame_images = []
+        pending = []
         
         for file in files:
             if file.filename == '':
                 continue
             
             try:
-                file_bytes = file.read()
-                detections, image = detector.detect_from_bytes(file_bytes, conf_threshold)
-                frame_detections.append(detections)
-                frame_images.append(image)
+                data = file.read()
+                image = detector.decode_image(data)
+                pending.append((file.filename, data, image.shape, scheduler.submit(image, conf_threshold)))
             except Exception as e:
                 logger.error(f"Error processing frame {file.filename}: {e}")
                 continue
         
+        frame_detections = []
+        annotated_images = []
+        
+        for filename, data, shape, future in pending:
+            try:
+                detections = future.result()
+                frame_detections.append(detections)
+                annotated_images.append(annotated_image_url(data, detections, shape))
+            except Exception as e:
+                logger.error(f"Error processing frame {filename}: {e}")
+                continue
+        
         if not frame_detections:
             return jsonify({'error': 'No valid frames processed'}), 400
         
@@ -115,26 +322,287 @@ def analyze_frames():
         if validated_detections and location:
             validated_detections = tagger.enrich_multiple_detections(validated_detections, location)
         
+        return jsonify({
+            'success': True,
+            'validated_detections': validated_detections.to_dicts(),
+            'annotated_images': annotated_images,
+            **{k: v for k, v in results.items() if k != 'validated_detections'}
+        })
+    
+    except Exception as e:
+        logger.error(f"Multi-frame analysis error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/sessions', methods=['POST'])
+def open_session():
+    """
+    Open a progressive multi-frame upload session.
+    
+    Frames posted to the session are detected as soon as they arrive, so
+    finalizing only runs the cross-frame validation. Sessions expire after
+    UPLOAD_SESSION_TTL seconds without activity.
+    
+    Request:
+        - conf_threshold: Optional confidence threshold
+        - min_frames_for_validation: Minimum frames needed to validate (default: 2)
+        - matching: Optional "cluster" (default) or "track"
+        - location: Optional JSON string with {lat, lon, address}
+    
+    Response (201):
+        {
+            "success": true,
+            "session_id": str,
+            "expires_in": float,
+            "max_frames": int,
+            "frames_url": str,
+            "finalize_url": str
+        }
+    """
+    try:
+        matching = request.form.get('matching', 'cluster')
+        
+        error = invalid_matching(matching)
+        if error:
+            return error
+        
+        params = {
+            'conf_threshold': request.form.get('conf_threshold', type=float),
+            'min_frames_for_validation': request.form.get('min_frames_for_validation', type=int, default=2),
+            'matching': matching,
+            'location': parse_location(request.form.get('location'))
+        }
+        
+        store = get_session_store()
+        
+        try:
+            session = store.create(params)
+        except SessionLimitError as e:
+            return jsonify({'error': str(e)}), 503
+        
+        return jsonify({
+            'success': True,
+            'session_id': session['id'],
+            'expires_in': store.ttl_seconds,
+            'max_frames': session['max_frames'],
+            'frames_url': f"/api/multiframe/sessions/{session['id']}/frames",
+            'finalize_url': f"/api/multiframe/sessions/{session['id']}/finalize"
+        }), 201
+    
+    except Exception as e:
+        logger.error(f"Session open error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/sessions/<session_id>/frames', methods=['POST'])
+def upload_session_frames(session_id):
+    """
+    Add frames to an upload session and start processing them.
+    
+    Returns as soon as the frames are decoded and queued for detection. A
+    request that would take the session past its max_frames is refused as a
+    whole, before any of its frames is processed.
+    
+    Request:
+        - files: One or more image files (multipart/form-data)
+    
+    Response (202):
+        {
+            "success": true,
+            "session_id": str,
+            "frame_indices": [int],
+            "num_frames": int
+        }
+    """
+    try:
+        sessions = get_session_store()
+        session = sessions.get(session_id)
+        
+        if session is None:
+            return jsonify({'error': f'Session {session_id} not found or expired'}), 404
+        
+        files = [file for file in request.files.getlist('files') if file.filename != '']
+        
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
+        
+        if session['num_frames'] + len(files) > session['max_frames']:
+            return jsonify({
+                'error': f"Session holds {session['num_frames']} of at most {session['max_frames']} frames; "
+                         f"cannot add {len(files)} more"
+            }), 400
+        
+        detector = get_detector()
+        scheduler = get_scheduler()
+        store = get_artifact_store()
+        
+        frames = []
+        
+        for file in files:
+            try:
+                data = file.read()
+                frames.append((data, detector.decode_image(data)))
+            except Exception as e:
+                logger.error(f"Error decoding frame {file.filename}: {e}")
+                continue
+        
+        if not frames:
+            return jsonify({'error': 'No valid frames uploaded'}), 400
+        
+        # Reserve every place before submitting anything, so a full session
+        # never leaves part of the request being detected
+        try:
+            frame_indices = sessions.add_frames(session_id, len(frames))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if frame_indices is None:
+            return jsonify({'error': f'Session {session_id} not found or expired'}), 404
+        
+        for index, (data, image) in zip(frame_indices, frames):
+            sessions.process_frame(
+                session_id,
+                index,
+                scheduler.submit(image, session['params']['conf_threshold']),
+                session_frame_result(data, image.shape, store.make_key(data))
+            )
+        
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'frame_indices': frame_indices,
+            'num_frames': frame_indices[-1] + 1
+        }), 202
+    
+    except Exception as e:
+        logger.error(f"Session upload error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@bp.route('/sessions/<session_id>', methods=['GET'])
+def session_status(session_id):
+    """
+    Get the upload and processing progress of a session.
+    
+    Response:
+        {
+            "session_id": str,
+            "num_frames": int,
+            "frames_processed": int,
+            "max_frames": int,
+            "created_at": float
+        }
+    """
+    status = get_session_store().get_status(session_id)
+    
+    if status is None:
+        return jsonify({'error': f'Session {session_id} not found or expired'}), 404
+    
+    return jsonify(status)
+
+
+@bp.route('/sessions/<session_id>', methods=['DELETE'])
+def discard_session(session_id):
+    """Discard a session and cancel its pending frames."""
+    if get_session_store().pop(session_id, finalized=False) is None:
+        return jsonify({'error': f'Session {session_id} not found or expired'}), 404
+    
+    return jsonify({'success': True, 'session_id': session_id})
+
+
+@bp.route('/sessions/<session_id>/finalize', methods=['POST'])
+def finalize_session(session_id):
+    """
+    Run multi-frame analysis over the frames of a session and close it.
+    
+    Waits up to UPLOAD_SESSION_FINALIZE_TIMEOUT seconds for any frame still
+    being processed, then validates detections across frames from the stored
+    per-frame results. A session with fewer than 2 frames, or whose frames are
+    still being processed after the wait, stays open.
+    
+    Response: same as /api/multiframe/analyze, plus "session_id"
+    """
+    try:
+        store = get_session_store()
+        session = store.get(session_id)
+        
+        if session is None:
+            return jsonify({'error': f'Session {session_id} not found or expired'}), 404
+        
+        if session['num_frames'] < 2:
+            return jsonify({'error': 'At least 2 frames required for multi-frame analysis'}), 400
+        
+        if not store.wait(session_id, SESSION_FINALIZE_TIMEOUT):
+            return jsonify({'error': 'Frames are still being processed; try again'}), 503
+        
+        closed = store.pop(session_id)
+        if closed is None:
+            return jsonify({'error': f'Session {session_id} not found or expired'}), 404
+        
+        session, frames = closed
+        
+        frame_detections = []
         annotated_images = []
-        for image, detections in zip(frame_images, frame_detections):
-            annotated = detector.annotate_image(image, detections)
-            resized = cv2.resize(annotated, (800, int(800 * annotated.shape[0] / annotated.shape[1])))
-            _, buffer = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            base64_image = base64.b64encode(buffer).decode('utf-8')
-            annotated_images.append(f"data:image/jpeg;base64,{base64_image}")
+        
+        for frame in frames:
+            if frame['status'] != store.DONE:
+                logger.error(
+                    f"Error processing frame {frame['index']} of session {session_id}: "
+                    f"{frame['error'] or 'not processed in time'}"
+                )
+                continue
+            
+            frame_detections.append(frame['detections'])
+            annotated_images.append(frame['annotated_image'])
+        
+        if not frame_detections:
+            return jsonify({'error': 'No valid frames processed'}), 400
+        
+        params = session['params']
+        analyzer = MultiFrameAnalyzer(
+            min_frames_for_validation=params['min_frames_for_validation'],
+            matching=params['matching'],
+            window=MULTIFRAME_WINDOW
+        )
+        
+        results = analyzer.analyze_frames(frame_detections)
+        
+        validated_detections = results['validated_detections']
+        if validated_detections and params['location']:
+            validated_detections = get_tagger().enrich_multiple_detections(validated_detections, params['location'])
         
         return jsonify({
             'success': True,
-            'validated_detections': validated_detections,
+            'session_id': session_id,
+            'validated_detections': validated_detections.to_dicts(),
             'annotated_images': annotated_images,
             **{k: v for k, v in results.items() if k != 'validated_detections'}
         })
-        
+    
     except Exception as e:
-        logger.error(f"Multi-frame analysis error: {e}")
+        logger.error(f"Session finalize error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+def session_frame_result(data, shape, source_key):
+    """
+    Build the callback recording a session frame once its detection resolves.
+    
+    Args:
+        data: Encoded frame as uploaded
+        shape: Shape of the decoded frame
+        source_key: ArtifactStore.make_key(data), computed off the scheduler thread
+    
+    Returns:
+        Callable taking the frame's DetectionSet and returning (detection dicts,
+        annotated image URL)
+    """
+    def finish(detections):
+        return detections.to_dicts(), annotated_image_url(data, detections, shape, source_key)
+    
+    return finish
+
+
 @bp.route('/analyze-detections', methods=['POST'])
 def analyze_detections():
     """
@@ -150,9 +618,10 @@ def analyze_detections():
             "frame_metadata": [
                 {"timestamp": str, "angle": str, ...},
                 ...
-            ]
+            ],
+            "matching": "cluster" | "track"
         }
-        
+    
     Response:
         {
             "success": true,
@@ -172,15 +641,21 @@ def analyze_detections():
         if len(frame_detections) < 2:
             return jsonify({'error': 'At least 2 frames required for multi-frame analysis'}), 400
         
-        analyzer = get_analyzer()
+        matching = data.get('matching', 'cluster')
+        error = invalid_matching(matching)
+        if error:
+            return error
+        
+        analyzer = get_analyzer(matching)
         
         results = analyzer.analyze_frames(frame_detections, frame_metadata)
         
         return jsonify({
             'success': True,
-            **results
+            **results,
+            'validated_detections': results['validated_detections'].to_dicts()
         })
-        
+    
     except Exception as e:
         logger.error(f"Detection analysis error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -196,7 +671,7 @@ def validate_detection():
             "frame_detections": [...],
             "target_detection": {...}
         }
-        
+    
     Response:
         {
             "success": true,
@@ -232,9 +707,9 @@ def validate_detection():
             'success': True,
             'validated': validated,
             'num_matching_frames': matching_frames,
-            'all_validated_detections': results['validated_detections']
+            'all_validated_detections': results['validated_detections'].to_dicts()
         })
-        
+    
     except Exception as e:
         logger.error(f"Validation error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -248,15 +723,25 @@ def analyze_video():
     Request:
         - video: Video file (multipart/form-data)
         - conf_threshold: Optional confidence threshold
-        - frame_interval: Optional frame extraction interval in seconds (default: 0.5)
+        - frame_interval: Optional frame extraction interval in seconds (default: 0.5);
+          the minimum spacing between frames with sampling=scene
         - max_frames: Optional maximum number of frames to extract (default: 10)
+        - sampling: Optional "interval" (default) for fixed spacing or "scene" to
+          keep frames whose content changed
+        - max_interval: Optional maximum spacing in seconds with sampling=scene
+          (default: 4 * frame_interval)
+        - keyframe_interval: Optional N to run the detector on every Nth sampled
+          frame only and carry boxes to the frames between with optical flow
+          (default: 1, detect every frame)
+        - matching: Optional "cluster" (default) or "track"
         - location: Optional JSON string with {lat, lon, address}
-        
+        - async: Optional "true" to queue a background job and return 202 with its id
+    
     Response:
         {
             "success": true,
             "validated_detections": [...],
-            "annotated_images": ["data:image/jpeg;base64,..."],
+            "annotated_images": ["/api/artifacts/<hash>", ...],
             "statistics": {
                 "num_frames": int,
                 "total_detections_before": int,
@@ -264,7 +749,9 @@ def analyze_video():
                 "false_positive_reduction_rate": float,
                 "detections_by_class": {...},
                 "avg_confidence": float
-            }
+            },
+            "keyframes": {"interval": int, "detected": int, "propagated": int}
+                (only with keyframe_interval > 1)
         }
     """
     try:
@@ -279,15 +766,40 @@ def analyze_video():
         conf_threshold = request.form.get('conf_threshold', type=float)
         frame_interval = request.form.get('frame_interval', type=float, default=0.5)
         max_frames = request.form.get('max_frames', type=int, default=10)
+        sampling = request.form.get('sampling', 'interval')
+        max_interval = request.form.get('max_interval', type=float)
+        keyframe_interval = request.form.get('keyframe_interval', type=int, default=1)
+        matching = request.form.get('matching', 'cluster')
         location_str = request.form.get('location')
         
-        location = None
-        if location_str:
-            import json
-            try:
-                location = json.loads(location_str)
-            except:
-                logger.warning("Failed to parse location JSON")
+        error = invalid_matching(matching)
+        if error:
+            return error
+        
+        if sampling not in VIDEO_SAMPLING_MODES:
+            return jsonify({'error': f"sampling must be one of {', '.join(VIDEO_SAMPLING_MODES)}"}), 400
+        
+        if keyframe_interval < 1:
+            return jsonify({'error': 'keyframe_interval must be at least 1'}), 400
+        
+        location = parse_location(location_str)
+        
+        if request.form.get('async', 'false').lower() == 'true':
+            params = {
+                'conf_threshold': conf_threshold,
+                'frame_interval': frame_interval,
+                'max_frames': max_frames,
+                'location': location,
+                'matching': matching,
+                'sampling': sampling,
+                'max_interval': max_interval,
+                'keyframe_interval': keyframe_interval
+            }
+            return submit_job(
+                'analyze_video',
+                params,
+                [(secure_filename(video_file.filename) or 'video.mp4', video_file.stream)]
+            )
         
         temp_video = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
         try:
@@ -295,105 +807,379 @@ def analyze_video():
             temp_video.close()
             
             logger.info(f"Extracting frames from video: {video_file.filename}")
-            frames = extract_frames_from_video(temp_video.name, frame_interval, max_frames)
-            
-            if len(frames) < 2:
-                return jsonify({'error': 'Could not extract enough frames from video (minimum 2 required)'}), 400
-            
-            logger.info(f"Extracted {len(frames)} frames from video")
-            
-            detector = get_detector()
-            analyzer = get_analyzer()
-            tagger = get_tagger()
-            
-            frame_detections = []
-            for i, frame in enumerate(frames):
-                try:
-                    _, buffer = cv2.imencode('.jpg', frame)
-                    frame_bytes = buffer.tobytes()
-                    
-                    detections, _ = detector.detect_from_bytes(frame_bytes, conf_threshold)
-                    frame_detections.append(detections)
-                    logger.info(f"Frame {i+1}: {len(detections)} detections")
-                except Exception as e:
-                    logger.error(f"Error processing frame {i}: {e}")
-                    continue
-            
-            if not frame_detections:
-                return jsonify({'error': 'No valid frames processed'}), 400
-            
-            results = analyzer.analyze_frames(frame_detections)
-            
-            validated_detections = results['validated_detections']
-            if validated_detections and location:
-                validated_detections = tagger.enrich_multiple_detections(validated_detections, location)
-            
-            annotated_images = []
-            for frame, detections in zip(frames, frame_detections):
-                annotated = detector.annotate_image(frame, detections)
-                resized = cv2.resize(annotated, (800, int(800 * annotated.shape[0] / annotated.shape[1])))
-                _, buffer = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                base64_image = base64.b64encode(buffer).decode('utf-8')
-                annotated_images.append(f"data:image/jpeg;base64,{base64_image}")
-            
-            return jsonify({
-                'success': True,
-                'validated_detections': validated_detections,
-                'annotated_images': annotated_images,
-                **{k: v for k, v in results.items() if k != 'validated_detections'}
-            })
             
+            return jsonify(run_video_analysis(
+                temp_video.name, conf_threshold, frame_interval, max_frames, location,
+                matching=matching,
+                sampling=sampling,
+                max_interval=max_interval,
+                keyframe_interval=keyframe_interval
+            ))
+        
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         finally:
             if os.path.exists(temp_video.name):
                 os.unlink(temp_video.name)
-        
+    
     except Exception as e:
         logger.error(f"Video analysis error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
-def extract_frames_from_video(video_path, frame_interval=0.5, max_frames=10):
+def run_video_analysis(
+    video_path,
+    conf_threshold=None,
+    frame_interval=0.5,
+    max_frames=10,
+    location=None,
+    progress=None,
+    matching='cluster',
+    sampling='interval',
+    max_interval=None,
+    keyframe_interval=1
+):
     """
-    Extract frames from a video file.
+    Extract frames from a video file, detect on each and run multi-frame analysis.
+    
+    Args:
+        video_path: Path to video file
+        conf_threshold: Optional confidence threshold
+        frame_interval: Time interval between frames in seconds (minimum spacing
+            for scene sampling)
+        max_frames: Maximum number of frames to extract
+        location: Optional {lat, lon, address} used to enrich validated detections
+        progress: Optional callback progress(done, total) after each batch of frames
+        matching: Multi-frame matching mode, "cluster" or "track"
+        sampling: "interval" for fixed spacing or "scene" for scene-change sampling
+        max_interval: Maximum spacing in seconds for scene sampling
+            (default: 4 * frame_interval)
+        keyframe_interval: Detect every Nth frame and propagate boxes to the
+            others with optical flow
+    
+    Returns:
+        /api/multiframe/analyze-video response body
+    
+    Raises:
+        ValueError: If the video cannot be read or yields too few usable frames
+    """
+    # Scene sampling never keeps frames closer than frame_interval, so this
+    # is an upper bound for it
+    expected_frames = count_video_samples(video_path, frame_interval, max_frames)
+    
+    if expected_frames is not None and expected_frames < 2:
+        raise ValueError('Could not extract enough frames from video (minimum 2 required)')
+    
+    if sampling == 'scene':
+        frames = iter_scene_frames(
+            video_path,
+            min_interval=frame_interval,
+            max_interval=max_interval or 4 * frame_interval,
+            max_frames=max_frames
+        )
+    else:
+        frames = iter_video_frames(video_path, frame_interval, max_frames)
+    
+    detector = get_detector()
+    analyzer = get_analyzer(matching)
+    tagger = get_tagger()
+    
+    def detect(frames):
+        with get_registry().acquire('yolo_detector') as replica:
+            return replica.detect_sets(frames, conf_threshold)
+    
+    keyframes = None
+    if keyframe_interval > 1:
+        keyframes = KeyframeDetector(detect, keyframe_interval)
+    
+    # Decoding, batched detection and annotation overlap; only a few batches
+    # of full-resolution frames are held at any time
+    pipeline = VideoPipeline(
+        keyframes or detect,
+        annotated_video_frame_url,
+        batch_size=detector.max_batch_size,
+        annotate_workers=VIDEO_ANNOTATE_WORKERS
+    )
+    frame_detections, annotated_images = pipeline.run(
+        frames,
+        progress=progress,
+        total=expected_frames
+    )
+    
+    logger.info(f"Detected on {len(frame_detections)} frames from video")
+    
+    if not frame_detections:
+        raise ValueError('No valid frames processed')
+    
+    # Scene sampling and failed batches can leave fewer frames than expected
+    if len(frame_detections) < 2:
+        raise ValueError('Could not extract enough frames from video (minimum 2 required)')
+    
+    results = analyzer.analyze_frames(frame_detections)
+    
+    validated_detections = results['validated_detections']
+    if validated_detections and location:
+        validated_detections = tagger.enrich_multiple_detections(validated_detections, location)
+    
+    response = {
+        'success': True,
+        'validated_detections': validated_detections.to_dicts(),
+        'annotated_images': annotated_images,
+        **{k: v for k, v in results.items() if k != 'validated_detections'}
+    }
+    
+    if keyframes:
+        response['keyframes'] = {
+            'interval': keyframe_interval,
+            'detected': keyframes.keyframes,
+            'propagated': keyframes.propagated
+        }
+    
+    return response
+
+
+def _run_video_job(params, files, progress):
+    """Job handler for asynchronous /analyze-video requests."""
+    _, video_path = files[0]
+    
+    return run_video_analysis(
+        video_path,
+        params.get('conf_threshold'),
+        params.get('frame_interval', 0.5),
+        params.get('max_frames', 10),
+        params.get('location'),
+        progress,
+        params.get('matching', 'cluster'),
+        params.get('sampling', 'interval'),
+        params.get('max_interval'),
+        params.get('keyframe_interval', 1)
+    )
+
+
+register_handler('analyze_video', _run_video_job)
+register_renderer('annotated_image', render_annotated_artifact)
+
+
+# Codecs that store every frame as a keyframe, so a seek costs one decode
+INTRA_ONLY_CODECS = {'MJPG', 'mjpg', 'jpeg', 'png ', 'MPNG', 'apch', 'apcn', 'apcs', 'apco', 'ap4h', 'FFV1'}
+
+# Frames skipped per sample beyond which a seek is cheaper than grabbing every
+# frame: for intra-only codecs the fixed cost of a seek outweighs about a
+# second of grabs, for inter-coded video a seek decodes from the previous
+# keyframe (x264's default GOP is 250 frames)
+INTRA_SEEK_MIN_FRAME_SKIP = 30
+SEEK_MIN_FRAME_SKIP = 250
+
+
+def get_video_codec(cap):
+    """Get the FourCC code of an opened cv2.VideoCapture as a string."""
+    fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+    return ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4))
+
+
+def get_video_fps(cap):
+    """Get the frame rate of an opened cv2.VideoCapture."""
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if fps == 0:
+        fps = 30  # Default to 30 fps if unable to get fps
+    
+    return fps
+
+
+def get_frame_skip(cap, frame_interval):
+    """Get the number of frames between samples taken every frame_interval seconds."""
+    return max(1, int(get_video_fps(cap) * frame_interval))
+
+
+def count_video_samples(video_path, frame_interval=0.5, max_frames=10):
+    """
+    Estimate how many frames iter_video_frames will yield from the container header.
     
     Args:
         video_path: Path to video file
         frame_interval: Time interval between frames in seconds
         max_frames: Maximum number of frames to extract
-        
+    
     Returns:
-        List of frames as numpy arrays
+        Expected frame count, or None if the video does not report its length
     """
-    frames = []
+    cap = cv2.VideoCapture(video_path)
     
+    if not cap.isOpened():
+        raise ValueError("Could not open video file")
+    
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            return None
+        
+        frame_skip = get_frame_skip(cap, frame_interval)
+        return min(max_frames, -(-total_frames // frame_skip))
+    
+    finally:
+        cap.release()
+
+
+def iter_video_frames(video_path, frame_interval=0.5, max_frames=10):
+    """
+    Yield frames sampled from a video file at a fixed time interval.
+    
+    Frames between samples are skipped with grab(), which advances the decoder
+    without converting or copying the frame. When the skip is long enough for a
+    seek to be cheaper, given whether the codec stores every frame as a
+    keyframe, the capture seeks to the next sample instead.
+    
+    Args:
+        video_path: Path to video file
+        frame_interval: Time interval between frames in seconds
+        max_frames: Maximum number of frames to extract
+    
+    Yields:
+        Frames as numpy arrays
+    """
     cap = cv2.VideoCapture(video_path)
     
     if not cap.isOpened():
         raise ValueError("Could not open video file")
     
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps == 0:
-        fps = 30  # Default to 30 fps if unable to get fps
+    try:
+        frame_skip = get_frame_skip(cap, frame_interval)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if get_video_codec(cap) in INTRA_ONLY_CODECS:
+            seek_min_frame_skip = INTRA_SEEK_MIN_FRAME_SKIP
+        else:
+            seek_min_frame_skip = SEEK_MIN_FRAME_SKIP
+        
+        seek = total_frames > 0 and frame_skip >= seek_min_frame_skip
+        
+        extracted_count = 0
+        
+        while extracted_count < max_frames:
+            ret, frame = cap.read()
+            
+            if not ret:
+                break
+            
+            yield frame
+            extracted_count += 1
+            
+            if seek:
+                next_frame = extracted_count * frame_skip
+                if next_frame >= total_frames or not cap.set(cv2.CAP_PROP_POS_FRAMES, next_frame):
+                    break
+            else:
+                for _ in range(frame_skip - 1):
+                    if not cap.grab():
+                        break
+    
+    finally:
+        cap.release()
+
+
+# Scene-change sampling: candidates are probed every SCENE_PROBE_INTERVAL
+# seconds and compared to the last kept frame as SCENE_THUMBNAIL_SIZE grayscale
+# thumbnails; a mean absolute difference of SCENE_CHANGE_THRESHOLD (fraction of
+# full scale) counts as new content
+SCENE_PROBE_INTERVAL = 0.1
+SCENE_THUMBNAIL_SIZE = 32
+SCENE_CHANGE_THRESHOLD = 0.06
+
+
+def scene_thumbnail(frame):
+    """Downscale a frame to the small grayscale thumbnail used for scene-change scores."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (SCENE_THUMBNAIL_SIZE, SCENE_THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+    return thumbnail.astype(np.float32) / 255.0
+
+
+def iter_scene_frames(
+    video_path,
+    min_interval=0.5,
+    max_interval=2.0,
+    max_frames=10,
+    threshold=SCENE_CHANGE_THRESHOLD
+):
+    """
+    Yield frames where the content has changed, within spacing limits.
     
-    frame_skip = int(fps * frame_interval)
-    if frame_skip < 1:
-        frame_skip = 1
+    The first frame is always kept. After that, a candidate is probed every
+    SCENE_PROBE_INTERVAL seconds (frames in between are only grabbed) and kept
+    when at least min_interval has passed and its thumbnail differs from the
+    last kept frame by threshold, or when max_interval has passed regardless.
+    A vehicle waiting at a light therefore yields one frame per max_interval
+    instead of one per sampling interval.
     
-    frame_count = 0
-    extracted_count = 0
+    Args:
+        video_path: Path to video file
+        min_interval: Minimum time between kept frames in seconds
+        max_interval: Maximum time between kept frames in seconds
+        max_frames: Maximum number of frames to extract
+        threshold: Scene-change score (0-1) needed to keep a frame early
     
-    while extracted_count < max_frames:
-        ret, frame = cap.read()
+    Yields:
+        Frames as numpy arrays
+    """
+    cap = cv2.VideoCapture(video_path)
+    
+    if not cap.isOpened():
+        raise ValueError("Could not open video file")
+    
+    try:
+        fps = get_video_fps(cap)
+        min_skip = max(1, int(fps * min_interval))
+        max_skip = max(min_skip, int(fps * max_interval))
+        probe_skip = max(1, min(min_skip, int(fps * SCENE_PROBE_INTERVAL)))
         
+        ret, frame = cap.read()
         if not ret:
-            break
+            return
         
-        if frame_count % frame_skip == 0:
-            frames.append(frame)
-            extracted_count += 1
+        yield frame
+        extracted_count = 1
         
-        frame_count += 1
+        last_thumbnail = scene_thumbnail(frame)
+        frame_index = 0
+        last_kept = 0
+        
+        while extracted_count < max_frames:
+            # Advance to the next probe, never before min_skip nor past max_skip
+            target = max(frame_index + probe_skip, last_kept + min_skip)
+            target = min(target, last_kept + max_skip)
+            
+            while frame_index < target - 1:
+                if not cap.grab():
+                    return
+                frame_index += 1
+            
+            ret, frame = cap.read()
+            if not ret:
+                return
+            frame_index += 1
+            
+            thumbnail = scene_thumbnail(frame)
+            score = float(np.mean(np.abs(thumbnail - last_thumbnail)))
+            
+            if score >= threshold or frame_index - last_kept >= max_skip:
+                yield frame
+                extracted_count += 1
+                last_thumbnail = thumbnail
+                last_kept = frame_index
     
-    cap.release()
+    finally:
+        cap.release()
+
+
+def extract_frames_from_video(video_path, frame_interval=0.5, max_frames=10):
+    """
+    Extract frames from a video file.
+    
+    Args:
+        video_path: Path to video file
+        frame_interval: Time interval between frames in seconds
+        max_frames: Maximum number of frames to extract
     
-    return frames
+    Returns:
+        List of frames as numpy arrays
+    """
+    return list(iter_video_frames(video_path, frame_interval, max_frames))
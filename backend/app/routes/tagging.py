@@ -3,21 +3,16 @@ Tagging endpoints for LangChain RAG-based intelligent enrichment.
 """
 
 from flask import Blueprint, request, jsonify
-from app.services.rag_tagger import RAGTagger
+from app.services.model_registry import get_registry
 import logging
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('tagging', __name__, url_prefix='/api/tag')
 
-_tagger = None
-
 def get_tagger():
-    """Get or create RAGTagger instance."""
-    global _tagger
-    if _tagger is None:
-        _tagger = RAGTagger(use_vector_db=False)  # Use direct lookup for faster response
-    return _tagger
+    """Get the shared RAGTagger from the model registry."""
+    return get_registry().get('rag_tagger')
 
 
 @bp.route('/enrich', methods=['POST'])
@@ -0,0 +1,511 @@
+"""
+Artifact Store
+Content-addressed, lazily rendered artifacts (annotated images) with memory and disk LRU caches.
+"""
+
+import os
+import json
+import stat
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Artifact renderers by kind: renderer(source, meta) -> artifact bytes, where source
+# and meta are the bytes and JSON-serializable dict given to ArtifactStore.register
+_renderers: Dict[str, Callable[[bytes, Dict], bytes]] = {}
+
+
+def register_renderer(kind: str, renderer: Callable[[bytes, Dict], bytes]):
+    """
+    Register the function that renders artifacts of a kind.
+    
+    Args:
+        kind: Artifact kind passed to ArtifactStore.register
+        renderer: Callable taking (source, meta) and returning the artifact bytes
+    """
+    _renderers[kind] = renderer
+
+
+class ArtifactStore:
+    """
+    Artifacts addressed by a hash of everything that determines their content.
+    
+    register() records how to render an artifact without rendering it. The
+    first get() renders it, at most once across threads, and keeps the result
+    in a memory LRU and a disk LRU, each bounded in bytes. The render recipes
+    hold their source data, so they are bounded in bytes as well; a recipe
+    evicted before its artifact was ever fetched makes that artifact
+    unavailable.
+    
+    With render_workers, artifacts are instead rendered in the background as
+    soon as they are registered, several at a time, so the first fetch finds
+    them ready.
+    
+    Several processes (e.g. gunicorn workers) may share one directory. With
+    the disk cache enabled, a background thread also writes each recipe to
+    disk, so an artifact registered by one process can be served by any
+    other: a key missing from a process's own index is looked up on disk as
+    a rendered file, then as a recipe, before it counts as unknown. Recipe
+    files share the disk LRU and its byte budget with rendered artifacts and
+    are deleted once rendered, evicted or older than recipe_ttl_seconds.
+    
+    Each process indexes what it writes, and every prune_interval seconds
+    rebuilds its index from the directory and evicts down to max_disk_bytes,
+    so processes sharing the directory keep it within the budget, give or
+    take what they write between two prunes.
+    """
+    
+    RECIPE_DIRECTORY = 'recipes'
+    
+    def __init__(
+        self,
+        directory: str,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+        max_pending_bytes: int = 512 * 1024 * 1024,
+        render_workers: int = 0,
+        recipe_ttl_seconds: float = 86400.0,
+        prune_interval: float = 60.0
+    ):
+        """
+        Initialize artifact store.
+        
+        Args:
+            directory: Directory rendered artifacts and recipes are written to
+            max_memory_bytes: Maximum bytes of rendered artifacts kept in memory
+            max_disk_bytes: Maximum bytes of rendered artifacts and recipes kept
+                on disk (0 disables the disk cache)
+            max_pending_bytes: Maximum bytes of source data held in memory by unrendered artifacts
+            render_workers: Threads rendering artifacts ahead of their first fetch
+                (0 renders only on fetch)
+            recipe_ttl_seconds: Seconds a recipe file is kept without being rendered
+            prune_interval: Seconds between rebuilds of the disk index from the directory
+        """
+        self.directory = directory
+        self.max_memory_bytes = max(0, max_memory_bytes)
+        self.max_disk_bytes = max(0, max_disk_bytes)
+        self.max_pending_bytes = max(0, max_pending_bytes)
+        self.recipe_ttl_seconds = recipe_ttl_seconds
+        self.prune_interval = prune_interval
+        
+        self._lock = threading.Lock()
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: 'OrderedDict[str, int]' = OrderedDict()
+        self._disk_bytes = 0
+        self._pending: 'OrderedDict[str, Tuple[str, bytes, Dict]]' = OrderedDict()
+        self._pending_bytes = 0
+        self._inflight: Dict[str, Future] = {}
+        self._last_prune = 0.0
+        self._prune_scheduled = False
+        
+        self._executor = None
+        if render_workers > 0:
+            self._executor = ThreadPoolExecutor(render_workers, thread_name_prefix='artifact-render')
+        
+        # Writes recipes and prunes the directory off the request threads
+        self._disk_worker = None
+        if self.max_disk_bytes:
+            self._disk_worker = ThreadPoolExecutor(1, thread_name_prefix='artifact-disk')
+        
+        self._stats = {
+            'registered': 0,
+            'rendered': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'dropped': 0
+        }
+        
+        if self.max_disk_bytes:
+            os.makedirs(os.path.join(directory, self.RECIPE_DIRECTORY), exist_ok=True)
+            self._prune()
+    
+    @staticmethod
+    def make_key(*parts: bytes) -> str:
+        """
+        Build an artifact key from the byte strings that determine its content.
+        
+        Returns:
+            Hex SHA-256 digest
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+    
+    def register(self, key: str, kind: str, source: bytes, meta: Dict):
+        """
+        Record how to render an artifact. Nothing is rendered until it is fetched.
+        
+        Args:
+            key: Artifact key from make_key
+            kind: Renderer registered with register_renderer
+            source: Source data passed to the renderer
+            meta: JSON-serializable parameters passed to the renderer
+        """
+        dropped = []
+        
+        with self._lock:
+            self._stats['registered'] += 1
+            
+            if key in self._memory or key in self._disk or key in self._pending:
+                return
+            
+            self._pending[key] = (kind, source, meta)
+            self._pending_bytes += len(source)
+            
+            while self._pending_bytes > self.max_pending_bytes and self._pending:
+                dropped_key, (_, dropped_source, _) = self._pending.popitem(last=False)
+                self._pending_bytes -= len(dropped_source)
+                self._stats['dropped'] += 1
+                dropped.append(dropped_key)
+        
+        for dropped_key in dropped:
+            self._forget(self._recipe_name(dropped_key))
+        
+        if self._disk_worker is not None:
+            self._disk_worker.submit(self._write_recipe, key)
+        
+        if self._executor is not None:
+            self._executor.submit(self._prerender, key)
+    
+    def _prerender(self, key: str):
+        """Render a registered artifact ahead of its first fetch."""
+        try:
+            self.get(key)
+        except Exception as e:
+            logger.warning(f"Could not render artifact {key}: {e}")
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get an artifact, rendering it on first access.
+        
+        Args:
+            key: Artifact key
+        
+        Returns:
+            Artifact bytes, or None if the key is unknown or was evicted unrendered
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return data
+            
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+            
+            future = self._inflight.get(key)
+            owner = future is None and not on_disk
+            
+            if owner:
+                recipe = self._pending.get(key)
+                future = Future()
+                self._inflight[key] = future
+        
+        if on_disk:
+            data = self._read(key)
+            if data is not None:
+                with self._lock:
+                    self._stats['disk_hits'] += 1
+                    self._remember(key, data)
+                return data
+            
+            # The file disappeared from under the index
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+                self._stats['misses'] += 1
+            return None
+        
+        if not owner:
+            return future.result()
+        
+        try:
+            data = self._fetch(key, recipe)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        
+        with self._lock:
+            self._inflight.pop(key, None)
+        
+        future.set_result(data)
+        return data
+    
+    def _fetch(self, key: str, recipe: Optional[Tuple[str, bytes, Dict]]) -> Optional[bytes]:
+        """Find an artifact rendered by another process sharing the directory, or render it."""
+        data = self._read(key) if self.max_disk_bytes else None
+        
+        if data is not None:
+            self._index(key, len(data))
+            with self._lock:
+                self._stats['disk_hits'] += 1
+                self._remember(key, data)
+                self._forget_recipe(key)
+            return data
+        
+        if recipe is None:
+            # Registered by another process
+            recipe = self._read_recipe(key)
+            if recipe is None:
+                with self._lock:
+                    self._stats['misses'] += 1
+                return None
+        
+        kind, source, meta = recipe
+        data = _renderers[kind](source, meta)
+        
+        self._write(key, data)
+        self._forget(self._recipe_name(key))
+        
+        with self._lock:
+            self._stats['rendered'] += 1
+            self._remember(key, data)
+            self._forget_recipe(key)
+        
+        return data
+    
+    def _forget_recipe(self, key: str):
+        """Drop a rendered artifact's recipe from memory. Caller holds the lock."""
+        if key in self._pending:
+            _, source, _ = self._pending.pop(key)
+            self._pending_bytes -= len(source)
+    
+    def _remember(self, key: str, data: bytes):
+        """Keep rendered bytes in the memory LRU. Caller holds the lock."""
+        if len(data) > self.max_memory_bytes:
+            return
+        
+        if key not in self._memory:
+            self._memory_bytes += len(data)
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+    
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+    
+    def _recipe_name(self, key: str) -> str:
+        """Disk index name of an artifact's recipe file."""
+        return f'{self.RECIPE_DIRECTORY}/{key}'
+    
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    
+    def _forget(self, name: str):
+        """Delete a file and drop it from the disk index."""
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(name, 0)
+        self._unlink(self._path(name))
+    
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            # Keeps the LRU order across processes and restarts, which index by mtime
+            os.utime(self._path(key))
+            return data
+        except OSError:
+            return None
+    
+    def _write_file(self, path: str, data: bytes) -> bool:
+        """Write a file atomically, so other processes never read it half written."""
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not write {path}: {e}")
+            self._unlink(temp_path)
+            return False
+    
+    def _write(self, key: str, data: bytes):
+        """Write rendered bytes to the disk LRU, evicting the least recently used files."""
+        if not self.max_disk_bytes or len(data) > self.max_disk_bytes:
+            return
+        
+        if self._write_file(self._path(key), data):
+            self._index(key, len(data))
+    
+    def _index(self, name: str, size: int):
+        """Add a file on disk to the disk LRU, evicting the least recently used files."""
+        evicted = []
+        
+        with self._lock:
+            if name not in self._disk:
+                self._disk_bytes += size
+            self._disk[name] = size
+            
+            while self._disk_bytes > self.max_disk_bytes:
+                old_name, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_name)
+            
+            prune = (
+                not self._prune_scheduled
+                and time.monotonic() - self._last_prune >= self.prune_interval
+            )
+            if prune:
+                self._prune_scheduled = True
+        
+        for old_name in evicted:
+            self._unlink(self._path(old_name))
+        
+        if prune:
+            self._disk_worker.submit(self._prune)
+    
+    def _write_recipe(self, key: str):
+        """Write a still unrendered artifact's recipe for other processes sharing the directory."""
+        with self._lock:
+            recipe = self._pending.get(key)
+        
+        if recipe is None:
+            return
+        
+        kind, source, meta = recipe
+        data = json.dumps({'kind': kind, 'meta': meta}).encode() + b'\n' + source
+        name = self._recipe_name(key)
+        
+        if len(data) > self.max_disk_bytes or not self._write_file(self._path(name), data):
+            return
+        
+        with self._lock:
+            pending = key in self._pending
+        
+        # Rendered or dropped while it was being written
+        if not pending:
+            self._unlink(self._path(name))
+            return
+        
+        self._index(name, len(data))
+    
+    def _read_recipe(self, key: str) -> Optional[Tuple[str, bytes, Dict]]:
+        """Read a recipe written by another process, or None if there is none."""
+        if not self.max_disk_bytes:
+            return None
+        
+        try:
+            with open(self._path(self._recipe_name(key)), 'rb') as f:
+                header, _, source = f.read().partition(b'\n')
+        except OSError:
+            return None
+        
+        recipe = json.loads(header)
+        return recipe['kind'], source, recipe['meta']
+    
+    def _prune(self):
+        """
+        Rebuild the disk index from the directory and evict down to max_disk_bytes.
+        
+        The directory may be shared with other processes, so the index is
+        rebuilt from what is actually on disk, least recently used first.
+        Expired recipes and temp files left by crashed writers are deleted.
+        """
+        now = time.time()
+        entries = []
+        
+        for subdirectory in ('', self.RECIPE_DIRECTORY):
+            try:
+                names = os.listdir(self._path(subdirectory))
+            except OSError:
+                continue
+            
+            for name in names:
+                if subdirectory:
+                    name = f'{subdirectory}/{name}'
+                path = self._path(name)
+                
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                
+                if not stat.S_ISREG(info.st_mode):
+                    continue
+                
+                # Recent temp files may belong to a live process
+                expired = (
+                    (name.endswith('.tmp') and info.st_mtime < now - 3600)
+                    or (subdirectory and info.st_mtime < now - self.recipe_ttl_seconds)
+                )
+                
+                if expired:
+                    self._unlink(path)
+                elif not name.endswith('.tmp'):
+                    entries.append((info.st_mtime, name, info.st_size))
+        
+        entries.sort()
+        disk_bytes = sum(size for _, _, size in entries)
+        
+        evicted = 0
+        while disk_bytes > self.max_disk_bytes and evicted < len(entries):
+            _, name, size = entries[evicted]
+            disk_bytes -= size
+            self._unlink(self._path(name))
+            evicted += 1
+        
+        with self._lock:
+            self._disk = OrderedDict((name, size) for _, name, size in entries[evicted:])
+            self._disk_bytes = disk_bytes
+            self._last_prune = time.monotonic()
+            self._prune_scheduled = False
+    
+    def get_stats(self) -> Dict:
+        """Get counters and cache occupancy."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+            stats['pending_bytes'] = self._pending_bytes
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['disk_entries'] = len(self._disk)
+            stats['disk_bytes'] = self._disk_bytes
+        
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Get the process-wide ArtifactStore configured from the environment."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                megabyte = 1024 * 1024
+                _store = ArtifactStore(
+                    directory=os.getenv('ARTIFACT_DIR') or os.path.join(
+                        os.path.dirname(__file__), '..', '..', 'uploads', 'artifacts'
+                    ),
+                    max_memory_bytes=int(float(os.getenv('ARTIFACT_MEMORY_MB', 64)) * megabyte),
+                    max_disk_bytes=int(float(os.getenv('ARTIFACT_DISK_MB', 1024)) * megabyte),
+                    max_pending_bytes=int(float(os.getenv('ARTIFACT_PENDING_MB', 512)) * megabyte),
+                    render_workers=int(os.getenv('ARTIFACT_RENDER_WORKERS', 0)),
+                    recipe_ttl_seconds=float(os.getenv('ARTIFACT_RECIPE_TTL', 86400))
+                )
+    return _store
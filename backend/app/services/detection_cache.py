@@ -0,0 +1,193 @@
+"""
+Detection Result Cache
+Content-addressed LRU cache with single-flight coalescing for detection results.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionCache:
+    """
+    LRU + TTL cache keyed by image content hash, model version and parameters.
+    
+    Lookups that miss while an identical request is already computing wait for
+    that request's result instead of running a second inference.
+    """
+    
+    HIT = 'hit'
+    WAIT = 'wait'
+    OWNER = 'owner'
+    
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 600.0):
+        """
+        Initialize detection cache.
+        
+        Args:
+            max_entries: Maximum cached results (0 disables caching, keeps coalescing)
+            ttl_seconds: Seconds a cached result stays valid
+        """
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+    
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str, **params) -> str:
+        """
+        Build a cache key from image content, model version and inference parameters.
+        
+        Args:
+            image_bytes: Encoded image data as uploaded
+            model_version: Identifier of the loaded model weights
+            **params: Inference parameters that change the result (e.g. conf_threshold)
+        
+        Returns:
+            Cache key string
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        param_str = ','.join(f"{k}={params[k]}" for k in sorted(params))
+        return f"{digest}:{model_version}:{param_str}"
+    
+    def claim(self, key: str) -> Tuple[str, Any]:
+        """
+        Look up a key, or claim it for computation.
+        
+        Args:
+            key: Cache key from make_key
+        
+        Returns:
+            (HIT, value) for a cached result,
+            (WAIT, future) if an identical request is computing it,
+            (OWNER, future) if the caller must compute it and call complete() or fail()
+        """
+        now = time.monotonic()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return self.HIT, value
+                
+                del self._entries[key]
+                self._stats['expirations'] += 1
+            
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                return self.WAIT, future
+            
+            future = Future()
+            self._inflight[key] = future
+            self._stats['misses'] += 1
+            return self.OWNER, future
+    
+    def complete(self, key: str, value: Any):
+        """Store a computed result and wake every request waiting on it."""
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            
+            if self.max_entries:
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+                self._entries.move_to_end(key)
+                
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        
+        if future is not None:
+            future.set_result(value)
+    
+    def fail(self, key: str, error: BaseException):
+        """Release a claimed key without caching and propagate the error to waiters."""
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        
+        if future is not None:
+            future.set_exception(error)
+    
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Return the cached result for key, computing it at most once across threads.
+        
+        Args:
+            key: Cache key from make_key
+            compute: Callable producing the result on a miss
+        
+        Returns:
+            Tuple of (result, served_without_inference)
+        """
+        status, value = self.claim(key)
+        
+        if status == self.HIT:
+            return value, True
+        
+        if status == self.WAIT:
+            return value.result(), True
+        
+        try:
+            result = compute()
+        except BaseException as e:
+            self.fail(key, e)
+            raise
+        
+        self.complete(key, result)
+        return result, False
+    
+    def clear(self):
+        """Drop all cached results."""
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self) -> Dict:
+        """Get hit/miss counters and occupancy."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['inflight'] = len(self._inflight)
+        
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = (stats['hits'] + stats['coalesced']) / lookups if lookups else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl_seconds
+        
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_detection_cache() -> DetectionCache:
+    """Get the process-wide DetectionCache configured from the environment."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DetectionCache(
+                    max_entries=int(os.getenv('DETECTION_CACHE_SIZE', 1024)),
+                    ttl_seconds=float(os.getenv('DETECTION_CACHE_TTL', 600))
+                )
+    return _cache
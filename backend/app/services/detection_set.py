@@ -0,0 +1,440 @@
+"""
+Columnar Detection Container
+Array-backed detections shared by the detection, multi-frame, tagging and reporting services.
+"""
+
+import numpy as np
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+ClassNames = Union[Sequence[str], Mapping[int, str]]
+
+
+def _as_float(values) -> np.ndarray:
+    """View values as a float array, keeping float64 input (e.g. parsed JSON) exact."""
+    values = np.asarray(values)
+    return values if values.dtype.kind == 'f' else values.astype(np.float32)
+
+
+class Detection:
+    """
+    Lightweight view of one row of a DetectionSet.
+    
+    Supports attribute access (det.confidence, det.bbox) and, for code written
+    against the legacy dict shape, det['class_name'], det.get('enrichment')
+    and 'enrichment' in det.
+    """
+    
+    __slots__ = ('_set', '_index')
+    
+    def __init__(self, detection_set: 'DetectionSet', index: int):
+        self._set = detection_set
+        self._index = index
+    
+    @property
+    def class_id(self) -> int:
+        return int(self._set.class_ids[self._index])
+    
+    @property
+    def class_name(self) -> str:
+        return self._set.class_names[self.class_id]
+    
+    @property
+    def confidence(self) -> float:
+        return float(self._set.scores[self._index])
+    
+    @property
+    def bbox(self) -> List[float]:
+        """Box as [x1, y1, x2, y2]."""
+        return self._set.boxes[self._index].tolist()
+    
+    @property
+    def frame_idx(self) -> int:
+        return int(self._set.frame_ids[self._index])
+    
+    @property
+    def attrs(self) -> Dict[str, Any]:
+        """Extra per-detection fields such as enrichment, location or validation."""
+        if self._set.attrs is None:
+            return {}
+        return self._set.attrs[self._index] or {}
+    
+    def to_dict(self) -> Dict:
+        """Convert to the legacy JSON detection dict."""
+        return self._set[self._index:self._index + 1].to_dicts()[0]
+    
+    def __getitem__(self, key: str) -> Any:
+        if key == 'class_name':
+            return self.class_name
+        if key == 'confidence':
+            return self.confidence
+        if key == 'class_id':
+            return self.class_id
+        if key in self.attrs:
+            return self.attrs[key]
+        return self.to_dict()[key]
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.attrs or key in self.to_dict()
+    
+    def __repr__(self) -> str:
+        return f"Detection({self.class_name}, {self.confidence:.2f}, {self.bbox})"
+
+
+class DetectionSet:
+    """
+    Detections stored as parallel NumPy columns.
+    
+    Columns are boxes (N, 4) as [x1, y1, x2, y2], scores (N,), class_ids (N,)
+    and frame_ids (N,). class_names maps class ids to names. attrs optionally
+    holds one dict of extra fields per row (enrichment, validation, ...).
+    Services pass DetectionSets between each other and only call to_dicts()
+    when building an HTTP response.
+    """
+    
+    __slots__ = ('boxes', 'scores', 'class_ids', 'frame_ids', 'class_names', 'attrs', 'box_format')
+    
+    # Legacy dict keys that are stored in (or derived from) the columns
+    _COLUMN_KEYS = frozenset((
+        'class_id', 'class_name', 'confidence', 'bbox', 'bbox_center', 'bbox_area', 'frame_idx'
+    ))
+    
+    def __init__(
+        self,
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        class_ids: np.ndarray,
+        class_names: ClassNames,
+        frame_ids: Optional[np.ndarray] = None,
+        attrs: Optional[List[Optional[Dict]]] = None,
+        box_format: str = 'dict'
+    ):
+        """
+        Initialize detection set.
+        
+        Args:
+            boxes: Boxes with shape (N, 4) as [x1, y1, x2, y2]
+            scores: Confidence scores with shape (N,)
+            class_ids: Class ids with shape (N,)
+            class_names: Class names indexed by class id
+            frame_ids: Frame index of each detection (default: all 0)
+            attrs: Optional per-detection dicts of extra fields
+            box_format: Legacy JSON shape of bbox and bbox_center, 'dict' ({"x1", ...})
+                as returned by the detector or 'list' ([x1, ...]) as returned by
+                multi-frame validation
+        """
+        self.boxes = _as_float(boxes).reshape(-1, 4)
+        self.scores = _as_float(scores)
+        self.class_ids = np.asarray(class_ids, dtype=np.int64)
+        self.frame_ids = (
+            np.zeros(len(self.boxes), dtype=np.int64) if frame_ids is None
+            else np.asarray(frame_ids, dtype=np.int64)
+        )
+        self.class_names = class_names
+        self.attrs = attrs
+        self.box_format = box_format
+    
+    @classmethod
+    def empty(cls, class_names: ClassNames = ()) -> 'DetectionSet':
+        """Create a set with no detections."""
+        return cls(np.empty((0, 4)), np.empty(0), np.empty(0), class_names)
+    
+    @classmethod
+    def from_array(
+        cls,
+        output: np.ndarray,
+        class_names: ClassNames,
+        frame_id: int = 0
+    ) -> 'DetectionSet':
+        """
+        Wrap raw detector output.
+        
+        Args:
+            output: Array with shape (N, 6) as [x1, y1, x2, y2, confidence, class_id]
+            class_names: Class names indexed by class id
+            frame_id: Frame index assigned to every detection
+        
+        Returns:
+            DetectionSet sharing memory with output where possible
+        """
+        output = np.asarray(output, dtype=np.float32).reshape(-1, 6)
+        
+        return cls(
+            output[:, :4],
+            output[:, 4],
+            output[:, 5].astype(np.int64),
+            class_names,
+            np.full(len(output), frame_id, dtype=np.int64)
+        )
+    
+    @classmethod
+    def from_dicts(
+        cls,
+        detections: Iterable[Dict],
+        class_names: Optional[ClassNames] = None,
+        frame_id: int = 0
+    ) -> 'DetectionSet':
+        """
+        Parse legacy detection dicts, e.g. from a JSON request body.
+        
+        Boxes may be lists [x1, y1, x2, y2] or dicts with x1, y1, x2, y2.
+        Classes are resolved by class_name; names missing from class_names are
+        given new ids. Fields other than the columns are kept in attrs.
+        
+        Args:
+            detections: Detection dicts
+            class_names: Known class names indexed by class id
+            frame_id: Frame index for detections without a frame_idx
+        
+        Returns:
+            DetectionSet
+        """
+        names = dict(enumerate(class_names)) if isinstance(class_names, (list, tuple)) else dict(class_names or {})
+        ids_by_name = {name: class_id for class_id, name in names.items()}
+        
+        boxes, scores, class_ids, frame_ids, attrs = [], [], [], [], []
+        has_attrs = False
+        box_format = 'dict'
+        
+        for det in detections:
+            bbox = det['bbox']
+            if isinstance(bbox, (list, tuple)):
+                boxes.append(bbox[:4])
+                box_format = 'list'
+            else:
+                boxes.append((bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2']))
+            
+            name = det['class_name']
+            class_id = ids_by_name.get(name)
+            if class_id is None:
+                class_id = det.get('class_id')
+                if class_id is None or class_id in names:
+                    class_id = max(names, default=-1) + 1
+                names[class_id] = name
+                ids_by_name[name] = class_id
+            
+            scores.append(det.get('confidence', 0.0))
+            class_ids.append(class_id)
+            frame_ids.append(det.get('frame_idx', frame_id))
+            
+            extra = {k: v for k, v in det.items() if k not in cls._COLUMN_KEYS}
+            attrs.append(extra or None)
+            has_attrs = has_attrs or bool(extra)
+        
+        if not boxes:
+            return cls.empty(names)
+        
+        return cls(
+            np.asarray(boxes, dtype=np.float64),
+            np.asarray(scores, dtype=np.float64),
+            class_ids,
+            names,
+            frame_ids,
+            attrs if has_attrs else None,
+            box_format
+        )
+    
+    @classmethod
+    def from_frames(
+        cls,
+        frame_detections: Sequence[Union['DetectionSet', List[Dict]]],
+        class_names: Optional[ClassNames] = None
+    ) -> 'DetectionSet':
+        """
+        Concatenate per-frame detections, numbering frames by position.
+        
+        Args:
+            frame_detections: One DetectionSet or list of legacy dicts per frame
+            class_names: Known class names for dict input
+        
+        Returns:
+            DetectionSet with frame_ids set to each frame's position
+        """
+        sets = []
+        for frame_idx, detections in enumerate(frame_detections):
+            if not isinstance(detections, DetectionSet):
+                detections = cls.from_dicts(detections, class_names)
+                # Keep ids consistent with names seen in earlier frames
+                class_names = detections.class_names
+            else:
+                detections = detections.copy()
+            detections.frame_ids = np.full(len(detections), frame_idx, dtype=np.int64)
+            sets.append(detections)
+        
+        return cls.concatenate(sets, class_names)
+    
+    @classmethod
+    def concatenate(
+        cls,
+        sets: Sequence['DetectionSet'],
+        class_names: Optional[ClassNames] = None
+    ) -> 'DetectionSet':
+        """Stack several sets into one (class names are taken from the last set)."""
+        if not sets:
+            return cls.empty(class_names or ())
+        
+        attrs = None
+        if any(s.attrs is not None for s in sets):
+            attrs = []
+            for s in sets:
+                attrs.extend(s.attrs if s.attrs is not None else [None] * len(s))
+        
+        return cls(
+            np.concatenate([s.boxes for s in sets]),
+            np.concatenate([s.scores for s in sets]),
+            np.concatenate([s.class_ids for s in sets]),
+            sets[-1].class_names,
+            np.concatenate([s.frame_ids for s in sets]),
+            attrs,
+            sets[0].box_format
+        )
+    
+    def __len__(self) -> int:
+        return len(self.scores)
+    
+    def __iter__(self) -> Iterator[Detection]:
+        for i in range(len(self)):
+            yield Detection(self, i)
+    
+    def __getitem__(self, index) -> Union[Detection, 'DetectionSet']:
+        """Row view for an integer index, subset for a slice, mask or index array."""
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('DetectionSet index out of range')
+            return Detection(self, int(index))
+        
+        if isinstance(index, slice):
+            attrs = self.attrs[index] if self.attrs is not None else None
+        else:
+            index = np.asarray(index)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+            attrs = [self.attrs[i] for i in index.tolist()] if self.attrs is not None else None
+        
+        return DetectionSet(
+            self.boxes[index],
+            self.scores[index],
+            self.class_ids[index],
+            self.class_names,
+            self.frame_ids[index],
+            attrs,
+            self.box_format
+        )
+    
+    def copy(self) -> 'DetectionSet':
+        """Copy with independent column arrays."""
+        return DetectionSet(
+            self.boxes.copy(),
+            self.scores.copy(),
+            self.class_ids.copy(),
+            self.class_names,
+            self.frame_ids.copy(),
+            list(self.attrs) if self.attrs is not None else None,
+            self.box_format
+        )
+    
+    @property
+    def centers(self) -> np.ndarray:
+        """Box centers with shape (N, 2)."""
+        return (self.boxes[:, :2] + self.boxes[:, 2:]) / 2
+    
+    @property
+    def areas(self) -> np.ndarray:
+        """Box areas with shape (N,)."""
+        return (self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1])
+    
+    def names(self) -> List[str]:
+        """Class name of every detection."""
+        class_names = self.class_names
+        return [class_names[class_id] for class_id in self.class_ids.tolist()]
+    
+    def with_attrs(self, key: str, values: Union[Any, Sequence[Any]], per_row: bool = False) -> 'DetectionSet':
+        """
+        Return a set sharing these columns with one extra field set on every row.
+        
+        Args:
+            key: Field name, e.g. 'enrichment'
+            values: Value for every row, or one value per row if per_row is True
+            per_row: Whether values is a sequence with one entry per row
+        
+        Returns:
+            New DetectionSet
+        """
+        attrs = [dict(a) if a else {} for a in self.attrs] if self.attrs is not None else [{} for _ in range(len(self))]
+        
+        for i, extra in enumerate(attrs):
+            extra[key] = values[i] if per_row else values
+        
+        return DetectionSet(
+            self.boxes,
+            self.scores,
+            self.class_ids,
+            self.class_names,
+            self.frame_ids,
+            attrs,
+            self.box_format
+        )
+    
+    def to_dicts(self) -> List[Dict]:
+        """
+        Convert to legacy JSON detection dicts.
+        
+        Centers and areas are computed for all boxes at once and every column
+        is converted to Python scalars with a single tolist() call, so the
+        per-detection work is only building the output dict.
+        
+        Returns:
+            List of detection dicts with bbox, bbox_center and bbox_area in box_format
+        """
+        if len(self) == 0:
+            return []
+        
+        boxes = self.boxes.tolist()
+        centers = self.centers.tolist()
+        areas = self.areas.tolist()
+        attrs = self.attrs if self.attrs is not None else [None] * len(self)
+        
+        if self.box_format == 'list':
+            bbox_values = boxes
+            center_values = centers
+        else:
+            bbox_values = [{'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2} for x1, y1, x2, y2 in boxes]
+            center_values = [{'x': cx, 'y': cy} for cx, cy in centers]
+        
+        detections = []
+        
+        for class_id, name, conf, bbox, center, area, extra in zip(
+            self.class_ids.tolist(),
+            self.names(),
+            self.scores.tolist(),
+            bbox_values,
+            center_values,
+            areas,
+            attrs
+        ):
+            det = {
+                'class_id': class_id,
+                'class_name': name,
+                'confidence': conf,
+                'bbox': bbox,
+                'bbox_center': center,
+                'bbox_area': area
+            }
+            if extra:
+                det.update(extra)
+            detections.append(det)
+        
+        return detections
+    
+    def __repr__(self) -> str:
+        return f"DetectionSet({len(self)} detections, {len(np.unique(self.frame_ids))} frame(s))"
@@ -5,8 +5,9 @@ Handles automated filing of urban issue reports to municipal systems.
 
 import requests
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 from datetime import datetime
+from app.services.detection_set import Detection, DetectionSet
 
 logger = logging.getLogger(__name__)
 
@@ -100,7 +101,7 @@ class GeoReportClient:
     
     def create_service_request(
         self,
-        detection: Dict,
+        detection: Union[Dict, Detection],
         location: Dict,
         description: Optional[str] = None,
         image_url: Optional[str] = None
@@ -109,7 +110,7 @@ class GeoReportClient:
         Create a service request (report) for a detected issue.
         
         Args:
-            detection: Enriched detection dict with class_name and enrichment
+            detection: Enriched detection (dict or DetectionSet row) with class_name and enrichment
             location: GPS coordinates {"lat": float, "lon": float}
             description: Optional custom description
             image_url: Optional URL to uploaded image
@@ -173,12 +174,12 @@ class GeoReportClient:
                 'jurisdiction': self.jurisdiction
             }
     
-    def _generate_description(self, detection: Dict) -> str:
+    def _generate_description(self, detection: Union[Dict, Detection]) -> str:
         """
         Generate a description for the service request.
         
         Args:
-            detection: Detection dict with class_name and enrichment
+            detection: Detection (dict or DetectionSet row) with class_name and enrichment
             
         Returns:
             Generated description string
@@ -253,7 +254,7 @@ class GeoReportClient:
     
     def create_automated_report(
         self,
-        detection: Dict,
+        detection: Union[Dict, Detection],
         location: Dict,
         image_url: Optional[str] = None,
         auto_route: bool = True
@@ -262,7 +263,7 @@ class GeoReportClient:
         Create an automated report with jurisdiction routing.
         
         Args:
-            detection: Enriched detection dict
+            detection: Enriched detection (dict or DetectionSet row)
             location: GPS coordinates
             image_url: Optional image URL
             auto_route: Whether to automatically determine jurisdiction
@@ -280,7 +281,7 @@ class GeoReportClient:
     
     def batch_create_reports(
         self,
-        detections: List[Dict],
+        detections: Union[DetectionSet, List[Dict]],
         location: Dict,
         image_url: Optional[str] = None
     ) -> List[Dict]:
@@ -288,7 +289,7 @@ class GeoReportClient:
         Create multiple reports for multiple detections.
         
         Args:
-            detections: List of enriched detections
+            detections: Enriched DetectionSet or list of enriched detection dicts
             location: GPS coordinates
             image_url: Optional image URL
             
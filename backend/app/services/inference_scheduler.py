@@ -0,0 +1,251 @@
+"""
+Dynamic Micro-Batching Inference Scheduler
+Coalesces frames from concurrent requests into shared forward passes.
+"""
+
+import threading
+import time
+import queue
+from concurrent.futures import Future
+from typing import List, Dict, Optional
+import numpy as np
+from app.services.detection_set import DetectionSet
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingFrame:
+    """A frame waiting in the scheduler queue."""
+    
+    __slots__ = ('image', 'conf_threshold', 'imgsz', 'future', 'enqueued_at')
+    
+    def __init__(self, image: np.ndarray, conf_threshold: float, imgsz: Optional[int] = None):
+        self.image = image
+        self.conf_threshold = conf_threshold
+        self.imgsz = imgsz
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class InferenceScheduler:
+    """
+    In-process micro-batching scheduler for a pool of YOLODetector replicas.
+    
+    Frames submitted from any thread are queued. Each worker thread (one per
+    replica) takes the oldest frame, keeps collecting until either
+    max_batch_size frames are queued or max_wait_ms has passed since that frame
+    arrived, checks out a replica, runs one detect_sets call per confidence
+    threshold and image size and resolves each caller's future with the
+    frame's DetectionSet.
+    """
+    
+    def __init__(
+        self,
+        pool,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: float = 5.0
+    ):
+        """
+        Initialize inference scheduler.
+        
+        Args:
+            pool: ModelPool of YOLODetector replicas used to run batched inference
+            max_batch_size: Maximum frames per forward pass (default: detector.max_batch_size)
+            max_wait_ms: Maximum time the oldest queued frame waits for a batch to fill
+        """
+        self.pool = pool
+        detector = pool.get()
+        self.default_conf_threshold = detector.conf_threshold
+        self.max_batch_size = max(1, max_batch_size or detector.max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._stopped = False
+        
+        self._stats = {
+            'frames': 0,
+            'batches': 0,
+            'forward_passes': 0
+        }
+    
+    def submit(
+        self,
+        image: np.ndarray,
+        conf_threshold: Optional[float] = None,
+        imgsz: Optional[int] = None
+    ) -> Future:
+        """
+        Queue a frame for detection.
+        
+        Args:
+            image: Input image as numpy array (BGR format)
+            conf_threshold: Override default confidence threshold
+            imgsz: Override default inference image size
+        
+        Returns:
+            Future resolving to the DetectionSet for the frame
+        """
+        if conf_threshold is None:
+            conf_threshold = self.default_conf_threshold
+        
+        self._ensure_worker()
+        
+        pending = _PendingFrame(image, conf_threshold, imgsz)
+        self._queue.put(pending)
+        
+        return pending.future
+    
+    def detect(
+        self,
+        image: np.ndarray,
+        conf_threshold: Optional[float] = None,
+        timeout: Optional[float] = None,
+        imgsz: Optional[int] = None
+    ) -> DetectionSet:
+        """
+        Detect urban issues in a frame through the shared batch queue.
+        
+        Args:
+            image: Input image as numpy array (BGR format)
+            conf_threshold: Override default confidence threshold
+            timeout: Optional seconds to wait for the result
+            imgsz: Override default inference image size
+        
+        Returns:
+            DetectionSet for the frame
+        """
+        return self.submit(image, conf_threshold, imgsz).result(timeout=timeout)
+    
+    def detect_many(
+        self,
+        images: List[np.ndarray],
+        conf_threshold: Optional[float] = None,
+        imgsz: Optional[int] = None
+    ) -> List[DetectionSet]:
+        """
+        Queue several frames at once and wait for all of them.
+        
+        Args:
+            images: Input images as numpy arrays (BGR format)
+            conf_threshold: Override default confidence threshold
+            imgsz: Override default inference image size
+        
+        Returns:
+            One DetectionSet per input image
+        """
+        futures = [self.submit(image, conf_threshold, imgsz) for image in images]
+        return [future.result() for future in futures]
+    
+    def queue_depth(self) -> int:
+        """Get the number of frames waiting for a batch."""
+        return self._queue.qsize()
+    
+    def get_stats(self) -> Dict:
+        """Get batching statistics."""
+        with self._lock:
+            stats = dict(self._stats)
+        
+        stats['queue_depth'] = self.queue_depth()
+        stats['max_batch_size'] = self.max_batch_size
+        stats['max_wait_ms'] = self.max_wait * 1000.0
+        stats['avg_batch_size'] = stats['frames'] / stats['batches'] if stats['batches'] else 0.0
+        
+        return stats
+    
+    def shutdown(self):
+        """Stop the worker threads after the queue drains."""
+        with self._lock:
+            self._stopped = True
+            workers = list(self._workers)
+        
+        for _ in workers:
+            self._queue.put(None)
+        
+        for worker in workers:
+            worker.join()
+    
+    def _ensure_worker(self):
+        """Start one worker thread per replica on first use."""
+        if self._workers:
+            return
+        
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("Inference scheduler has been shut down")
+            
+            if not self._workers:
+                for i in range(self.pool.size):
+                    worker = threading.Thread(
+                        target=self._run,
+                        name=f'inference-scheduler-{i}',
+                        daemon=True
+                    )
+                    worker.start()
+                    self._workers.append(worker)
+    
+    def _run(self):
+        """Worker loop: collect a batch, run it, repeat."""
+        while True:
+            first = self._queue.get()
+            
+            if first is None:
+                return
+            
+            batch = [first]
+            deadline = first.enqueued_at + self.max_wait
+            stop = False
+            
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                
+                try:
+                    if remaining > 0:
+                        pending = self._queue.get(timeout=remaining)
+                    else:
+                        pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                
+                if pending is None:
+                    stop = True
+                    break
+                
+                batch.append(pending)
+            
+            self._run_batch(batch)
+            
+            if stop:
+                return
+    
+    def _run_batch(self, batch: List[_PendingFrame]):
+        """Run one forward pass per (confidence threshold, image size) in the batch."""
+        groups = {}
+        for pending in batch:
+            if pending.future.set_running_or_notify_cancel():
+                key = (pending.conf_threshold, pending.imgsz)
+                groups.setdefault(key, []).append(pending)
+        
+        for (conf_threshold, imgsz), group in groups.items():
+            try:
+                with self.pool.acquire() as detector:
+                    results = detector.detect_sets(
+                        [pending.image for pending in group],
+                        conf_threshold,
+                        imgsz
+                    )
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(group)} frames: {e}")
+                for pending in group:
+                    pending.future.set_exception(e)
+                continue
+            
+            for pending, detections in zip(group, results):
+                pending.future.set_result(detections)
+        
+        with self._lock:
+            self._stats['frames'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['forward_passes'] += len(groups)
@@ -0,0 +1,430 @@
+"""
+Background Job Queue
+SQLite-backed queue and bounded worker pool for long-running analysis jobs.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Job handlers by kind: handler(params, files, progress) -> JSON-serializable result,
+# where files is a list of (filename, path) and progress(done, total) reports progress
+_handlers: Dict[str, Callable] = {}
+
+
+def register_handler(kind: str, handler: Callable):
+    """
+    Register the function that runs jobs of a kind.
+    
+    Args:
+        kind: Job kind passed to JobQueue.submit
+        handler: Callable taking (params, files, progress) and returning the job result
+    """
+    _handlers[kind] = handler
+
+
+class QueueFullError(RuntimeError):
+    """Raised when submitting to a queue that already holds max_pending jobs."""
+
+
+class JobQueue:
+    """
+    Persistent job queue processed by a fixed number of worker threads.
+    
+    Jobs and their results live in a SQLite database and uploaded inputs are
+    stored on disk, so queued jobs survive a restart.
+    
+    Several processes (e.g. gunicorn workers) may share one storage
+    directory. A claimed job records its owner and a lease that the owner's
+    heartbeat thread keeps extending while the job runs. Only running jobs
+    whose lease has expired, because their process died, are queued again.
+    """
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            params TEXT NOT NULL,
+            files TEXT NOT NULL,
+            progress_done INTEGER NOT NULL DEFAULT 0,
+            progress_total INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            owner TEXT,
+            lease_expires_at REAL
+        )
+    """
+    
+    def __init__(
+        self,
+        storage_dir: str,
+        workers: int = 2,
+        max_pending: int = 100,
+        retention_seconds: float = 86400.0,
+        lease_seconds: float = 60.0
+    ):
+        """
+        Initialize job queue.
+        
+        Args:
+            storage_dir: Directory holding the jobs database and uploaded inputs
+            workers: Number of jobs processed concurrently
+            max_pending: Maximum queued or running jobs before submit() is refused
+            retention_seconds: Seconds finished jobs and their results are kept
+            lease_seconds: Seconds a running job stays claimed without a heartbeat
+                from its owner before another process may run it again
+        """
+        self.storage_dir = storage_dir
+        self.db_path = os.path.join(storage_dir, 'jobs.db')
+        self.num_workers = max(1, workers)
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._workers = []
+        self._running_ids = set()
+        
+        os.makedirs(storage_dir, exist_ok=True)
+        
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(self._SCHEMA)
+            
+            # Databases created before leases were added
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in (('owner', 'TEXT'), ('lease_expires_at', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+            
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+    
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection, commit on success and always close it."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def start(self):
+        """Requeue interrupted jobs and start the worker and heartbeat threads."""
+        with self._lock:
+            if self._workers:
+                return
+            
+            with self._connect() as conn:
+                self._requeue_expired(conn)
+            
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            
+            heartbeat = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+            heartbeat.start()
+            self._workers.append(heartbeat)
+    
+    def _requeue_expired(self, conn: sqlite3.Connection) -> int:
+        """Queue again running jobs whose owner stopped renewing their lease."""
+        requeued = conn.execute(
+            'UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, lease_expires_at = NULL '
+            'WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)',
+            (self.QUEUED, self.RUNNING, time.time())
+        ).rowcount
+        
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted job(s)")
+        
+        return requeued
+    
+    def _heartbeat(self):
+        """Extend the leases of the jobs this process is running."""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            
+            with self._lock:
+                job_ids = list(self._running_ids)
+            
+            if not job_ids:
+                continue
+            
+            try:
+                with self._connect() as conn:
+                    conn.executemany(
+                        'UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND owner = ?',
+                        [(time.time() + self.lease_seconds, job_id, self.owner) for job_id in job_ids]
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew job leases: {e}")
+    
+    def submit(
+        self,
+        kind: str,
+        params: Dict[str, Any],
+        files: List[Tuple[str, Any]]
+    ) -> str:
+        """
+        Persist a job and its input files and queue it.
+        
+        Args:
+            kind: Registered job kind
+            params: JSON-serializable job parameters
+            files: (filename, data) pairs, where data is bytes or a readable file object
+        
+        Returns:
+            Job id
+        """
+        if kind not in _handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        
+        self.prune()
+        
+        with self._connect() as conn:
+            pending = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)',
+                (self.QUEUED, self.RUNNING)
+            ).fetchone()[0]
+        
+        if pending >= self.max_pending:
+            raise QueueFullError(f"Job queue is full ({pending} pending jobs)")
+        
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.storage_dir, job_id)
+        os.makedirs(job_dir)
+        
+        stored = []
+        for i, (filename, data) in enumerate(files):
+            # Prefix with the position so duplicate names keep their order
+            path = os.path.join(job_dir, f"{i:04d}_{filename}")
+            with open(path, 'wb') as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    shutil.copyfileobj(data, f)
+            stored.append((filename, path))
+        
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, params, files, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, self.QUEUED, json.dumps(params), json.dumps(stored), time.time())
+            )
+        
+        self.start()
+        
+        with self._wakeup:
+            self._wakeup.notify()
+        
+        return job_id
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Get a job's status and progress.
+        
+        Args:
+            job_id: Job id from submit
+        
+        Returns:
+            Job status dict, or None for an unknown id
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id, kind, status, progress_done, progress_total, error, '
+                'created_at, started_at, finished_at FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        
+        if row is None:
+            return None
+        
+        total = row['progress_total']
+        
+        return {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'progress': {
+                'done': row['progress_done'],
+                'total': total,
+                'fraction': row['progress_done'] / total if total else 0.0
+            },
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+    
+    def get_result(self, job_id: str) -> Optional[Any]:
+        """Get the stored result of a succeeded job (None if there is none)."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        
+        if row is None or row['result'] is None:
+            return None
+        
+        return json.loads(row['result'])
+    
+    def prune(self):
+        """Delete finished jobs older than retention_seconds."""
+        cutoff = time.time() - self.retention_seconds
+        
+        with self._connect() as conn:
+            expired = [
+                row['id'] for row in conn.execute(
+                    'SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                    (self.SUCCEEDED, self.FAILED, cutoff)
+                )
+            ]
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+        
+        for job_id in expired:
+            shutil.rmtree(os.path.join(self.storage_dir, job_id), ignore_errors=True)
+    
+    def get_stats(self) -> Dict:
+        """Get job counts by status."""
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        
+        stats = {status: counts.get(status, 0) for status in (self.QUEUED, self.RUNNING, self.SUCCEEDED, self.FAILED)}
+        stats['workers'] = self.num_workers
+        stats['max_pending'] = self.max_pending
+        
+        return stats
+    
+    def _claim_next(self) -> Optional[sqlite3.Row]:
+        """Atomically move the oldest queued job to running, leased to this process."""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._requeue_expired(conn)
+            
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1',
+                (self.QUEUED,)
+            ).fetchone()
+            
+            if row is not None:
+                now = time.time()
+                conn.execute(
+                    'UPDATE jobs SET status = ?, started_at = ?, owner = ?, lease_expires_at = ? WHERE id = ?',
+                    (self.RUNNING, now, self.owner, now + self.lease_seconds, row['id'])
+                )
+                
+                with self._lock:
+                    self._running_ids.add(row['id'])
+        
+        return row
+    
+    def _run(self):
+        """Worker loop: claim a job, run it, repeat."""
+        while True:
+            try:
+                row = self._claim_next()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to claim job: {e}")
+                row = None
+            
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            
+            self._execute(row)
+    
+    def _execute(self, row: sqlite3.Row):
+        """Run one claimed job and store its result or error."""
+        job_id = row['id']
+        files = [tuple(f) for f in json.loads(row['files'])]
+        
+        def progress(done: int, total: int):
+            with self._connect() as conn:
+                conn.execute(
+                    'UPDATE jobs SET progress_done = ?, progress_total = ? WHERE id = ?',
+                    (done, total, job_id)
+                )
+        
+        finished = 0
+        
+        try:
+            handler = _handlers.get(row['kind'])
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{row['kind']}'")
+            
+            result = handler(json.loads(row['params']), files, progress)
+            
+            with self._connect() as conn:
+                finished = conn.execute(
+                    'UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_expires_at = NULL '
+                    'WHERE id = ? AND owner = ?',
+                    (self.SUCCEEDED, json.dumps(result), time.time(), job_id, self.owner)
+                ).rowcount
+            
+            logger.info(f"Job {job_id} ({row['kind']}) succeeded")
+        
+        except Exception as e:
+            logger.error(f"Job {job_id} ({row['kind']}) failed: {e}")
+            
+            with self._connect() as conn:
+                finished = conn.execute(
+                    'UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL '
+                    'WHERE id = ? AND owner = ?',
+                    (self.FAILED, str(e), time.time(), job_id, self.owner)
+                ).rowcount
+        
+        finally:
+            with self._lock:
+                self._running_ids.discard(job_id)
+        
+        if not finished:
+            # The lease expired and another process has taken the job over
+            logger.warning(f"Job {job_id} was requeued while it ran; keeping its inputs")
+            return
+        
+        # Inputs are only needed until the job has run
+        shutil.rmtree(os.path.join(self.storage_dir, job_id), ignore_errors=True)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Get the process-wide JobQueue configured from the environment."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(
+                    storage_dir=os.getenv('JOB_STORAGE_DIR') or os.path.join(
+                        os.path.dirname(__file__), '..', '..', 'uploads', 'jobs'
+                    ),
+                    workers=int(os.getenv('JOB_WORKERS', 2)),
+                    max_pending=int(os.getenv('JOB_MAX_PENDING', 100)),
+                    retention_seconds=float(os.getenv('JOB_RETENTION_SECONDS', 86400)),
+                    lease_seconds=float(os.getenv('JOB_LEASE_SECONDS', 60))
+                )
+    return _queue
@@ -0,0 +1,316 @@
+"""
+Model Registry Service
+Process-wide, thread-safe ownership of loaded models shared by all blueprints.
+"""
+
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ModelHandle:
+    """Reference-counted checkout of one model replica."""
+    
+    __slots__ = ('_pool', 'model', '_released')
+    
+    def __init__(self, pool: 'ModelPool', model: Any):
+        self._pool = pool
+        self.model = model
+        self._released = False
+    
+    def release(self):
+        """Return the replica to its pool. Safe to call more than once."""
+        if not self._released:
+            self._released = True
+            self._pool._release(self.model)
+    
+    def __enter__(self):
+        return self.model
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ModelPool:
+    """
+    Lazily loaded pool of identical model replicas.
+    
+    The first caller loads every replica while holding the pool lock, so
+    concurrent first requests wait for one load instead of each loading their
+    own copy. acquire() hands out replicas exclusively; get() returns a shared
+    replica for thread-safe, non-inference use such as metadata or drawing.
+    """
+    
+    def __init__(self, name: str, factory: Callable[[], Any], replicas: int = 1):
+        """
+        Initialize model pool.
+        
+        Args:
+            name: Registry name of the model
+            factory: Callable creating one replica
+            replicas: Number of replicas to load for concurrent inference
+        """
+        self.name = name
+        self.factory = factory
+        self.size = max(1, replicas)
+        
+        self._load_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._replicas: List[Any] = []
+        self._idle = queue.Queue()
+        self._refcount = 0
+    
+    def is_loaded(self) -> bool:
+        """Check whether the replicas have been created."""
+        return bool(self._replicas)
+    
+    def load(self):
+        """Create all replicas if they do not exist yet."""
+        if self._replicas:
+            return
+        
+        with self._load_lock:
+            if self._replicas:
+                return
+            
+            logger.info(f"Loading {self.size} replica(s) of model '{self.name}'")
+            replicas = [self.factory() for _ in range(self.size)]
+            
+            for replica in replicas:
+                self._idle.put(replica)
+            
+            self._replicas = replicas
+    
+    def get(self) -> Any:
+        """Get a shared replica without checking it out."""
+        self.load()
+        return self._replicas[0]
+    
+    def acquire(self, timeout: Optional[float] = None) -> ModelHandle:
+        """
+        Check out a replica for exclusive use.
+        
+        Args:
+            timeout: Optional seconds to wait for an idle replica
+        
+        Returns:
+            Handle to release (or use as a context manager) when done
+        """
+        self.load()
+        
+        try:
+            replica = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No idle replica of model '{self.name}' within {timeout}s")
+        
+        with self._count_lock:
+            self._refcount += 1
+        
+        return ModelHandle(self, replica)
+    
+    def _release(self, replica: Any):
+        with self._count_lock:
+            self._refcount -= 1
+        self._idle.put(replica)
+    
+    def unload(self):
+        """Drop all replicas. Fails while any handle is still checked out."""
+        with self._load_lock:
+            with self._count_lock:
+                if self._refcount:
+                    raise RuntimeError(f"Model '{self.name}' has {self._refcount} active handle(s)")
+                
+                self._replicas = []
+                self._idle = queue.Queue()
+    
+    def get_stats(self) -> Dict:
+        """Get pool status."""
+        with self._count_lock:
+            in_use = self._refcount
+        
+        return {
+            'loaded': self.is_loaded(),
+            'replicas': self.size,
+            'in_use': in_use
+        }
+
+
+class ModelRegistry:
+    """Named model pools and their inference schedulers."""
+    
+    WARMUP_IDLE = 'idle'
+    WARMUP_RUNNING = 'running'
+    WARMUP_READY = 'ready'
+    WARMUP_FAILED = 'failed'
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, ModelPool] = {}
+        self._schedulers: Dict[str, Any] = {}
+        self.warmup_state = self.WARMUP_IDLE
+        self.warmup_error: Optional[str] = None
+    
+    def register(self, name: str, factory: Callable[[], Any], replicas: int = 1):
+        """
+        Register a model factory under a name. Nothing is loaded until first use.
+        
+        Args:
+            name: Registry name of the model
+            factory: Callable creating one replica
+            replicas: Number of replicas to load for concurrent inference
+        """
+        with self._lock:
+            self._pools[name] = ModelPool(name, factory, replicas)
+    
+    def pool(self, name: str) -> ModelPool:
+        """Get the pool registered under name."""
+        try:
+            return self._pools[name]
+        except KeyError:
+            raise KeyError(f"No model registered as '{name}'")
+    
+    def get(self, name: str) -> Any:
+        """Get a shared replica of a model, loading it if needed."""
+        return self.pool(name).get()
+    
+    def acquire(self, name: str, timeout: Optional[float] = None) -> ModelHandle:
+        """Check out a replica of a model for exclusive use."""
+        return self.pool(name).acquire(timeout)
+    
+    def scheduler(self, name: str):
+        """Get or create the micro-batching InferenceScheduler for a detector."""
+        scheduler = self._schedulers.get(name)
+        if scheduler is not None:
+            return scheduler
+        
+        from app.services.inference_scheduler import InferenceScheduler
+        
+        with self._lock:
+            if name not in self._schedulers:
+                self._schedulers[name] = InferenceScheduler(
+                    self.pool(name),
+                    max_wait_ms=float(os.getenv('YOLO_SCHEDULER_MAX_WAIT_MS', 5))
+                )
+            return self._schedulers[name]
+    
+    def warmup(
+        self,
+        names: Optional[List[str]] = None,
+        sizes: Optional[List[int]] = None,
+        runs: int = 2
+    ):
+        """
+        Load models and run dummy inferences on every replica that supports it.
+        
+        Args:
+            names: Models to warm up (default: all registered models)
+            sizes: Image sizes passed to each replica's warmup()
+            runs: Forward passes per size
+        """
+        self.warmup_state = self.WARMUP_RUNNING
+        
+        try:
+            for name in names or self.names():
+                pool = self.pool(name)
+                handles = []
+                
+                # Replicas are checked out like any inference, so scheduler and
+                # job threads never run one concurrently with its warm-up. Each
+                # stays checked out until all are warm, so every replica is visited.
+                try:
+                    for _ in range(pool.size):
+                        handle = pool.acquire()
+                        handles.append(handle)
+                        
+                        if hasattr(handle.model, 'warmup'):
+                            handle.model.warmup(sizes=sizes, runs=runs)
+                finally:
+                    for handle in handles:
+                        handle.release()
+                
+                logger.info(f"Model '{name}' warmed up")
+            
+            self.warmup_state = self.WARMUP_READY
+            
+        except Exception as e:
+            logger.error(f"Model warm-up failed: {e}")
+            self.warmup_error = str(e)
+            self.warmup_state = self.WARMUP_FAILED
+    
+    def start_warmup(self, **kwargs) -> threading.Thread:
+        """Run warmup() in a background thread so the app can serve health checks."""
+        self.warmup_state = self.WARMUP_RUNNING
+        
+        thread = threading.Thread(
+            target=self.warmup,
+            kwargs=kwargs,
+            name='model-warmup',
+            daemon=True
+        )
+        thread.start()
+        
+        return thread
+    
+    def is_ready(self) -> bool:
+        """Models are ready unless a warm-up is running or has failed."""
+        return self.warmup_state in (self.WARMUP_IDLE, self.WARMUP_READY)
+    
+    def names(self) -> List[str]:
+        """Get registered model names."""
+        return list(self._pools.keys())
+    
+    def get_stats(self) -> Dict:
+        """Get status of every registered model."""
+        stats = {}
+        for name, pool in list(self._pools.items()):
+            stats[name] = pool.get_stats()
+            if name in self._schedulers:
+                stats[name]['scheduler'] = self._schedulers[name].get_stats()
+        return stats
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _create_detector():
+    from app.services.yolo_detector import YOLODetector
+    
+    return YOLODetector(
+        max_batch_size=int(os.getenv('YOLO_MAX_BATCH_SIZE', 16)),
+        backend=os.getenv('YOLO_BACKEND', 'ultralytics'),
+        onnx_path=os.getenv('YOLO_ONNX_PATH') or None,
+        intra_op_threads=int(os.getenv('ORT_INTRA_OP_THREADS', 0)) or None,
+        inter_op_threads=int(os.getenv('ORT_INTER_OP_THREADS', 0)) or None,
+        tile_size=int(os.getenv('YOLO_TILE_SIZE', 640)),
+        tile_overlap=float(os.getenv('YOLO_TILE_OVERLAP', 0.2)),
+        max_tiles=int(os.getenv('YOLO_MAX_TILES', 16)),
+        imgsz_ladder=[int(s) for s in os.getenv('YOLO_IMGSZ_LADDER', '').split(',') if s.strip()] or None
+    )
+
+
+def _create_tagger():
+    from app.services.rag_tagger import RAGTagger
+    
+    return RAGTagger(use_vector_db=False)  # Use direct lookup for faster response
+
+
+def get_registry() -> ModelRegistry:
+    """Get the process-wide ModelRegistry with the default models registered."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = ModelRegistry()
+                registry.register(
+                    'yolo_detector',
+                    _create_detector,
+                    replicas=int(os.getenv('YOLO_REPLICAS', 1))
+                )
+                registry.register('rag_tagger', _create_tagger)
+                _registry = registry
+    return _registry
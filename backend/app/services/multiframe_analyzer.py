@@ -4,8 +4,12 @@ Analyzes multiple frames together to improve detection accuracy and eliminate fa
 """
 
 import numpy as np
-from typing import List, Dict, Tuple, Optional
-from scipy.spatial.distance import cdist
+from typing import List, Dict, Iterator, Tuple, Optional, Sequence, Union
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.optimize import linear_sum_assignment
+from app.services.detection_set import DetectionSet
+from app.services.box_ops import pairwise_iou, paired_iou
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,11 +21,24 @@ class MultiFrameAnalyzer:
     Validates detections across viewpoints using spatial correlation.
     """
     
+    MATCHING_MODES = ('cluster', 'track')
+    TRACK_COSTS = ('iou', 'center')
+    
+    # Candidate pairs generated at once by the grid index
+    GRID_PAIRS_PER_CHUNK = 1_000_000
+    
     def __init__(
         self,
         iou_threshold: float = 0.3,
         confidence_boost: float = 0.15,
-        min_frames_for_validation: int = 2
+        min_frames_for_validation: int = 2,
+        dense_max_detections: int = 2048,
+        grid_cell_size: Optional[float] = None,
+        matching: str = 'cluster',
+        track_cost: str = 'iou',
+        max_center_distance: Optional[float] = None,
+        max_missed_frames: int = 1,
+        window: Optional[int] = None
     ):
         """
         Initialize multi-frame analyzer.
@@ -30,10 +47,36 @@ class MultiFrameAnalyzer:
             iou_threshold: IoU threshold for matching detections across frames
             confidence_boost: Confidence boost for validated detections
             min_frames_for_validation: Minimum frames needed to validate a detection
+            dense_max_detections: Largest per-class detection count matched with a
+                full IoU matrix; larger inputs use a grid index instead
+            grid_cell_size: Grid index cell size in pixels (default: twice the
+                median box side)
+            matching: 'cluster' to group overlapping detections from any frames,
+                or 'track' to assign detections between consecutive frames
+            track_cost: Assignment cost in track mode, 'iou' (1 - IoU, linked
+                when IoU reaches iou_threshold) or 'center' (center distance)
+            max_center_distance: Largest center distance linked with the 'center'
+                cost (default: the diagonal of the track's last box)
+            max_missed_frames: Frames a track may go undetected before it ends
+            window: Frames a cluster in a stream() stays open without a new
+                match before it is emitted and dropped (default: clusters stay
+                open until the stream is closed)
         """
+        if matching not in self.MATCHING_MODES:
+            raise ValueError(f"Unknown matching mode '{matching}', expected one of {self.MATCHING_MODES}")
+        if track_cost not in self.TRACK_COSTS:
+            raise ValueError(f"Unknown track cost '{track_cost}', expected one of {self.TRACK_COSTS}")
+        
         self.iou_threshold = iou_threshold
         self.confidence_boost = confidence_boost
         self.min_frames_for_validation = min_frames_for_validation
+        self.dense_max_detections = dense_max_detections
+        self.grid_cell_size = grid_cell_size
+        self.matching = matching
+        self.track_cost = track_cost
+        self.max_center_distance = max_center_distance
+        self.max_missed_frames = max_missed_frames
+        self.window = window
     
     def calculate_iou(self, bbox1, bbox2) -> float:
         """
@@ -110,152 +153,359 @@ class MultiFrameAnalyzer:
     
     def match_detections_across_frames(
         self,
-        frame_detections: List[List[Dict]]
-    ) -> List[Dict]:
+        frame_detections: Sequence[Union[DetectionSet, List[Dict]]]
+    ) -> DetectionSet:
         """
         Match detections across multiple frames using spatial correlation.
         
         Args:
-            frame_detections: List of detection lists, one per frame
+            frame_detections: One DetectionSet (or list of detection dicts) per frame
             
         Returns:
-            List of validated detections with aggregated confidence
+            DetectionSet of validated detections with aggregated confidence
         """
         if not frame_detections or len(frame_detections) < self.min_frames_for_validation:
             logger.warning(f"Not enough frames for validation (got {len(frame_detections)}, need {self.min_frames_for_validation})")
-            return frame_detections[0] if frame_detections else []
+            return DetectionSet.from_frames(frame_detections[:1])
         
-        class_groups = {}
+        if self.matching == 'track':
+            return self._match_streaming(frame_detections)
         
-        for frame_idx, detections in enumerate(frame_detections):
-            for det in detections:
-                class_name = det['class_name']
-                
-                if class_name not in class_groups:
-                    class_groups[class_name] = []
-                
-                det_with_frame = {**det, 'frame_idx': frame_idx}
-                class_groups[class_name].append(det_with_frame)
+        detections = DetectionSet.from_frames(frame_detections)
         
-        validated_detections = []
+        return self._aggregate_clusters(detections, self._validated_clusters(detections))
+    
+    def stream(self) -> 'MultiFrameStream':
+        """
+        Start incremental matching over frames pushed one at a time.
         
-        for class_name, detections in class_groups.items():
-            clusters = self._cluster_detections(detections)
-            
-            for cluster in clusters:
-                if len(cluster) >= self.min_frames_for_validation:
-                    validated_det = self._aggregate_cluster(cluster)
-                    validated_detections.append(validated_det)
+        Returns:
+            MultiFrameStream using this analyzer's settings
+        """
+        return MultiFrameStream(self)
+    
+    def _match_streaming(self, frame_detections: Sequence[Union[DetectionSet, List[Dict]]]) -> DetectionSet:
+        """Push every frame through a stream and collect what it emits."""
+        stream = self.stream()
+        
+        emitted = [stream.push_frame(detections) for detections in frame_detections]
+        emitted.append(stream.close())
+        
+        validated = DetectionSet.concatenate(emitted)
         
-        return validated_detections
+        if self.matching == 'track' and len(validated):
+            # Tracks are emitted when they end; report them in order of birth
+            track_ids = [attrs['validation']['track_id'] for attrs in validated.attrs]
+            validated = validated[np.argsort(track_ids, kind='stable')]
+        
+        return validated
     
-    def _cluster_detections(self, detections: List[Dict]) -> List[List[Dict]]:
+    @staticmethod
+    def _observed_mask(detections: DetectionSet) -> np.ndarray:
         """
-        Cluster detections based on spatial overlap.
+        Mask of detections that were observed rather than carried by optical flow.
+        
+        Propagated detections link clusters and tracks but do not count as
+        independent observations toward min_frames_for_validation.
+        """
+        if detections.attrs is None:
+            return np.ones(len(detections), dtype=bool)
+        
+        return np.array([not (attrs and attrs.get('propagated')) for attrs in detections.attrs], dtype=bool)
+    
+    def _is_validated(self, detections: DetectionSet, observed: np.ndarray, cluster: np.ndarray) -> bool:
+        """Check whether a cluster was observed in enough distinct frames."""
+        frames = np.unique(detections.frame_ids[cluster[observed[cluster]]])
+        return len(frames) >= self.min_frames_for_validation
+    
+    def _validated_clusters(self, detections: DetectionSet) -> List[np.ndarray]:
+        """
+        Cluster all detections at once and keep the validated clusters.
         
         Args:
-            detections: List of detections from multiple frames
+            detections: Detections from all frames
             
         Returns:
-            List of detection clusters
+            Clusters as arrays of indices into detections, grouped by class in
+            order of first appearance
         """
-        if not detections:
-            return []
+        observed = self._observed_mask(detections)
+        
+        # Classes in order of first appearance
+        class_ids, first_seen = np.unique(detections.class_ids, return_index=True)
         
         clusters = []
-        used = set()
         
-        for i, det1 in enumerate(detections):
-            if i in used:
-                continue
+        for class_id in class_ids[np.argsort(first_seen)]:
+            indices = np.flatnonzero(detections.class_ids == class_id)
             
-            cluster = [det1]
-            used.add(i)
+            for cluster in self._cluster_detections(detections[indices]):
+                cluster = indices[cluster]
+                if self._is_validated(detections, observed, cluster):
+                    clusters.append(cluster)
+        
+        return clusters
+    
+    def _cluster_detections(self, detections: DetectionSet) -> List[np.ndarray]:
+        """
+        Cluster detections based on spatial overlap.
+        
+        Two detections from different frames are linked when their IoU reaches
+        the threshold; clusters are the connected components of that graph, so
+        matches are transitive across frames. Small inputs compute IoU for all
+        pairs at once as a matrix. Above dense_max_detections, only pairs of
+        boxes sharing a grid cell are compared, so memory grows with the number
+        of nearby pairs rather than quadratically.
+        
+        Args:
+            detections: Detections of one class from multiple frames
             
-            for j, det2 in enumerate(detections):
-                if j in used or j <= i:
-                    continue
+        Returns:
+            List of clusters as arrays of indices into detections, ordered by
+            their first detection
+        """
+        if len(detections) == 0:
+            return []
+        
+        boxes = detections.boxes
+        frame_ids = detections.frame_ids
+        
+        # A non-positive threshold links boxes that do not overlap at all,
+        # which the grid index cannot find
+        if len(detections) <= self.dense_max_detections or self.iou_threshold <= 0:
+            linked = pairwise_iou(boxes, boxes) >= self.iou_threshold
+            linked &= frame_ids[:, None] != frame_ids[None, :]
+            graph = csr_matrix(np.triu(linked, 1))
+        else:
+            edges = []
+            for first, second in self._grid_candidate_pairs(boxes):
+                linked = frame_ids[first] != frame_ids[second]
+                first, second = first[linked], second[linked]
                 
-                if det1['frame_idx'] != det2['frame_idx']:
-                    iou = self.calculate_iou(det1['bbox'], det2['bbox'])
-                    
-                    if iou >= self.iou_threshold:
-                        cluster.append(det2)
-                        used.add(j)
+                linked = paired_iou(boxes[first], boxes[second]) >= self.iou_threshold
+                edges.append((first[linked], second[linked]))
             
-            clusters.append(cluster)
+            first = np.concatenate([edge[0] for edge in edges])
+            second = np.concatenate([edge[1] for edge in edges])
+            graph = coo_matrix(
+                (np.ones(len(first), dtype=bool), (first, second)),
+                shape=(len(detections), len(detections))
+            )
         
-        return clusters
+        _, labels = connected_components(graph, directed=False)
+        
+        return self._split_labels(labels)
     
-    def _aggregate_cluster(self, cluster: List[Dict]) -> Dict:
+    def _grid_candidate_pairs(self, boxes: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
         """
-        Aggregate a cluster of detections into a single validated detection.
+        Find pairs of boxes that share at least one cell of a uniform grid.
+        
+        Every box is entered into each cell its extent covers, so any two
+        overlapping boxes share a cell. Pairs are yielded for runs of cells
+        holding at most GRID_PAIRS_PER_CHUNK pairs, so a crowded scene never
+        materializes all candidate pairs at once.
         
         Args:
-            cluster: List of matching detections from different frames
+            boxes: Boxes with shape (N, 4) as [x1, y1, x2, y2]
+            
+        Yields:
+            Tuples of index arrays (first, second) with first < second; each
+            pair is yielded once
+        """
+        cell_size = self.grid_cell_size
+        if not cell_size:
+            sides = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+            cell_size = max(2.0 * float(np.median(sides)), 1.0)
+        
+        low = np.floor(boxes[:, :2] / cell_size).astype(np.int64)
+        high = np.floor(boxes[:, 2:] / cell_size).astype(np.int64)
+        origin = low.min(axis=0)
+        low -= origin
+        high -= origin
+        
+        # One (cell, box) entry per covered cell
+        span = high - low + 1
+        cells_per_box = span[:, 0] * span[:, 1]
+        box_index = np.repeat(np.arange(len(boxes)), cells_per_box)
+        offset = np.arange(len(box_index)) - np.repeat(np.cumsum(cells_per_box) - cells_per_box, cells_per_box)
+        cell_x = low[box_index, 0] + offset % span[box_index, 0]
+        cell_y = low[box_index, 1] + offset // span[box_index, 0]
+        cell_key = cell_x * (int(high[:, 1].max()) + 1) + cell_y
+        
+        order = np.lexsort((box_index, cell_key))
+        box_index = box_index[order]
+        cell_x = cell_x[order]
+        cell_y = cell_y[order]
+        cell_key = cell_key[order]
+        
+        cell_starts = np.flatnonzero(np.r_[True, cell_key[1:] != cell_key[:-1]])
+        cell_ends = np.r_[cell_starts[1:], len(cell_key)]
+        entry_end = np.repeat(cell_ends, cell_ends - cell_starts)
+        
+        # Every entry pairs with the later entries of its cell
+        partners = entry_end - np.arange(len(cell_key)) - 1
+        pair_ends = np.cumsum(partners)
+        
+        chunk_start = 0
+        while chunk_start < len(cell_key):
+            # Whole cells only; a single cell larger than the limit is one chunk
+            limit = pair_ends[chunk_start] - partners[chunk_start] + self.GRID_PAIRS_PER_CHUNK
+            chunk_cells = np.searchsorted(cell_ends, chunk_start, side='right')
+            chunk_end = int(cell_ends[max(
+                np.searchsorted(pair_ends[cell_ends - 1], limit, side='right') - 1,
+                chunk_cells
+            )])
+            
+            positions = np.arange(chunk_start, chunk_end)
+            counts = partners[chunk_start:chunk_end]
+            left = np.repeat(positions, counts)
+            right = left + 1 + np.arange(len(left)) - np.repeat(np.cumsum(counts) - counts, counts)
+            chunk_start = chunk_end
+            
+            first = box_index[left]
+            second = box_index[right]
+            
+            # Boxes sharing several cells meet in each of them; keep only the
+            # cell holding the top-left corner of their overlap
+            owner = (
+                (cell_x[left] == np.maximum(low[first, 0], low[second, 0]))
+                & (cell_y[left] == np.maximum(low[first, 1], low[second, 1]))
+            )
+            
+            yield first[owner], second[owner]
+    
+    def _assignment_cost(
+        self,
+        detections: DetectionSet,
+        previous: np.ndarray,
+        current: np.ndarray
+    ) -> np.ndarray:
+        """
+        Cost of assigning current detections to the last detections of tracks.
+        
+        Args:
+            detections: Detections from all frames
+            previous: Index of each track's last detection
+            current: Indices of the current frame's detections
             
         Returns:
-            Aggregated detection with boosted confidence
+            Cost matrix with shape (len(previous), len(current)); pairs that
+            may not be linked are inf
         """
-        bbox_coords = []
-        for d in cluster:
-            if isinstance(d['bbox'], list):
-                bbox_coords.append(d['bbox'])
-            else:
-                bbox_coords.append([d['bbox']['x1'], d['bbox']['y1'], d['bbox']['x2'], d['bbox']['y2']])
+        boxes = detections.boxes
+        same_class = detections.class_ids[previous][:, None] == detections.class_ids[current][None, :]
         
-        avg_bbox = [
-            np.mean([b[0] for b in bbox_coords]),
-            np.mean([b[1] for b in bbox_coords]),
-            np.mean([b[2] for b in bbox_coords]),
-            np.mean([b[3] for b in bbox_coords])
-        ]
+        if self.track_cost == 'iou':
+            iou = pairwise_iou(boxes[previous], boxes[current])
+            return np.where(same_class & (iou >= self.iou_threshold), 1.0 - iou, np.inf)
         
-        avg_center = [
-            (avg_bbox[0] + avg_bbox[2]) / 2,
-            (avg_bbox[1] + avg_bbox[3]) / 2
-        ]
+        centers = detections.centers
+        distance = np.linalg.norm(centers[previous][:, None, :] - centers[current][None, :, :], axis=2)
+        
+        limit = self.max_center_distance
+        if limit is None:
+            limit = np.hypot(
+                boxes[previous, 2] - boxes[previous, 0],
+                boxes[previous, 3] - boxes[previous, 1]
+            )[:, None]
+        
+        return np.where(same_class & (distance <= limit), distance, np.inf)
+    
+    @staticmethod
+    def _split_labels(labels: np.ndarray) -> List[np.ndarray]:
+        """Group indices by component label, in order of each component's first index."""
+        order = np.argsort(labels, kind='stable')
+        boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+        clusters = np.split(order, boundaries)
+        clusters.sort(key=lambda cluster: cluster[0])
+        return clusters
+    
+    def _aggregate_clusters(
+        self,
+        detections: DetectionSet,
+        clusters: List[np.ndarray],
+        track_ids: Optional[List[int]] = None
+    ) -> DetectionSet:
+        """
+        Aggregate clusters of detections into validated detections.
         
-        avg_area = (avg_bbox[2] - avg_bbox[0]) * (avg_bbox[3] - avg_bbox[1])
-        
-        avg_confidence = np.mean([d['confidence'] for d in cluster])
-        boosted_confidence = min(1.0, avg_confidence + self.confidence_boost)
-        
-        aggregated = {
-            'class_id': cluster[0].get('class_id', 0),
-            'class_name': cluster[0]['class_name'],
-            'confidence': boosted_confidence,
-            'original_confidence': avg_confidence,
-            'bbox': avg_bbox,
-            'bbox_center': avg_center,
-            'bbox_area': avg_area,
-            'validation': {
-                'validated': True,
-                'num_frames': len(cluster),
-                'frame_indices': [d['frame_idx'] for d in cluster],
-                'confidence_boost': self.confidence_boost,
-                'individual_confidences': [d['confidence'] for d in cluster]
+        Args:
+            detections: All detections
+            clusters: Arrays of indices into detections, one per cluster
+            track_ids: Optional track id per cluster, added to the validation info
+            
+        Returns:
+            DetectionSet with one averaged, confidence-boosted detection per cluster
+        """
+        if not clusters:
+            empty = DetectionSet.empty(detections.class_names)
+            empty.box_format = 'list'
+            return empty
+        
+        order = np.concatenate(clusters)
+        sizes = np.array([len(cluster) for cluster in clusters])
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        
+        avg_boxes = np.add.reduceat(detections.boxes[order].astype(np.float64), starts) / sizes[:, None]
+        avg_confidences = np.add.reduceat(detections.scores[order].astype(np.float64), starts) / sizes
+        boosted_confidences = np.minimum(1.0, avg_confidences + self.confidence_boost)
+        
+        frame_ids = detections.frame_ids.tolist()
+        scores = detections.scores.tolist()
+        
+        attrs = [
+            {
+                'original_confidence': avg_confidence,
+                'validation': {
+                    'validated': True,
+                    'num_frames': len(set(frame_ids[i] for i in cluster)),
+                    'frame_indices': [frame_ids[i] for i in cluster],
+                    'confidence_boost': self.confidence_boost,
+                    'individual_confidences': [scores[i] for i in cluster]
+                }
             }
-        }
+            for cluster, avg_confidence in zip(
+                (cluster.tolist() for cluster in clusters),
+                avg_confidences.tolist()
+            )
+        ]
         
-        return aggregated
+        if track_ids is not None:
+            for attr, track_id in zip(attrs, track_ids):
+                attr['validation']['track_id'] = track_id
+        
+        return DetectionSet(
+            avg_boxes,
+            boosted_confidences,
+            detections.class_ids[order[starts]],
+            detections.class_names,
+            detections.frame_ids[order[starts]],
+            attrs,
+            box_format='list'
+        )
     
     def analyze_frames(
         self,
-        frame_detections: List[List[Dict]],
+        frame_detections: Sequence[Union[DetectionSet, List[Dict]]],
         frame_metadata: Optional[List[Dict]] = None
     ) -> Dict:
         """
         Perform comprehensive multi-frame analysis.
         
+        A thin wrapper that pushes every frame through a stream(); use a stream
+        directly to analyze footage as it arrives.
+        
         Args:
-            frame_detections: List of detection lists, one per frame
+            frame_detections: One DetectionSet (or list of detection dicts) per frame
             frame_metadata: Optional metadata for each frame (e.g., timestamps, angles)
             
         Returns:
-            Analysis results with validated detections and statistics
+            Analysis results with validated detections (a DetectionSet) and statistics
         """
-        validated_detections = self.match_detections_across_frames(frame_detections)
+        if len(frame_detections) < self.min_frames_for_validation:
+            validated_detections = self.match_detections_across_frames(frame_detections)
+        else:
+            validated_detections = self._match_streaming(frame_detections)
         
         total_detections_before = sum(len(dets) for dets in frame_detections)
         total_detections_after = len(validated_detections)
@@ -265,10 +515,11 @@ class MultiFrameAnalyzer:
         else:
             reduction_rate = 0.0
         
-        class_counts = {}
-        for det in validated_detections:
-            class_name = det['class_name']
-            class_counts[class_name] = class_counts.get(class_name, 0) + 1
+        class_ids, counts = np.unique(validated_detections.class_ids, return_counts=True)
+        class_counts = {
+            validated_detections.class_names[class_id]: count
+            for class_id, count in zip(class_ids.tolist(), counts.tolist())
+        }
         
         return {
             'validated_detections': validated_detections,
@@ -278,37 +529,40 @@ class MultiFrameAnalyzer:
                 'total_detections_after': total_detections_after,
                 'false_positive_reduction_rate': reduction_rate,
                 'detections_by_class': class_counts,
-                'avg_confidence': np.mean([d['confidence'] for d in validated_detections]) if validated_detections else 0.0
+                'avg_confidence': float(validated_detections.scores.mean()) if len(validated_detections) else 0.0
             },
             'frame_metadata': frame_metadata or []
         }
     
     def filter_low_confidence(
         self,
-        detections: List[Dict],
+        detections: Union[DetectionSet, List[Dict]],
         min_confidence: float = 0.3
-    ) -> List[Dict]:
+    ) -> Union[DetectionSet, List[Dict]]:
         """
         Filter out low-confidence detections.
         
         Args:
-            detections: List of detections
+            detections: DetectionSet or list of detections
             min_confidence: Minimum confidence threshold
             
         Returns:
-            Filtered detections
+            Filtered detections of the same type
         """
+        if isinstance(detections, DetectionSet):
+            return detections[detections.scores >= min_confidence]
+        
         return [d for d in detections if d['confidence'] >= min_confidence]
     
     def handle_partial_occlusions(
         self,
-        frame_detections: List[List[Dict]]
-    ) -> List[Dict]:
+        frame_detections: Sequence[Union[DetectionSet, List[Dict]]]
+    ) -> DetectionSet:
         """
         Handle partial occlusions by validating across viewpoints.
         
         Args:
-            frame_detections: List of detection lists from different viewpoints
+            frame_detections: One DetectionSet (or list of detection dicts) per viewpoint
             
         Returns:
             Validated detections that handle occlusions
@@ -316,10 +570,219 @@ class MultiFrameAnalyzer:
         
         validated = self.match_detections_across_frames(frame_detections)
         
-        occlusion_handled = []
+        num_frames = np.array(
+            [det.attrs.get('validation', {}).get('num_frames', 0) for det in validated],
+            dtype=np.int64
+        )
+        
+        return validated[num_frames >= 2]
+        
+
+
+class MultiFrameStream:
+    """
+    Incremental multi-frame matching with bounded state.
+    
+    Frames are pushed one at a time. Each push links the frame's detections
+    to the open clusters (or tracks) and returns the validated detections of
+    those that can no longer grow: clusters with no match within the
+    analyzer's window frames, and tracks unmatched for more than
+    max_missed_frames. Their detections are then dropped, so state is bounded
+    by the window rather than by the length of the footage.
+    
+    Without a window, no cluster can close early, so clustering is deferred to
+    close() and done in one vectorized pass.
+    """
+    
+    def __init__(self, analyzer: MultiFrameAnalyzer):
+        """
+        Initialize stream.
+        
+        Args:
+            analyzer: MultiFrameAnalyzer whose settings are used
+        """
+        self.analyzer = analyzer
+        self.num_frames = 0
+        self.total_detections = 0
+        
+        # Detections of open clusters or tracks with their cluster or track id
+        self._open: Optional[DetectionSet] = None
+        self._labels = np.empty(0, dtype=np.int64)
+        self._next_label = 0
+        
+        # Class id -> order of first appearance, to emit clusters in batch order
+        self._class_rank: Dict[int, int] = {}
+        
+        # Track id -> (frame id, row) of its last detection
+        self._track_last: Dict[int, Tuple[int, int]] = {}
+    
+    def push_frame(self, detections: Union[DetectionSet, List[Dict]]) -> DetectionSet:
+        """
+        Add the next frame's detections.
+        
+        Args:
+            detections: DetectionSet (or list of detection dicts) for the frame
+            
+        Returns:
+            Validated detections of the clusters or tracks closed by this frame
+        """
+        frame_id = self.num_frames
+        self.num_frames += 1
+        self.total_detections += len(detections)
+        
+        if isinstance(detections, DetectionSet):
+            frame = detections.copy()
+        else:
+            frame = DetectionSet.from_dicts(detections, self._open.class_names if self._open is not None else None)
+        frame.frame_ids = np.full(len(frame), frame_id, dtype=np.int64)
+        
+        for class_id in frame.class_ids.tolist():
+            self._class_rank.setdefault(class_id, len(self._class_rank))
+        
+        start = len(self._labels)
+        self._open = frame if self._open is None else DetectionSet.concatenate([self._open, frame])
+        self._labels = np.concatenate([self._labels, np.full(len(frame), -1, dtype=np.int64)])
+        new = np.arange(start, len(self._labels))
         
-        for det in validated:
-            if det.get('validation', {}).get('num_frames', 0) >= 2:
-                occlusion_handled.append(det)
+        if self.analyzer.matching == 'track':
+            self._assign_tracks(new, frame_id)
+            return self._emit(self._ended_tracks(frame_id))
+        
+        if self.analyzer.window is None:
+            return self._empty()
+        
+        self._link_clusters(new, frame_id)
+        return self._emit(self._stale_clusters(frame_id))
+    
+    def close(self) -> DetectionSet:
+        """
+        End the stream.
+        
+        Returns:
+            Validated detections of every cluster or track still open
+        """
+        if self._open is None:
+            return DetectionSet.empty()
+        
+        if self.analyzer.matching == 'cluster' and self.analyzer.window is None:
+            validated = self.analyzer._aggregate_clusters(
+                self._open, self.analyzer._validated_clusters(self._open)
+            )
+            self._open = self._open[np.zeros(len(self._open), dtype=bool)]
+            self._labels = self._labels[:0]
+            return validated
+        
+        self._track_last.clear()
+        return self._emit(np.unique(self._labels))
+    
+    def _empty(self) -> DetectionSet:
+        return self.analyzer._aggregate_clusters(self._open, [])
+    
+    def _link_clusters(self, new: np.ndarray, frame_id: int):
+        """Join new detections to open clusters they overlap, merging clusters they bridge."""
+        analyzer = self.analyzer
+        detections = self._open
+        labels = self._labels
+        
+        if len(new) == 0:
+            return
+        
+        # Earlier detections still inside the window
+        linkable = np.flatnonzero(detections.frame_ids[:new[0]] >= frame_id - analyzer.window)
+        
+        iou = pairwise_iou(detections.boxes[new], detections.boxes[linkable])
+        linked = iou >= analyzer.iou_threshold
+        linked &= detections.class_ids[new][:, None] == detections.class_ids[linkable][None, :]
+        
+        for i, row in enumerate(new.tolist()):
+            hits = np.unique(labels[linkable[linked[i]]])
+            
+            if len(hits) == 0:
+                labels[row] = self._next_label
+                self._next_label += 1
+                continue
+            
+            target = hits[0]
+            if len(hits) > 1:
+                labels[np.isin(labels, hits)] = target
+            labels[row] = target
+    
+    def _stale_clusters(self, frame_id: int) -> np.ndarray:
+        """Clusters whose latest detection is too old to match the next frame."""
+        if len(self._labels) == 0:
+            return self._labels
+        
+        clusters, inverse = np.unique(self._labels, return_inverse=True)
+        last_frame = np.full(len(clusters), -1, dtype=np.int64)
+        np.maximum.at(last_frame, inverse, self._open.frame_ids)
+        
+        return clusters[last_frame < frame_id + 1 - self.analyzer.window]
+    
+    def _assign_tracks(self, new: np.ndarray, frame_id: int):
+        """Assign new detections to live tracks and start tracks for the rest."""
+        analyzer = self.analyzer
+        alive = sorted(self._track_last)
+        assigned = np.zeros(len(new), dtype=bool)
+        
+        if alive and len(new):
+            previous = np.array([self._track_last[t][1] for t in alive])
+            cost = analyzer._assignment_cost(self._open, previous, new)
+            rows, cols = linear_sum_assignment(np.where(np.isfinite(cost), cost, 1e9))
+            
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                if np.isfinite(cost[row, col]):
+                    self._labels[new[col]] = alive[row]
+                    self._track_last[alive[row]] = (frame_id, int(new[col]))
+                    assigned[col] = True
+        
+        for index in new[~assigned].tolist():
+            self._labels[index] = self._next_label
+            self._track_last[self._next_label] = (frame_id, index)
+            self._next_label += 1
+    
+    def _ended_tracks(self, frame_id: int) -> np.ndarray:
+        """Tracks that cannot be matched in the next frame."""
+        ended = [
+            track_id for track_id, (last_frame, _) in self._track_last.items()
+            if frame_id + 1 - last_frame > self.analyzer.max_missed_frames + 1
+        ]
+        
+        for track_id in ended:
+            del self._track_last[track_id]
+        
+        return np.array(sorted(ended), dtype=np.int64)
+    
+    def _emit(self, closed: np.ndarray) -> DetectionSet:
+        """Aggregate the validated clusters among closed ones and drop their detections."""
+        if len(closed) == 0:
+            return self._empty()
+        
+        detections = self._open
+        closing = np.isin(self._labels, closed)
+        rows = np.flatnonzero(closing)
+        
+        observed = self.analyzer._observed_mask(detections)
+        clusters = [
+            rows[cluster] for cluster in self.analyzer._split_labels(self._labels[rows])
+        ]
+        clusters = [cluster for cluster in clusters if self.analyzer._is_validated(detections, observed, cluster)]
+        
+        if self.analyzer.matching == 'track':
+            clusters.sort(key=lambda cluster: self._labels[cluster[0]])
+            track_ids = [int(self._labels[cluster[0]]) for cluster in clusters]
+        else:
+            clusters.sort(key=lambda cluster: (self._class_rank[int(detections.class_ids[cluster[0]])], cluster[0]))
+            track_ids = None
+        
+        validated = self.analyzer._aggregate_clusters(detections, clusters, track_ids)
+        
+        # Rows shift once closed detections are dropped
+        keep = ~closing
+        remap = np.cumsum(keep) - 1
+        self._track_last = {
+            track_id: (last_frame, int(remap[row])) for track_id, (last_frame, row) in self._track_last.items()
+        }
+        self._open = detections[np.flatnonzero(keep)]
+        self._labels = self._labels[keep]
         
-        return occlusion_handled
+        return validated
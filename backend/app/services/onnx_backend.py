@@ -0,0 +1,323 @@
+"""
+ONNX Runtime Inference Backend
+Runs exported YOLOv8 detectors through onnxruntime with NumPy pre- and post-processing.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from typing import Iterator, List, Tuple, Optional
+from app.services.box_ops import batched_nms
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: exports are not coordinated across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 checksum of a file.
+    
+    Args:
+        path: Path to the file
+        chunk_size: Read size in bytes
+    
+    Returns:
+        Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Hold an exclusive advisory lock on a lock file across processes.
+    
+    Args:
+        path: Lock file to create if needed and lock
+    """
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _has_cached_export(onnx_path: str, checksum_path: str, checksum: str) -> bool:
+    """Check whether an export exists and its sidecar matches the weights checksum."""
+    if not (os.path.exists(onnx_path) and os.path.exists(checksum_path)):
+        return False
+    
+    with open(checksum_path, 'r') as f:
+        return f.read().strip() == checksum
+
+
+def export_onnx(weights_path: str, imgsz: int = 640) -> str:
+    """
+    Export YOLOv8 .pt weights to ONNX, reusing a cached export when possible.
+    
+    The export is written next to the weights together with a sidecar file
+    holding the checksum of the weights it was built from. The model is only
+    re-exported when that checksum no longer matches.
+    
+    Workers booting at the same time export at most once: the export runs
+    under a file lock, in a temporary directory, and the model and then its
+    sidecar are moved into place with os.replace. Readers therefore never see
+    a partly written model, or a sidecar that vouches for the wrong one.
+    
+    Args:
+        weights_path: Path to trained YOLOv8 .pt weights
+        imgsz: Image size the export is traced at
+    
+    Returns:
+        Path to the ONNX model
+    """
+    onnx_path = os.path.splitext(weights_path)[0] + '.onnx'
+    checksum_path = onnx_path + '.sha256'
+    checksum = file_checksum(weights_path)
+    
+    if _has_cached_export(onnx_path, checksum_path, checksum):
+        logger.info(f"Using cached ONNX export at {onnx_path}")
+        return onnx_path
+    
+    with file_lock(onnx_path + '.lock'):
+        # Another worker may have finished the export while this one waited
+        if _has_cached_export(onnx_path, checksum_path, checksum):
+            logger.info(f"Using cached ONNX export at {onnx_path}")
+            return onnx_path
+        
+        from ultralytics import YOLO
+        
+        workdir = tempfile.mkdtemp(prefix='.onnx-export-', dir=os.path.dirname(os.path.abspath(onnx_path)))
+        
+        try:
+            # ultralytics writes the export next to the weights it is given
+            temp_weights = os.path.join(workdir, os.path.basename(weights_path))
+            shutil.copy2(weights_path, temp_weights)
+            
+            logger.info(f"Exporting {weights_path} to ONNX")
+            exported = YOLO(temp_weights).export(format='onnx', imgsz=imgsz, dynamic=True)
+            
+            temp_checksum = os.path.join(workdir, 'checksum.sha256')
+            with open(temp_checksum, 'w') as f:
+                f.write(checksum)
+            
+            # Drop the old sidecar first so the new model is never paired with it
+            if os.path.exists(checksum_path):
+                os.unlink(checksum_path)
+            
+            os.replace(exported, onnx_path)
+            os.replace(temp_checksum, checksum_path)
+        
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    return onnx_path
+
+
+def letterbox(
+    image: np.ndarray,
+    imgsz: int = 640,
+    pad_value: int = 114
+) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """
+    Resize an image to a square input keeping its aspect ratio, padding the rest.
+    
+    Args:
+        image: Input image (BGR format)
+        imgsz: Side length of the square output
+        pad_value: Gray level used for padding
+    
+    Returns:
+        Tuple of (letterboxed image, scale gain, (pad_x, pad_y))
+    """
+    height, width = image.shape[:2]
+    gain = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * gain)), int(round(height * gain))
+    
+    if (new_w, new_h) != (width, height):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    
+    pad_x = (imgsz - new_w) / 2
+    pad_y = (imgsz - new_h) / 2
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    
+    padded = cv2.copyMakeBorder(
+        image, top, bottom, left, right,
+        cv2.BORDER_CONSTANT, value=(pad_value, pad_value, pad_value)
+    )
+    
+    return padded, gain, (left, top)
+
+
+class OnnxYOLOBackend:
+    """Runs an exported YOLOv8 detector with onnxruntime on CPU."""
+    
+    def __init__(
+        self,
+        onnx_path: str,
+        imgsz: int = 640,
+        iou_threshold: float = 0.45,
+        max_det: int = 300,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None
+    ):
+        """
+        Initialize ONNX Runtime backend.
+        
+        Args:
+            onnx_path: Path to exported ONNX model
+            imgsz: Default square input size
+            iou_threshold: IoU threshold for non-maximum suppression
+            max_det: Maximum detections kept per image
+            intra_op_threads: Threads used inside a single operator (default: CPU count)
+            inter_op_threads: Threads used to run independent operators (default: 1)
+        """
+        import onnxruntime as ort
+        
+        self.onnx_path = onnx_path
+        self.imgsz = imgsz
+        self.iou_threshold = iou_threshold
+        self.max_det = max_det
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = inter_op_threads or 1
+        
+        self.session = ort.InferenceSession(
+            onnx_path,
+            sess_options=options,
+            providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        
+        logger.info(
+            f"Loaded ONNX model from {onnx_path} "
+            f"(intra_op_threads={options.intra_op_num_threads}, "
+            f"inter_op_threads={options.inter_op_num_threads})"
+        )
+    
+    def preprocess(
+        self,
+        images: List[np.ndarray],
+        imgsz: int
+    ) -> Tuple[np.ndarray, List[Tuple[float, Tuple[float, float]]]]:
+        """
+        Letterbox images and stack them into one NCHW float32 tensor.
+        
+        Args:
+            images: Input images (BGR format)
+            imgsz: Square input size
+        
+        Returns:
+            Tuple of (input tensor, per-image (gain, pad) pairs)
+        """
+        tensor = np.empty((len(images), 3, imgsz, imgsz), dtype=np.float32)
+        transforms = []
+        
+        for i, image in enumerate(images):
+            padded, gain, pad = letterbox(image, imgsz)
+            tensor[i] = padded[:, :, ::-1].transpose(2, 0, 1)
+            transforms.append((gain, pad))
+        
+        tensor *= 1.0 / 255.0
+        
+        return tensor, transforms
+    
+    def postprocess(
+        self,
+        output: np.ndarray,
+        conf_threshold: float,
+        gain: float,
+        pad: Tuple[float, float],
+        image_shape: Tuple[int, int]
+    ) -> np.ndarray:
+        """
+        Decode raw YOLOv8 output for one image.
+        
+        Args:
+            output: Raw predictions with shape (4 + num_classes, num_anchors)
+            conf_threshold: Minimum class confidence
+            gain: Letterbox scale gain
+            pad: Letterbox (pad_x, pad_y)
+            image_shape: Original (height, width)
+        
+        Returns:
+            Array with shape (N, 6) as [x1, y1, x2, y2, confidence, class_id]
+        """
+        class_scores = output[4:]
+        class_ids = class_scores.argmax(axis=0)
+        scores = class_scores[class_ids, np.arange(class_scores.shape[1])]
+        
+        mask = scores >= conf_threshold
+        if not mask.any():
+            return np.empty((0, 6), dtype=np.float32)
+        
+        cx, cy, w, h = output[:4, mask]
+        scores = scores[mask]
+        class_ids = class_ids[mask]
+        
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        
+        keep = batched_nms(boxes, scores, class_ids, self.iou_threshold, self.max_det)
+        boxes = boxes[keep]
+        
+        boxes -= (pad[0], pad[1], pad[0], pad[1])
+        boxes /= gain
+        
+        height, width = image_shape
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        
+        return np.column_stack([
+            boxes,
+            scores[keep],
+            class_ids[keep]
+        ]).astype(np.float32)
+    
+    def predict(
+        self,
+        images: List[np.ndarray],
+        conf_threshold: float,
+        imgsz: Optional[int] = None
+    ) -> List[np.ndarray]:
+        """
+        Run detection on a batch of images with a single session call.
+        
+        Args:
+            images: Input images (BGR format)
+            conf_threshold: Minimum class confidence
+            imgsz: Override default square input size
+        
+        Returns:
+            List of (N, 6) arrays, one per image, in original image coordinates
+        """
+        imgsz = imgsz or self.imgsz
+        tensor, transforms = self.preprocess(images, imgsz)
+        
+        outputs = self.session.run(None, {self.input_name: tensor})[0]
+        
+        return [
+            self.postprocess(output, conf_threshold, gain, pad, image.shape[:2])
+            for output, image, (gain, pad) in zip(outputs, images, transforms)
+        ]
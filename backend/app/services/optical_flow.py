@@ -0,0 +1,223 @@
+"""
+Optical Flow Propagation Service
+Carries detections between keyframes with sparse Lucas-Kanade optical flow.
+"""
+
+import cv2
+import numpy as np
+from typing import Callable, List, Optional, Tuple
+from app.services.detection_set import DetectionSet
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FlowPropagator:
+    """
+    Moves detection boxes from one frame to the next with cv2.calcOpticalFlowPyrLK.
+    
+    Frames are converted to grayscale and downscaled so their longer side is
+    at most max_side. A grid of points inside each box is tracked forward and
+    back, and points whose round trip misses by more than fb_threshold pixels
+    are dropped. Each box follows the median displacement and spread of its
+    remaining points. A box is lost when less than min_point_fraction of its
+    points survive.
+    """
+    
+    def __init__(
+        self,
+        max_side: int = 480,
+        grid_size: int = 4,
+        fb_threshold: float = 1.0,
+        min_point_fraction: float = 0.5
+    ):
+        """
+        Initialize flow propagator.
+        
+        Args:
+            max_side: Longer side of the downscaled frames flow is computed on
+            grid_size: Points tracked per box along each axis
+            fb_threshold: Maximum forward-backward error of a point in downscaled pixels
+            min_point_fraction: Fraction of a box's points that must survive to keep it
+        """
+        self.max_side = max_side
+        self.grid_size = grid_size
+        self.fb_threshold = fb_threshold
+        self.min_point_fraction = min_point_fraction
+        
+        self.lk_params = dict(
+            winSize=(15, 15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+        )
+    
+    def prepare(self, frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        """
+        Convert a BGR frame to the downscaled grayscale image flow is computed on.
+        
+        Returns:
+            Tuple of (grayscale image, scale from frame to image coordinates)
+        """
+        scale = min(1.0, self.max_side / max(frame.shape[:2]))
+        
+        if scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), scale
+    
+    def propagate(
+        self,
+        previous: Tuple[np.ndarray, float],
+        current: Tuple[np.ndarray, float],
+        detections: DetectionSet
+    ) -> Tuple[DetectionSet, float]:
+        """
+        Move detections from the previous frame to the current one.
+        
+        Args:
+            previous: prepare() output for the frame the detections belong to
+            current: prepare() output for the next frame
+            detections: Detections in the previous frame
+        
+        Returns:
+            Tuple of (detections that could be followed, moved, and mean fraction
+            of tracked points that survived as the tracking confidence)
+        """
+        if len(detections) == 0:
+            return detections.copy(), 1.0
+        
+        previous_gray, scale = previous
+        current_gray, _ = current
+        
+        boxes = detections.boxes * scale
+        steps = (np.arange(self.grid_size) + 0.5) / self.grid_size
+        
+        # Grid of points inside every box: shape (boxes, points, 2)
+        grid_x, grid_y = np.meshgrid(steps, steps)
+        offsets = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
+        sizes = boxes[:, 2:] - boxes[:, :2]
+        points = boxes[:, None, :2] + offsets[None, :, :] * sizes[:, None, :]
+        
+        start = points.reshape(-1, 1, 2).astype(np.float32)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(previous_gray, current_gray, start, None, **self.lk_params)
+        returned, back_status, _ = cv2.calcOpticalFlowPyrLK(current_gray, previous_gray, moved, None, **self.lk_params)
+        
+        error = np.linalg.norm((returned - start).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.fb_threshold)
+        good = good.reshape(len(boxes), -1)
+        
+        fractions = good.mean(axis=1)
+        keep = fractions >= self.min_point_fraction
+        
+        new_boxes = np.empty((int(keep.sum()), 4))
+        moved = moved.reshape(len(boxes), -1, 2)
+        
+        for row, i in enumerate(np.flatnonzero(keep)):
+            before = points[i][good[i]]
+            after = moved[i][good[i]].astype(np.float64)
+            
+            shift = np.median(after - before, axis=0)
+            spread_before = np.linalg.norm(before - before.mean(axis=0), axis=1).mean()
+            spread_after = np.linalg.norm(after - after.mean(axis=0), axis=1).mean()
+            zoom = np.clip(spread_after / spread_before, 0.8, 1.25) if spread_before > 0 else 1.0
+            
+            center = (boxes[i, :2] + boxes[i, 2:]) / 2 + shift
+            half = sizes[i] * zoom / 2
+            new_boxes[row] = np.concatenate([center - half, center + half])
+        
+        height, width = current_gray.shape[:2]
+        new_boxes[:, 0::2] = np.clip(new_boxes[:, 0::2], 0, width)
+        new_boxes[:, 1::2] = np.clip(new_boxes[:, 1::2], 0, height)
+        
+        propagated = detections[np.flatnonzero(keep)].copy()
+        propagated.boxes = new_boxes / scale
+        
+        return propagated, float(fractions.mean())
+
+
+class KeyframeDetector:
+    """
+    Detect callable for VideoPipeline that runs the model only on keyframes.
+    
+    Every keyframe_interval-th frame is detected; the frames in between get the
+    previous frame's detections moved by a FlowPropagator, marked with a
+    'propagated' attribute. A frame whose tracking confidence falls below
+    min_track_confidence is detected as well, without moving the schedule.
+    Frames must be passed in order, one batch at a time.
+    """
+    
+    def __init__(
+        self,
+        detect: Callable[[List[np.ndarray]], List[DetectionSet]],
+        keyframe_interval: int = 5,
+        min_track_confidence: float = 0.5,
+        propagator: Optional[FlowPropagator] = None
+    ):
+        """
+        Initialize keyframe detector.
+        
+        Args:
+            detect: Callable running detection on a list of frames
+            keyframe_interval: Frames per keyframe (1 detects every frame)
+            min_track_confidence: Tracking confidence below which a frame is detected
+            propagator: FlowPropagator to use (default: FlowPropagator())
+        """
+        self.detect = detect
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.min_track_confidence = min_track_confidence
+        self.propagator = propagator or FlowPropagator()
+        
+        self.keyframes = 0
+        self.propagated = 0
+        
+        self._next_keyframe = 0
+        self._previous = None
+        self._previous_detections = None
+    
+    def __call__(self, frames: List[np.ndarray]) -> List[DetectionSet]:
+        """Detect or propagate a batch of consecutive frames."""
+        try:
+            return self._process(frames)
+        except Exception:
+            # The pipeline drops a failed batch, so start over with a keyframe
+            self.reset()
+            raise
+    
+    def reset(self):
+        """Forget the previous frame so the next frame is a keyframe."""
+        self._next_keyframe = 0
+        self._previous = None
+        self._previous_detections = None
+    
+    def _process(self, frames: List[np.ndarray]) -> List[DetectionSet]:
+        # Scheduled keyframes of the batch share one forward pass
+        scheduled = list(range(self._next_keyframe, len(frames), self.keyframe_interval))
+        detected = dict(zip(scheduled, self.detect([frames[i] for i in scheduled]))) if scheduled else {}
+        
+        results = []
+        
+        for i, frame in enumerate(frames):
+            current = self.propagator.prepare(frame) if self.keyframe_interval > 1 else None
+            detections = detected.get(i)
+            
+            if detections is None:
+                detections, confidence = self.propagator.propagate(
+                    self._previous, current, self._previous_detections
+                )
+                
+                if confidence < self.min_track_confidence:
+                    detections = self.detect([frame])[0]
+                    self.keyframes += 1
+                else:
+                    detections = detections.with_attrs('propagated', True)
+                    self.propagated += 1
+            else:
+                self.keyframes += 1
+            
+            self._previous = current
+            self._previous_detections = detections
+            results.append(detections)
+        
+        self._next_keyframe = (self._next_keyframe - len(frames)) % self.keyframe_interval
+        
+        return results
@@ -5,11 +5,13 @@ Enriches detection reports with municipal metadata using retrieval augmented gen
 
 import os
 import logging
-from typing import Dict, List, Optional
+import numpy as np
+from typing import Dict, List, Optional, Union
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from app.services.detection_set import DetectionSet
 
 logger = logging.getLogger(__name__)
 
@@ -188,8 +190,26 @@ class RAGTagger:
         Returns:
             Enriched detection with municipal metadata
         """
-        issue_type = detection['class_name']
+        enriched = {
+            **detection,
+            'enrichment': self._lookup_enrichment(detection['class_name'])
+        }
+        
+        if location:
+            enriched['location'] = location
+        
+        return enriched
+    
+    def _lookup_enrichment(self, issue_type: str) -> Dict:
+        """
+        Look up the municipal metadata for an issue type.
         
+        Args:
+            issue_type: Type of urban issue
+        
+        Returns:
+            Enrichment dict
+        """
         if self.use_vector_db and self.vector_store:
             query = f"Information about {issue_type} urban infrastructure issue"
             results = self.vector_store.similarity_search(query, k=1)
@@ -201,40 +221,53 @@ class RAGTagger:
         else:
             metadata = self.KNOWLEDGE_BASE.get(issue_type, {})
         
-        enriched = {
-            **detection,
-            'enrichment': {
-                'department': metadata.get('department', 'Unknown'),
-                'urgency': metadata.get('urgency', 'medium'),
-                'response_time': metadata.get('response_time', 'Unknown'),
-                'technical_specs': metadata.get('technical_specs', ''),
-                'routing_category': metadata.get('routing_category', 'general'),
-                'required_fields': metadata.get('required_fields', []),
-                'safety_priority': metadata.get('safety_priority', 'medium')
-            }
+        return {
+            'department': metadata.get('department', 'Unknown'),
+            'urgency': metadata.get('urgency', 'medium'),
+            'response_time': metadata.get('response_time', 'Unknown'),
+            'technical_specs': metadata.get('technical_specs', ''),
+            'routing_category': metadata.get('routing_category', 'general'),
+            'required_fields': metadata.get('required_fields', []),
+            'safety_priority': metadata.get('safety_priority', 'medium')
         }
-        
-        if location:
-            enriched['location'] = location
-        
-        return enriched
     
     def enrich_multiple_detections(
         self,
-        detections: List[Dict],
+        detections: Union[DetectionSet, List[Dict]],
         location: Optional[Dict] = None
-    ) -> List[Dict]:
+    ) -> Union[DetectionSet, List[Dict]]:
         """
         Enrich multiple detections with municipal metadata.
         
+        For a DetectionSet, metadata is looked up once per class present and
+        attached to the rows as the 'enrichment' (and 'location') field.
+        
         Args:
-            detections: List of detection dicts from YOLOv8 detector
+            detections: DetectionSet or list of detection dicts from YOLOv8 detector
             location: Optional GPS coordinates {"lat": float, "lon": float}
             
         Returns:
-            List of enriched detections
+            Enriched detections of the same type
         """
-        return [self.enrich_detection(det, location) for det in detections]
+        if not isinstance(detections, DetectionSet):
+            return [self.enrich_detection(det, location) for det in detections]
+        
+        class_ids, inverse = np.unique(detections.class_ids, return_inverse=True)
+        by_class = [
+            self._lookup_enrichment(detections.class_names[class_id])
+            for class_id in class_ids.tolist()
+        ]
+        
+        enriched = detections.with_attrs(
+            'enrichment',
+            [by_class[i] for i in inverse.tolist()],
+            per_row=True
+        )
+        
+        if location:
+            enriched = enriched.with_attrs('location', location)
+        
+        return enriched
     
     def get_routing_info(self, issue_type: str) -> Dict:
         """
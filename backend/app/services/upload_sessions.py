@@ -0,0 +1,493 @@
+"""
+Upload Session Store
+SQLite-backed multi-frame upload sessions whose frames are processed as they arrive.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLimitError(RuntimeError):
+    """Raised when opening a session while max_sessions are already open."""
+
+
+class SessionStore:
+    """
+    Open upload sessions with idle-time expiry.
+    
+    Sessions and their processed frames live in a SQLite database, so several
+    processes (e.g. gunicorn workers) sharing one storage directory serve the
+    same sessions: frames uploaded to one worker can be finalized on another.
+    
+    A frame is detected in the process that received it and its result is
+    written back once detection resolves. Each process keeps the futures of
+    the frames it started and cancels those still queued once their session
+    is finalized, discarded or expires, wherever that happened.
+    
+    A session expires ttl_seconds after it was last used; expired sessions are
+    dropped on the next access to the store.
+    """
+    
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    _SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            params TEXT NOT NULL,
+            max_frames INTEGER NOT NULL,
+            num_frames INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_active REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS session_frames (
+            session_id TEXT NOT NULL,
+            frame_index INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            detections TEXT,
+            annotated_image TEXT,
+            error TEXT,
+            PRIMARY KEY (session_id, frame_index)
+        )
+        """
+    )
+    
+    def __init__(
+        self,
+        storage_dir: str,
+        ttl_seconds: float = 300.0,
+        max_sessions: int = 256,
+        max_frames: int = 30
+    ):
+        """
+        Initialize session store.
+        
+        Args:
+            storage_dir: Directory holding the sessions database
+            ttl_seconds: Idle seconds after which a session expires
+            max_sessions: Maximum open sessions
+            max_frames: Maximum frames per session
+        """
+        self.storage_dir = storage_dir
+        self.db_path = os.path.join(storage_dir, 'sessions.db')
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max(1, max_sessions)
+        self.max_frames = max(1, max_frames)
+        
+        self._lock = threading.Lock()
+        # Futures of frames started in this process, by session
+        self._running: Dict[str, List[Future]] = {}
+        # Serializes result writes to the database, off the threads resolving detections
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='upload-session-writer')
+        
+        self._stats = {
+            'opened': 0,
+            'finalized': 0,
+            'expired': 0
+        }
+        
+        os.makedirs(storage_dir, exist_ok=True)
+        
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in self._SCHEMA:
+                conn.execute(statement)
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)')
+    
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection, commit on success and always close it."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def create(self, params: Dict[str, Any]) -> Dict:
+        """
+        Open a session.
+        
+        Args:
+            params: JSON-serializable analysis parameters to keep with the session
+        
+        Returns:
+            The new session (see get())
+        
+        Raises:
+            SessionLimitError: If max_sessions sessions are open
+        """
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._expire(conn)
+            
+            open_sessions = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+            if open_sessions >= self.max_sessions:
+                raise SessionLimitError(f"Too many open upload sessions ({open_sessions})")
+            
+            conn.execute(
+                'INSERT INTO sessions (id, params, max_frames, created_at, last_active) VALUES (?, ?, ?, ?, ?)',
+                (session_id, json.dumps(params), self.max_frames, now, now)
+            )
+        
+        with self._lock:
+            self._stats['opened'] += 1
+        
+        self._cancel_closed()
+        
+        return {
+            'id': session_id,
+            'params': params,
+            'max_frames': self.max_frames,
+            'num_frames': 0,
+            'created_at': now
+        }
+    
+    def get(self, session_id: str) -> Optional[Dict]:
+        """
+        Get an open session and mark it as used.
+        
+        Returns:
+            Dict with id, params, max_frames, num_frames and created_at, or
+            None if the session is unknown or expired
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._expire(conn)
+            
+            row = conn.execute('SELECT * FROM sessions WHERE id = ?', (session_id,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE sessions SET last_active = ? WHERE id = ?', (time.time(), session_id))
+        
+        self._cancel_closed()
+        
+        return self._session_to_dict(row) if row is not None else None
+    
+    def add_frames(self, session_id: str, count: int) -> Optional[List[int]]:
+        """
+        Reserve places for frames about to be processed.
+        
+        Args:
+            session_id: Session identifier
+            count: Number of frames
+        
+        Returns:
+            Index of each frame within the session, or None if the session is
+            unknown or expired
+        
+        Raises:
+            ValueError: If the frames would take the session past max_frames
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._expire(conn)
+            
+            row = conn.execute(
+                'SELECT num_frames, max_frames FROM sessions WHERE id = ?', (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            num_frames, max_frames = row['num_frames'], row['max_frames']
+            if num_frames + count > max_frames:
+                raise ValueError(
+                    f"Session holds {num_frames} of at most {max_frames} frames; "
+                    f"cannot add {count} more"
+                )
+            
+            indices = list(range(num_frames, num_frames + count))
+            conn.execute(
+                'UPDATE sessions SET num_frames = ?, last_active = ? WHERE id = ?',
+                (num_frames + count, time.time(), session_id)
+            )
+            conn.executemany(
+                'INSERT INTO session_frames (session_id, frame_index, status) VALUES (?, ?, ?)',
+                [(session_id, index, self.PENDING) for index in indices]
+            )
+        
+        return indices
+    
+    def process_frame(
+        self,
+        session_id: str,
+        index: int,
+        detecting: Future,
+        finish: Callable[[Any], Tuple[List[Dict], str]]
+    ) -> Future:
+        """
+        Record a frame's result once its detection resolves.
+        
+        Args:
+            session_id: Session identifier
+            index: Frame index from add_frames()
+            detecting: Future resolving to the frame's detections
+            finish: Callable turning the detections into (detection dicts,
+                annotated image URL); runs on the thread resolving detecting,
+                so it must be quick
+        
+        Returns:
+            Future resolving once the result is recorded
+        """
+        processed = Future()
+        
+        def record(status, detections, annotated_image, error, exception):
+            self._update_frame(session_id, index, status, detections, annotated_image, error)
+            if exception is None:
+                processed.set_result(None)
+            else:
+                processed.set_exception(exception)
+        
+        def detected(_):
+            # Cancelled along with its closed session, so there is nothing to record
+            if detecting.cancelled():
+                processed.cancel()
+                return
+            
+            if not processed.set_running_or_notify_cancel():
+                return
+            try:
+                detections, annotated_image = finish(detecting.result())
+                result = (self.DONE, json.dumps(detections), annotated_image, None, None)
+            except BaseException as e:
+                result = (self.FAILED, None, None, str(e), e)
+            
+            # Only the database write is serialized across sessions
+            try:
+                self._writer.submit(record, *result)
+            except RuntimeError as e:
+                processed.set_exception(e)
+        
+        with self._lock:
+            self._running.setdefault(session_id, []).extend((detecting, processed))
+        
+        detecting.add_done_callback(detected)
+        
+        return processed
+    
+    def _update_frame(self, session_id, index, status, detections, annotated_image, error):
+        """Store a frame's result, unless its session has closed meanwhile."""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    UPDATE session_frames SET status = ?, detections = ?, annotated_image = ?, error = ?
+                    WHERE session_id = ? AND frame_index = ?
+                    """,
+                    (status, detections, annotated_image, error, session_id, index)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Could not record frame {index} of session {session_id}: {e}")
+    
+    def get_status(self, session_id: str) -> Optional[Dict]:
+        """Get upload and processing progress, or None if the session is unknown or expired."""
+        session = self.get(session_id)
+        if session is None:
+            return None
+        
+        with self._connect() as conn:
+            processed = conn.execute(
+                'SELECT COUNT(*) FROM session_frames WHERE session_id = ? AND status != ?',
+                (session_id, self.PENDING)
+            ).fetchone()[0]
+        
+        return {
+            'session_id': session_id,
+            'num_frames': session['num_frames'],
+            'frames_processed': processed,
+            'max_frames': session['max_frames'],
+            'created_at': session['created_at']
+        }
+    
+    def wait(self, session_id: str, timeout: float) -> bool:
+        """
+        Wait for every frame of a session to be processed.
+        
+        Frames started in this process are waited on directly; frames started
+        elsewhere are polled for.
+        
+        Returns:
+            True if no frame is pending any more, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        
+        with self._lock:
+            running = list(self._running.get(session_id, ()))
+        wait(running, timeout=timeout)
+        
+        while True:
+            with self._connect() as conn:
+                pending = conn.execute(
+                    'SELECT COUNT(*) FROM session_frames WHERE session_id = ? AND status = ?',
+                    (session_id, self.PENDING)
+                ).fetchone()[0]
+            
+            if not pending:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+    
+    def pop(self, session_id: str, finalized: bool = True) -> Optional[Tuple[Dict, List[Dict]]]:
+        """
+        Close a session and cancel its frames that are still queued.
+        
+        Args:
+            session_id: Session identifier
+            finalized: Count the session as finalized rather than discarded
+        
+        Returns:
+            (session, frames) where frames are dicts with index, status,
+            detections, annotated_image and error in upload order, or None if
+            the session is unknown or expired
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._expire(conn)
+            
+            row = conn.execute('SELECT * FROM sessions WHERE id = ?', (session_id,)).fetchone()
+            if row is None:
+                frame_rows = []
+            else:
+                frame_rows = conn.execute(
+                    'SELECT * FROM session_frames WHERE session_id = ? ORDER BY frame_index',
+                    (session_id,)
+                ).fetchall()
+                conn.execute('DELETE FROM session_frames WHERE session_id = ?', (session_id,))
+                conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        
+        self._cancel_closed()
+        
+        if row is None:
+            return None
+        
+        if finalized:
+            with self._lock:
+                self._stats['finalized'] += 1
+        
+        frames = [
+            {
+                'index': frame['frame_index'],
+                'status': frame['status'],
+                'detections': json.loads(frame['detections']) if frame['detections'] is not None else None,
+                'annotated_image': frame['annotated_image'],
+                'error': frame['error']
+            }
+            for frame in frame_rows
+        ]
+        
+        return self._session_to_dict(row), frames
+    
+    def _expire(self, conn: sqlite3.Connection):
+        """Drop sessions idle for longer than ttl_seconds."""
+        deadline = time.time() - self.ttl_seconds
+        
+        expired = [
+            row['id'] for row in conn.execute('SELECT id FROM sessions WHERE last_active <= ?', (deadline,))
+        ]
+        
+        for session_id in expired:
+            conn.execute('DELETE FROM session_frames WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+            logger.info(f"Upload session {session_id} expired")
+        
+        if expired:
+            with self._lock:
+                self._stats['expired'] += len(expired)
+    
+    def _cancel_closed(self):
+        """Cancel this process's queued frames of sessions that no longer exist."""
+        with self._lock:
+            for session_id in list(self._running):
+                futures = [future for future in self._running[session_id] if not future.done()]
+                if futures:
+                    self._running[session_id] = futures
+                else:
+                    del self._running[session_id]
+            
+            session_ids = list(self._running)
+        
+        if not session_ids:
+            return
+        
+        with self._connect() as conn:
+            placeholders = ', '.join('?' * len(session_ids))
+            open_ids = {
+                row['id'] for row in conn.execute(
+                    f'SELECT id FROM sessions WHERE id IN ({placeholders})', session_ids
+                )
+            }
+        
+        closed = []
+        
+        with self._lock:
+            for session_id in session_ids:
+                if session_id not in open_ids:
+                    closed.extend(self._running.pop(session_id, ()))
+        
+        for future in closed:
+            future.cancel()
+    
+    @staticmethod
+    def _session_to_dict(row: sqlite3.Row) -> Dict:
+        return {
+            'id': row['id'],
+            'params': json.loads(row['params']),
+            'max_frames': row['max_frames'],
+            'num_frames': row['num_frames'],
+            'created_at': row['created_at']
+        }
+    
+    def get_stats(self) -> Dict:
+        """Get this process's session counters and the number of open sessions."""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._expire(conn)
+            open_sessions = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        
+        with self._lock:
+            stats = dict(self._stats)
+        
+        stats['open'] = open_sessions
+        stats['max_sessions'] = self.max_sessions
+        stats['ttl_seconds'] = self.ttl_seconds
+        
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Get the process-wide SessionStore configured from the environment."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(
+                    storage_dir=os.getenv('UPLOAD_SESSION_DIR') or os.path.join(
+                        os.path.dirname(__file__), '..', '..', 'uploads', 'sessions'
+                    ),
+                    ttl_seconds=float(os.getenv('UPLOAD_SESSION_TTL', 300)),
+                    max_sessions=int(os.getenv('UPLOAD_SESSION_MAX', 256)),
+                    max_frames=int(os.getenv('UPLOAD_SESSION_MAX_FRAMES', 30))
+                )
+    return _store
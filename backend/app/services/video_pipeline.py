@@ -0,0 +1,167 @@
+"""
+Video Pipeline Service
+Overlaps frame decoding, batched inference and annotation for video analysis.
+"""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+import numpy as np
+from app.services.detection_set import DetectionSet
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class VideoPipeline:
+    """
+    Bounded producer/consumer pipeline: decode -> detect -> annotate.
+    
+    A decoder thread pulls frames from an iterator into a small queue. The
+    calling thread collects them into batches for the detect callable, and each
+    detected frame is handed to a thread pool that runs the annotate callable.
+    Every queue is bounded, so at most a few batches of full-resolution frames
+    are alive at once however many frames the video yields, and the stages run
+    concurrently so wall-clock time approaches that of the slowest one.
+    """
+    
+    _END = object()
+    
+    def __init__(
+        self,
+        detect: Callable[[List[np.ndarray]], List[DetectionSet]],
+        annotate: Callable[[np.ndarray, DetectionSet], Any],
+        batch_size: int = 16,
+        annotate_workers: int = 2
+    ):
+        """
+        Initialize video pipeline.
+        
+        Args:
+            detect: Callable running detection on a list of frames, returning one
+                DetectionSet per frame
+            annotate: Callable turning a frame and its detections into an output
+                such as an encoded image; frames are released once it returns
+            batch_size: Frames per detect call
+            annotate_workers: Threads running annotate
+        """
+        self.detect = detect
+        self.annotate = annotate
+        self.batch_size = max(1, batch_size)
+        self.annotate_workers = max(1, annotate_workers)
+    
+    def run(
+        self,
+        frames: Iterable[np.ndarray],
+        progress: Optional[Callable[[int, int], None]] = None,
+        total: Optional[int] = None
+    ) -> Tuple[List[DetectionSet], List[Any]]:
+        """
+        Push every frame through detection and annotation.
+        
+        Frames whose batch fails detection are logged and left out of the
+        results. Errors raised by the frame iterator or by annotate propagate.
+        
+        Args:
+            frames: Iterator of decoded frames, consumed on a background thread
+            progress: Optional callback progress(done, total) after each batch
+            total: Expected number of frames reported to progress
+        
+        Returns:
+            Tuple of (detections, annotations) for the detected frames, in frame order
+        """
+        decoded = queue.Queue(maxsize=self.batch_size)
+        stop = threading.Event()
+        
+        decoder = threading.Thread(
+            target=self._decode,
+            args=(iter(frames), decoded, stop),
+            name='video-decoder',
+            daemon=True
+        )
+        decoder.start()
+        
+        frame_detections = []
+        annotating = deque()
+        annotations = []
+        done = 0
+        
+        try:
+            with ThreadPoolExecutor(self.annotate_workers, thread_name_prefix='video-annotate') as pool:
+                while True:
+                    batch, finished = self._next_batch(decoded)
+                    
+                    if batch:
+                        try:
+                            detection_sets = self.detect(batch)
+                        except Exception as e:
+                            logger.error(f"Error processing frames {done}-{done + len(batch) - 1}: {e}")
+                        else:
+                            for frame, detections in zip(batch, detection_sets):
+                                frame_detections.append(detections)
+                                annotating.append(pool.submit(self.annotate, frame, detections))
+                        
+                        done += len(batch)
+                        if progress:
+                            progress(done, max(done, total or 0))
+                    
+                    # Keep at most one batch per worker waiting for annotation
+                    while len(annotating) > self.batch_size * self.annotate_workers:
+                        annotations.append(annotating.popleft().result())
+                    
+                    if finished:
+                        break
+                
+                while annotating:
+                    annotations.append(annotating.popleft().result())
+        
+        finally:
+            stop.set()
+            decoder.join()
+        
+        return frame_detections, annotations
+    
+    def _next_batch(self, decoded: queue.Queue) -> Tuple[List[np.ndarray], bool]:
+        """Take up to batch_size frames; the flag is set once the decoder is done."""
+        batch = []
+        
+        while len(batch) < self.batch_size:
+            item = decoded.get()
+            
+            if item is self._END:
+                return batch, True
+            if isinstance(item, BaseException):
+                raise item
+            
+            batch.append(item)
+        
+        return batch, False
+    
+    def _decode(self, frames, decoded: queue.Queue, stop: threading.Event):
+        """Decoder thread: move frames into the queue until exhausted or stopped."""
+        item = self._END
+        
+        try:
+            for frame in frames:
+                if not self._put(decoded, frame, stop):
+                    return
+        except Exception as e:
+            item = e
+        finally:
+            if hasattr(frames, 'close'):
+                frames.close()
+        
+        self._put(decoded, item, stop)
+    
+    @staticmethod
+    def _put(decoded: queue.Queue, item, stop: threading.Event) -> bool:
+        """Block until the item is queued; False if the pipeline stopped first."""
+        while not stop.is_set():
+            try:
+                decoded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -4,11 +4,16 @@ Handles real-time object detection for urban infrastructure issues.
 """
 
 import os
+import time
+import threading
 import cv2
 import numpy as np
 from ultralytics import YOLO
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Union
 from pathlib import Path
+from app.services.onnx_backend import OnnxYOLOBackend, export_onnx, file_checksum
+from app.services.box_ops import batched_nms
+from app.services.detection_set import DetectionSet
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,6 +22,13 @@ logger = logging.getLogger(__name__)
 class YOLODetector:
     """YOLOv8-based urban issue detector with ONNX runtime optimization."""
     
+    BACKENDS = ('ultralytics', 'onnx')
+    
+    IMGSZ_LADDER = (320, 480, 640)
+    
+    # Weight of the newest measurement in the per-size latency moving average
+    LATENCY_EWMA_ALPHA = 0.2
+    
     CLASS_NAMES = [
         "pothole",
         "road_crack",
@@ -30,15 +42,59 @@ class YOLODetector:
         "flooded_road"
     ]
     
-    def __init__(self, model_path: Optional[str] = None, conf_threshold: float = 0.25):
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        conf_threshold: float = 0.25,
+        max_batch_size: int = 16,
+        backend: str = 'ultralytics',
+        onnx_path: Optional[str] = None,
+        imgsz: int = 640,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        tile_size: int = 640,
+        tile_overlap: float = 0.2,
+        max_tiles: int = 16,
+        tile_iou_threshold: float = 0.5,
+        imgsz_ladder: Optional[List[int]] = None
+    ):
         """
         Initialize YOLOv8 detector.
         
         Args:
             model_path: Path to trained YOLOv8 model weights
             conf_threshold: Confidence threshold for detections
+            max_batch_size: Maximum number of images per forward pass in detect_batch
+            backend: Inference backend, 'ultralytics' (PyTorch) or 'onnx' (onnxruntime)
+            onnx_path: Prebuilt ONNX model for the onnx backend, e.g. the INT8 model from
+                model/scripts/quantize_int8.py (default: export model_path to ONNX)
+            imgsz: Inference image size
+            intra_op_threads: onnxruntime threads per operator (onnx backend only)
+            inter_op_threads: onnxruntime threads across operators (onnx backend only)
+            tile_size: Tile side length in pixels for detect_tiled
+            tile_overlap: Fraction of a tile shared with its neighbour for detect_tiled
+            max_tiles: Maximum tiles per frame for detect_tiled
+            tile_iou_threshold: IoU threshold for merging tile detections
+            imgsz_ladder: Image sizes select_imgsz may fall back to under a latency
+                budget (default: IMGSZ_LADDER, capped at imgsz)
         """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {self.BACKENDS}")
+        
         self.conf_threshold = conf_threshold
+        self.max_batch_size = max(1, max_batch_size)
+        self.backend = backend
+        self.imgsz = imgsz
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.max_tiles = max(1, max_tiles)
+        self.tile_iou_threshold = tile_iou_threshold
+        
+        ladder = {size for size in (imgsz_ladder or self.IMGSZ_LADDER) if 0 < size <= imgsz}
+        self.imgsz_ladder = sorted(ladder | {imgsz})
+        
+        self._latency_lock = threading.Lock()
+        self._latency_ms: Dict[int, float] = {}
         
         if model_path is None:
             model_path = os.path.join(
@@ -49,17 +105,41 @@ class YOLODetector:
         
         self.model_path = model_path
         
+        self.model = None
+        self.onnx_model = None
+        
         try:
-            self.model = YOLO(self.model_path)
-            logger.info(f"Loaded YOLOv8 model from {self.model_path}")
+            if backend == 'onnx':
+                if onnx_path is None:
+                    onnx_path = export_onnx(self.model_path, imgsz)
+                self.onnx_model = OnnxYOLOBackend(
+                    onnx_path,
+                    imgsz=imgsz,
+                    intra_op_threads=intra_op_threads,
+                    inter_op_threads=inter_op_threads
+                )
+            else:
+                self.model = YOLO(self.model_path)
+            logger.info(f"Loaded YOLOv8 model from {onnx_path or self.model_path} ({backend} backend)")
         except Exception as e:
             logger.error(f"Failed to load YOLOv8 model: {e}")
             raise
+        
+        self.model_version = self._model_version(onnx_path or self.model_path)
+    
+    @staticmethod
+    def _model_version(path: str) -> str:
+        """Identify loaded weights by a short checksum of the model file."""
+        try:
+            return file_checksum(path)[:16]
+        except OSError:
+            return os.path.basename(path)
     
     def detect_single_frame(
         self, 
         image: np.ndarray,
-        conf_threshold: Optional[float] = None
+        conf_threshold: Optional[float] = None,
+        imgsz: Optional[int] = None
     ) -> List[Dict]:
         """
         Detect urban issues in a single frame.
@@ -67,45 +147,323 @@ class YOLODetector:
         Args:
             image: Input image as numpy array (BGR format)
             conf_threshold: Override default confidence threshold
-            
+            imgsz: Override default inference image size
+        
         Returns:
             List of detections with bounding boxes and metadata
         """
         if conf_threshold is None:
             conf_threshold = self.conf_threshold
         
-        results = self.model(image, conf=conf_threshold, verbose=False)
+        return self._infer([image], conf_threshold, imgsz)[0]
+    
+    def detect_batch(
+        self,
+        images: List[np.ndarray],
+        conf_threshold: Optional[float] = None,
+        imgsz: Optional[int] = None
+    ) -> List[List[Dict]]:
+        """
+        Detect urban issues in several frames with batched forward passes.
+        
+        Same as detect_sets, converted to detection dicts for JSON responses.
+        
+        Args:
+            images: Input images as numpy arrays (BGR format)
+            conf_threshold: Override default confidence threshold
+            imgsz: Override default inference image size
+        
+        Returns:
+            List of detection lists, one per input image, in input order
+        """
+        return [detections.to_dicts() for detections in self.detect_sets(images, conf_threshold, imgsz)]
+    
+    def detect_sets(
+        self,
+        images: List[np.ndarray],
+        conf_threshold: Optional[float] = None,
+        imgsz: Optional[int] = None
+    ) -> List[DetectionSet]:
+        """
+        Detect urban issues in several frames with batched forward passes.
+        
+        Images are split into chunks of at most max_batch_size. Each chunk is
+        handed to the model as one list, which letterboxes the frames into a
+        single input tensor and runs one forward pass for the whole chunk.
+        
+        Args:
+            images: Input images as numpy arrays (BGR format)
+            conf_threshold: Override default confidence threshold
+            imgsz: Override default inference image size
+        
+        Returns:
+            One DetectionSet per input image, in input order
+        """
+        if conf_threshold is None:
+            conf_threshold = self.conf_threshold
+        
+        detection_sets = []
+        
+        for start in range(0, len(images), self.max_batch_size):
+            chunk = list(images[start:start + self.max_batch_size])
+            detection_sets.extend(
+                DetectionSet.from_array(output, self.CLASS_NAMES)
+                for output in self._infer_arrays(chunk, conf_threshold, imgsz)
+            )
+        
+        return detection_sets
+    
+    def detect_tiled(
+        self,
+        image: np.ndarray,
+        conf_threshold: Optional[float] = None,
+        tile_size: Optional[int] = None,
+        overlap: Optional[float] = None,
+        max_tiles: Optional[int] = None,
+        include_full_frame: bool = True
+    ) -> List[Dict]:
+        """
+        Detect urban issues in a high-resolution frame using overlapping tiles.
+        
+        The frame is split into overlapping square tiles, which are run through
+        batched forward passes together with the whole frame (for objects larger
+        than a tile). Tile detections are shifted back to full-frame coordinates
+        and merged with class-aware NMS. If the grid would exceed max_tiles, the
+        tile size grows until it fits, so latency stays bounded.
+        
+        Args:
+            image: Input image as numpy array (BGR format)
+            conf_threshold: Override default confidence threshold
+            tile_size: Tile side length in pixels (default: self.tile_size)
+            overlap: Fraction of a tile shared with its neighbour (default: self.tile_overlap)
+            max_tiles: Maximum number of tiles (default: self.max_tiles)
+            include_full_frame: Also detect on the whole frame
+        
+        Returns:
+            List of detections in full-frame coordinates
+        """
+        if conf_threshold is None:
+            conf_threshold = self.conf_threshold
+        
+        tile_size = tile_size or self.tile_size
+        overlap = self.tile_overlap if overlap is None else overlap
+        max_tiles = max_tiles or self.max_tiles
+        
+        height, width = image.shape[:2]
+        
+        if max(height, width) <= tile_size:
+            return self.detect_single_frame(image, conf_threshold)
+        
+        origins, tile_size = self._tile_origins(width, height, tile_size, overlap, max_tiles)
+        
+        crops = [image[y:y + tile_size, x:x + tile_size] for x, y in origins]
+        offsets = list(origins)
+        
+        if include_full_frame:
+            crops.append(image)
+            offsets.append((0, 0))
+        
+        outputs = []
+        for start in range(0, len(crops), self.max_batch_size):
+            outputs.extend(self._infer_arrays(crops[start:start + self.max_batch_size], conf_threshold))
+        
+        shifted = []
+        for (x, y), output in zip(offsets, outputs):
+            if len(output):
+                output = output.copy()
+                output[:, [0, 2]] += x
+                output[:, [1, 3]] += y
+                shifted.append(output)
+        
+        if not shifted:
+            return []
+        
+        merged = np.concatenate(shifted)
+        keep = batched_nms(merged[:, :4], merged[:, 4], merged[:, 5], self.tile_iou_threshold)
+        
+        return self._parse_array(merged[keep])
+    
+    @staticmethod
+    def _tile_origins(
+        width: int,
+        height: int,
+        tile_size: int,
+        overlap: float,
+        max_tiles: int
+    ) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        Lay out an overlapping tile grid covering the frame within a tile budget.
+        
+        Returns:
+            Tuple of (list of (x, y) tile origins, tile size actually used)
+        """
+        overlap = min(max(overlap, 0.0), 0.9)
+        
+        while True:
+            tile_size = min(tile_size, max(width, height))
+            stride = max(1, int(tile_size * (1 - overlap)))
+            cols = int(np.ceil(max(width - tile_size, 0) / stride)) + 1
+            rows = int(np.ceil(max(height - tile_size, 0) / stride)) + 1
+            
+            if cols * rows <= max_tiles or tile_size >= max(width, height):
+                break
+            
+            tile_size = int(tile_size * 1.25)
+        
+        xs = np.linspace(0, max(width - tile_size, 0), cols).round().astype(int)
+        ys = np.linspace(0, max(height - tile_size, 0), rows).round().astype(int)
+        
+        return [(int(x), int(y)) for y in ys for x in xs], tile_size
+    
+    def _infer(
+        self,
+        images: List[np.ndarray],
+        conf_threshold: float,
+        imgsz: Optional[int] = None
+    ) -> List[List[Dict]]:
+        """
+        Run one forward pass over a list of images on the configured backend.
+        
+        Args:
+            images: Input images as numpy arrays (BGR format)
+            conf_threshold: Confidence threshold for detections
+            imgsz: Override default inference image size
+        
+        Returns:
+            List of detection lists, one per input image
+        """
+        outputs = self._infer_arrays(images, conf_threshold, imgsz)
+        return [self._parse_array(output) for output in outputs]
+    
+    def _infer_arrays(
+        self,
+        images: List[np.ndarray],
+        conf_threshold: float,
+        imgsz: Optional[int] = None
+    ) -> List[np.ndarray]:
+        """
+        Run one forward pass and return raw detections as arrays.
         
-        detections = []
+        Args:
+            images: Input images as numpy arrays (BGR format)
+            conf_threshold: Confidence threshold for detections
+            imgsz: Override default inference image size
         
-        for result in results:
-            boxes = result.boxes
+        Returns:
+            List of (N, 6) arrays as [x1, y1, x2, y2, confidence, class_id], one per image
+        """
+        imgsz = imgsz or self.imgsz
+        start = time.perf_counter()
+        
+        if self.onnx_model is not None:
+            outputs = self.onnx_model.predict(list(images), conf_threshold, imgsz)
+        else:
+            results = self.model(list(images), conf=conf_threshold, imgsz=imgsz, verbose=False)
             
-            for i in range(len(boxes)):
-                box = boxes.xyxy[i].cpu().numpy()  # [x1, y1, x2, y2]
-                conf = float(boxes.conf[i].cpu().numpy())
-                cls = int(boxes.cls[i].cpu().numpy())
-                
-                detection = {
-                    'class_id': cls,
-                    'class_name': self.CLASS_NAMES[cls],
-                    'confidence': conf,
-                    'bbox': {
-                        'x1': float(box[0]),
-                        'y1': float(box[1]),
-                        'x2': float(box[2]),
-                        'y2': float(box[3])
-                    },
-                    'bbox_center': {
-                        'x': float((box[0] + box[2]) / 2),
-                        'y': float((box[1] + box[3]) / 2)
-                    },
-                    'bbox_area': float((box[2] - box[0]) * (box[3] - box[1]))
-                }
-                
-                detections.append(detection)
-        
-        return detections
+            # One device-to-host transfer per image for all boxes: [x1, y1, x2, y2, conf, cls]
+            outputs = [result.boxes.data.cpu().numpy() for result in results]
+        
+        if images:
+            self._record_latency(imgsz, (time.perf_counter() - start) * 1000.0 / len(images))
+        
+        return outputs
+    
+    def _record_latency(self, imgsz: int, per_image_ms: float):
+        """Fold a per-image latency measurement into the moving average for a size."""
+        with self._latency_lock:
+            previous = self._latency_ms.get(imgsz)
+            if previous is None:
+                self._latency_ms[imgsz] = per_image_ms
+            else:
+                alpha = self.LATENCY_EWMA_ALPHA
+                self._latency_ms[imgsz] = alpha * per_image_ms + (1 - alpha) * previous
+    
+    def estimate_latency(self, imgsz: int) -> Optional[float]:
+        """
+        Estimate per-image inference latency at a size from live measurements.
+        
+        Sizes that have not been measured yet are extrapolated from the nearest
+        measured size, assuming cost grows with input area.
+        
+        Args:
+            imgsz: Inference image size
+        
+        Returns:
+            Estimated milliseconds per image, or None before any measurement
+        """
+        with self._latency_lock:
+            measured = dict(self._latency_ms)
+        
+        if imgsz in measured:
+            return measured[imgsz]
+        
+        if not measured:
+            return None
+        
+        nearest = min(measured, key=lambda size: abs(size - imgsz))
+        return measured[nearest] * (imgsz / nearest) ** 2
+    
+    def select_imgsz(
+        self,
+        latency_budget_ms: Optional[float],
+        queue_depth: int = 0,
+        replicas: int = 1,
+        overhead_ms: float = 0.0
+    ) -> Dict:
+        """
+        Pick the largest ladder size whose estimated latency fits a budget.
+        
+        The estimate assumes the frames already queued are shared across the
+        replicas and run before this one, each at the candidate size. When no
+        size fits, the smallest is used so the request degrades instead of
+        piling up behind the queue.
+        
+        Args:
+            latency_budget_ms: Per-request latency budget (None keeps the default size)
+            queue_depth: Frames waiting ahead of this request
+            replicas: Detector replicas serving the queue
+            overhead_ms: Fixed latency added on top of inference, e.g. batching wait
+        
+        Returns:
+            Dict with the chosen imgsz, the budget, the estimate and the queue depth
+        """
+        choice = {
+            'imgsz': self.imgsz,
+            'latency_budget_ms': latency_budget_ms,
+            'estimated_ms': None,
+            'queue_depth': queue_depth
+        }
+        
+        if latency_budget_ms is None:
+            return choice
+        
+        frames_ahead = queue_depth / max(1, replicas) + 1
+        
+        for imgsz in reversed(self.imgsz_ladder):
+            per_image_ms = self.estimate_latency(imgsz)
+            if per_image_ms is None:
+                # Nothing measured yet: no basis for degrading
+                return choice
+            
+            choice['imgsz'] = imgsz
+            choice['estimated_ms'] = frames_ahead * per_image_ms + overhead_ms
+            
+            if choice['estimated_ms'] <= latency_budget_ms:
+                break
+        
+        return choice
+    
+    def _parse_array(self, output: np.ndarray) -> List[Dict]:
+        """
+        Convert an array of raw detections into detection dicts.
+        
+        Args:
+            output: Array with shape (N, 6) as [x1, y1, x2, y2, confidence, class_id]
+        
+        Returns:
+            List of detections with bounding boxes and metadata
+        """
+        return DetectionSet.from_array(output, self.CLASS_NAMES).to_dicts()
     
     def detect_from_file(
         self, 
@@ -118,7 +476,7 @@ class YOLODetector:
         Args:
             image_path: Path to input image
             conf_threshold: Override default confidence threshold
-            
+        
         Returns:
             Tuple of (detections, original_image)
         """
@@ -142,45 +500,89 @@ class YOLODetector:
         Args:
             image_bytes: Image data as bytes
             conf_threshold: Override default confidence threshold
-            
+        
         Returns:
             Tuple of (detections, original_image)
         """
+        image = self.decode_image(image_bytes)
+        
+        detections = self.detect_single_frame(image, conf_threshold)
+        
+        return detections, image
+    
+    def warmup(self, sizes: Optional[List[int]] = None, runs: int = 2):
+        """
+        Run dummy inferences so graph setup and kernel selection happen up front.
+        
+        Args:
+            sizes: Square image sizes to warm up (default: imgsz_ladder)
+            runs: Number of forward passes per size
+        """
+        sizes = sizes or self.imgsz_ladder
+        
+        for size in sizes:
+            dummy = np.full((size, size, 3), 114, dtype=np.uint8)
+            
+            for run in range(runs):
+                if run == runs - 1:
+                    # Seed the latency estimate from a warm pass, not the cold ones
+                    with self._latency_lock:
+                        self._latency_ms.pop(size, None)
+                self._infer([dummy], self.conf_threshold, size)
+        
+        logger.info(f"Warmed up {self.backend} detector at sizes {sizes}")
+    
+    @staticmethod
+    def decode_image(image_bytes: bytes) -> np.ndarray:
+        """
+        Decode encoded image bytes into a BGR numpy array.
+        
+        Args:
+            image_bytes: Image data as bytes
+        
+        Returns:
+            Decoded image
+        """
         nparr = np.frombuffer(image_bytes, np.uint8)
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
         if image is None:
             raise ValueError("Failed to decode image from bytes")
         
-        detections = self.detect_single_frame(image, conf_threshold)
-        
-        return detections, image
+        return image
     
+    @staticmethod
     def annotate_image(
-        self,
         image: np.ndarray,
-        detections: List[Dict]
+        detections: Union[DetectionSet, List[Dict]],
+        copy: bool = True
     ) -> np.ndarray:
         """
         Draw bounding boxes and labels on image.
         
+        Needs no model, so it can be called on the class.
+        
         Args:
             image: Input image
-            detections: List of detections from detect_single_frame
-            
+            detections: DetectionSet, or list of detections from detect_single_frame
+            copy: Draw on a copy (False draws on image itself)
+        
         Returns:
             Annotated image
         """
-        annotated = image.copy()
+        annotated = image.copy() if copy else image
         
-        for det in detections:
-            bbox = det['bbox']
-            x1, y1 = int(bbox['x1']), int(bbox['y1'])
-            x2, y2 = int(bbox['x2']), int(bbox['y2'])
+        if not isinstance(detections, DetectionSet):
+            detections = DetectionSet.from_dicts(detections, YOLODetector.CLASS_NAMES)
             
+        for (x1, y1, x2, y2), class_name, confidence in zip(
+            detections.boxes.astype(int).tolist(),
+            detections.names(),
+            detections.scores.tolist()
+        ):
             cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 255, 0), 2)
             
-            label = f"{det['class_name']}: {det['confidence']:.2f}"
+            label = f"{class_name}: {confidence:.2f}"
             label_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
             
             cv2.rectangle(
@@ -206,8 +608,19 @@ class YOLODetector:
     def get_model_info(self) -> Dict:
         """Get information about the loaded model."""
         return {
-            'model_path': self.model_path,
+            'model_path': self.onnx_model.onnx_path if self.onnx_model else self.model_path,
+            'model_version': self.model_version,
+            'backend': self.backend,
+            'imgsz': self.imgsz,
             'num_classes': len(self.CLASS_NAMES),
             'class_names': self.CLASS_NAMES,
-            'default_conf_threshold': self.conf_threshold
+            'default_conf_threshold': self.conf_threshold,
+            'max_batch_size': self.max_batch_size,
+            'tiling': {
+                'tile_size': self.tile_size,
+                'overlap': self.tile_overlap,
+                'max_tiles': self.max_tiles
+            },
+            'imgsz_ladder': self.imgsz_ladder,
+            'latency_ms': {str(size): self.estimate_latency(size) for size in self.imgsz_ladder}
         }
@@ -0,0 +1,128 @@
+"""
+Tests for cross-frame matching in the multi-frame analyzer.
+"""
+
+import numpy as np
+import pytest
+
+from app.services.detection_set import DetectionSet
+from app.services.multiframe_analyzer import MultiFrameAnalyzer
+
+CLASS_NAMES = ['pothole', 'graffiti', 'streetlight_out']
+
+
+def random_frames(seed, num_frames, num_objects, extent=2000.0):
+    """
+    Objects seen with jitter and slow drift, each missed in some frames.
+    
+    Returns:
+        One DetectionSet per frame
+    """
+    rng = np.random.default_rng(seed)
+    
+    origins = rng.uniform(0, extent, (num_objects, 2))
+    sizes = rng.uniform(20, 80, num_objects)
+    classes = rng.integers(0, len(CLASS_NAMES), num_objects)
+    
+    frames = []
+    for frame_id in range(num_frames):
+        seen = rng.random(num_objects) < 0.7
+        corners = origins[seen] + rng.normal(0, 3, (seen.sum(), 2)) + (frame_id * 2, 0)
+        boxes = np.hstack([corners, corners + sizes[seen, None]])
+        
+        frames.append(DetectionSet(
+            boxes,
+            rng.uniform(0.3, 0.9, seen.sum()),
+            classes[seen],
+            CLASS_NAMES
+        ))
+    
+    return frames
+
+
+def summary(detections):
+    """Comparable view of validated detections."""
+    return [
+        (
+            det['class_name'],
+            tuple(np.round(det['bbox'], 4)),
+            round(det['confidence'], 6),
+            tuple(det['validation']['frame_indices'])
+        )
+        for det in detections.to_dicts()
+    ]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_grid_index_matches_dense_clustering(seed):
+    frames = random_frames(seed, num_frames=8, num_objects=250)
+    assert sum(len(frame) for frame in frames) > 1000
+    
+    dense = MultiFrameAnalyzer().match_detections_across_frames(frames)
+    grid = MultiFrameAnalyzer(dense_max_detections=0).match_detections_across_frames(frames)
+    
+    assert len(dense) > 0
+    assert summary(grid) == summary(dense)
+
+
+def single_box_frames(positions):
+    """One 60px pothole per frame at each x position, or no detection for None."""
+    return [
+        DetectionSet.from_dicts(
+            [] if x is None else [{'bbox': [x, 100, x + 60, 160], 'class_name': 'pothole', 'confidence': 0.6}],
+            CLASS_NAMES
+        )
+        for x in positions
+    ]
+
+
+def tracks(detections):
+    """(track_id, frame_indices) of each validated track."""
+    return [
+        (det['validation']['track_id'], det['validation']['frame_indices'])
+        for det in detections.to_dicts()
+    ]
+
+
+def test_drifting_box_keeps_one_track():
+    analyzer = MultiFrameAnalyzer(matching='track')
+    frames = single_box_frames([100, 108, 116, 124, 132, 140])
+    
+    # The first and last boxes no longer overlap enough to be matched directly
+    assert analyzer.calculate_iou(frames[0].boxes[0].tolist(), frames[-1].boxes[0].tolist()) < analyzer.iou_threshold
+    
+    assert tracks(analyzer.match_detections_across_frames(frames)) == [(0, [0, 1, 2, 3, 4, 5])]
+
+
+def test_track_ends_after_max_missed_frames():
+    analyzer = MultiFrameAnalyzer(matching='track', max_missed_frames=1)
+    
+    # One missed frame is bridged
+    frames = single_box_frames([100, 105, 110, None, 115, 120])
+    assert tracks(analyzer.match_detections_across_frames(frames)) == [(0, [0, 1, 2, 4, 5])]
+    
+    # Two missed frames end the track and the box comes back as a new one
+    frames = single_box_frames([100, 105, 110, None, None, 115, 120])
+    assert tracks(analyzer.match_detections_across_frames(frames)) == [(0, [0, 1, 2]), (1, [5, 6])]
+    
+    # A stream emits the ended track as soon as the second missed frame arrives
+    stream = analyzer.stream()
+    emitted = [len(stream.push_frame(frame)) for frame in frames]
+    assert emitted == [0, 0, 0, 0, 1, 0, 0]
+    assert len(stream.close()) == 1
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_unbounded_stream_matches_batch_clustering(seed):
+    frames = random_frames(seed, num_frames=2 + seed % 10, num_objects=15, extent=500.0)
+    analyzer = MultiFrameAnalyzer()
+    
+    batch = analyzer.match_detections_across_frames(frames)
+    
+    stream = analyzer.stream()
+    emitted = [stream.push_frame(frame) for frame in frames]
+    emitted.append(stream.close())
+    streamed = DetectionSet.concatenate(emitted)
+    
+    assert summary(streamed) == summary(batch)
+    assert summary(analyzer.analyze_frames(frames)['validated_detections']) == summary(batch)
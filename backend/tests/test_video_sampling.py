@@ -0,0 +1,70 @@
+"""
+Tests for video frame sampling in multi-frame video analysis.
+"""
+
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+import pytest
+
+from app.routes import multiframe
+from app.services.artifact_store import ArtifactStore
+from app.services.detection_set import DetectionSet
+
+
+class FakeReplica:
+    """Detector replica returning no detections."""
+    
+    max_batch_size = 4
+    
+    def detect_sets(self, frames, conf_threshold=None):
+        return [DetectionSet.empty(['pothole']) for _ in frames]
+
+
+class FakeRegistry:
+    @contextmanager
+    def acquire(self, name):
+        yield FakeReplica()
+
+
+@pytest.fixture
+def no_model(monkeypatch, tmp_path):
+    """Run video analysis without loading the YOLO model or the tagger."""
+    replica = FakeReplica()
+    store = ArtifactStore(str(tmp_path / 'artifacts'))
+    
+    monkeypatch.setattr(multiframe, 'get_registry', lambda: FakeRegistry())
+    monkeypatch.setattr(multiframe, 'get_detector', lambda: replica)
+    monkeypatch.setattr(multiframe, 'get_tagger', lambda: None)
+    monkeypatch.setattr(multiframe, 'get_artifact_store', lambda: store)
+
+
+def write_clip(path, frames, fps=30):
+    """Write frames to an MJPG video file."""
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    return str(path)
+
+
+def test_scene_sampling_short_static_clip_is_rejected(no_model, tmp_path):
+    # One second of an unchanging scene: the header promises two samples at
+    # 0.5s spacing, but scene sampling keeps only the first frame
+    frame = np.full((120, 160, 3), 90, dtype=np.uint8)
+    video_path = write_clip(tmp_path / 'static.avi', [frame] * 30)
+    
+    with pytest.raises(ValueError, match='minimum 2 required'):
+        multiframe.run_video_analysis(video_path, frame_interval=0.5, sampling='scene')
+
+
+def test_scene_sampling_keeps_changing_frames(no_model, tmp_path):
+    frames = [np.full((120, 160, 3), 40 + 60 * (i // 15), dtype=np.uint8) for i in range(30)]
+    video_path = write_clip(tmp_path / 'cut.avi', frames)
+    
+    result = multiframe.run_video_analysis(video_path, frame_interval=0.5, sampling='scene')
+    
+    assert result['statistics']['num_frames'] >= 2
+    assert len(result['annotated_images']) == result['statistics']['num_frames']
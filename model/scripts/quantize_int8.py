@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Quantize the trained YOLOv8 detector to INT8 with ONNX Runtime static quantization
+
+Calibrates activations on the merged validation images, validates the fp32 and
+INT8 ONNX models on seesomething.yaml and reports the mAP delta and CPU latency.
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import logging
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import cv2
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def letterbox(image: np.ndarray, imgsz: int, pad_value: int = 114) -> np.ndarray:
+    """
+    Resize to a square input keeping aspect ratio (matches Ultralytics preprocessing)
+    """
+    height, width = image.shape[:2]
+    gain = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * gain)), int(round(height * gain))
+    
+    if (new_w, new_h) != (width, height):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    
+    pad_x = (imgsz - new_w) / 2
+    pad_y = (imgsz - new_h) / 2
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    
+    return cv2.copyMakeBorder(
+        image, top, bottom, left, right,
+        cv2.BORDER_CONSTANT, value=(pad_value, pad_value, pad_value)
+    )
+
+def load_input_tensor(image_path: Path, imgsz: int) -> Optional[np.ndarray]:
+    """
+    Load an image as a 1x3xHxW float32 RGB tensor in [0, 1]
+    """
+    image = cv2.imread(str(image_path))
+    if image is None:
+        logger.warning(f"Skipping unreadable image: {image_path}")
+        return None
+    
+    padded = letterbox(image, imgsz)
+    tensor = padded[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32)
+    return tensor / 255.0
+
+def find_images(image_dir: Path, limit: int, seed: int = 0) -> List[Path]:
+    """
+    Pick a reproducible random sample of images from a directory
+    """
+    images = sorted(p for p in image_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    random.Random(seed).shuffle(images)
+    return images[:limit]
+
+class ValImageReader:
+    """
+    onnxruntime CalibrationDataReader over merged validation images
+    """
+    
+    def __init__(self, input_name: str, image_paths: List[Path], imgsz: int):
+        self.input_name = input_name
+        self.image_paths = image_paths
+        self.imgsz = imgsz
+        self._iter = iter(self.image_paths)
+    
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        for image_path in self._iter:
+            tensor = load_input_tensor(image_path, self.imgsz)
+            if tensor is not None:
+                return {self.input_name: tensor}
+        return None
+    
+    def rewind(self):
+        self._iter = iter(self.image_paths)
+
+def export_fp32_onnx(weights: Path, imgsz: int) -> Path:
+    """
+    Export .pt weights to an fp32 ONNX model with a dynamic batch axis
+    """
+    from ultralytics import YOLO
+    
+    logger.info(f"Exporting {weights} to ONNX (imgsz={imgsz})")
+    exported = YOLO(str(weights)).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    return Path(exported)
+
+def head_nodes_to_exclude(onnx_path: Path) -> List[str]:
+    """
+    Keep the Detect head's box decoding in fp32.
+    
+    The DFL softmax, anchor arithmetic and final concat mix box coordinates in
+    pixels with class probabilities in [0, 1]; quantizing them to one scale
+    costs most of the accuracy lost in INT8 YOLO models, for little speedup.
+    """
+    import onnx
+    
+    model = onnx.load(str(onnx_path))
+    conv_heads = [n.name for n in model.graph.node if n.op_type == 'Conv']
+    if not conv_heads:
+        return []
+    
+    # The Detect head is the last module, e.g. "/model.22/cv2.0/..." for YOLOv8n
+    head_prefix = '/'.join(conv_heads[-1].split('/')[:2]) + '/'
+    
+    return [
+        n.name for n in model.graph.node
+        if n.name.startswith(head_prefix) and n.op_type != 'Conv'
+    ]
+
+def quantize(
+    fp32_path: Path,
+    int8_path: Path,
+    calib_images: List[Path],
+    imgsz: int,
+    per_channel: bool,
+    keep_head_fp32: bool
+) -> Path:
+    """
+    Run static QDQ quantization (uint8 activations, int8 weights)
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import (
+        quantize_static, QuantFormat, QuantType, CalibrationMethod
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    
+    prepared_path = fp32_path.with_name(fp32_path.stem + '_prep.onnx')
+    logger.info("Running quantization pre-processing")
+    quant_pre_process(str(fp32_path), str(prepared_path))
+    
+    session = ort.InferenceSession(str(prepared_path), providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    del session
+    
+    nodes_to_exclude = head_nodes_to_exclude(prepared_path) if keep_head_fp32 else []
+    if nodes_to_exclude:
+        logger.info(f"Keeping {len(nodes_to_exclude)} Detect head nodes in fp32")
+    
+    logger.info(f"Calibrating on {len(calib_images)} validation images")
+    quantize_static(
+        str(prepared_path),
+        str(int8_path),
+        ValImageReader(input_name, calib_images, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=per_channel,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=nodes_to_exclude
+    )
+    
+    prepared_path.unlink(missing_ok=True)
+    
+    return int8_path
+
+def validate(model_path: Path, data: str, imgsz: int) -> Dict[str, float]:
+    """
+    Validate an ONNX detector with Ultralytics on the dataset's val split
+    """
+    from ultralytics import YOLO
+    
+    logger.info(f"Validating {model_path}")
+    metrics = YOLO(str(model_path), task='detect').val(
+        data=data, imgsz=imgsz, batch=1, device='cpu', plots=False, verbose=False
+    )
+    return {
+        'map50': float(metrics.box.map50),
+        'map50_95': float(metrics.box.map),
+        'precision': float(metrics.box.mp),
+        'recall': float(metrics.box.mr)
+    }
+
+def benchmark(model_path: Path, images: List[Path], imgsz: int, warmup: int = 3) -> float:
+    """
+    Measure mean single-image CPU latency in milliseconds with onnxruntime
+    """
+    import onnxruntime as ort
+    
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(str(model_path), sess_options=options, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    
+    tensors = [t for t in (load_input_tensor(p, imgsz) for p in images) if t is not None]
+    if not tensors:
+        return 0.0
+    
+    for tensor in tensors[:warmup]:
+        session.run(None, {input_name: tensor})
+    
+    start = time.perf_counter()
+    for tensor in tensors:
+        session.run(None, {input_name: tensor})
+    
+    return (time.perf_counter() - start) * 1000.0 / len(tensors)
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the YOLOv8 detector to INT8 ONNX")
+    parser.add_argument('--weights', type=str, default='runs/detect/ssai_y8n4/weights/best.pt',
+                       help='Trained YOLOv8 .pt weights')
+    parser.add_argument('--data', type=str, default='seesomething.yaml',
+                       help='Ultralytics dataset config used for validation')
+    parser.add_argument('--calib-dir', type=str, default='data/merged/images/val',
+                       help='Calibration images (merged validation split)')
+    parser.add_argument('--calib-size', type=int, default=200,
+                       help='Number of calibration images')
+    parser.add_argument('--imgsz', type=int, default=640,
+                       help='Inference image size')
+    parser.add_argument('--out', type=str, default=None,
+                       help='INT8 model path (default: <weights dir>/best_int8.onnx)')
+    parser.add_argument('--no-per-channel', action='store_true',
+                       help='Use per-tensor instead of per-channel weight scales')
+    parser.add_argument('--quantize-head', action='store_true',
+                       help='Also quantize the Detect head decoding nodes')
+    parser.add_argument('--skip-val', action='store_true',
+                       help='Skip fp32/INT8 mAP validation')
+    parser.add_argument('--max-map-drop', type=float, default=0.02,
+                       help='Fail if mAP50-95 drops by more than this (absolute)')
+    
+    args = parser.parse_args()
+    
+    weights = Path(args.weights)
+    if not weights.exists():
+        logger.error(f"Weights not found: {weights}. Run 'make train' first.")
+        return 1
+    
+    calib_dir = Path(args.calib_dir)
+    if not calib_dir.is_dir():
+        logger.error(f"Calibration images not found: {calib_dir}. Run 'make merge' first.")
+        return 1
+    
+    calib_images = find_images(calib_dir, args.calib_size)
+    if not calib_images:
+        logger.error(f"No images found in {calib_dir}")
+        return 1
+    
+    int8_path = Path(args.out) if args.out else weights.with_name(weights.stem + '_int8.onnx')
+    
+    fp32_path = export_fp32_onnx(weights, args.imgsz)
+    quantize(
+        fp32_path, int8_path, calib_images, args.imgsz,
+        per_channel=not args.no_per_channel,
+        keep_head_fp32=not args.quantize_head
+    )
+    
+    report = {
+        'weights': str(weights),
+        'fp32_model': str(fp32_path),
+        'int8_model': str(int8_path),
+        'imgsz': args.imgsz,
+        'calibration_images': len(calib_images),
+        'size_mb': {
+            'fp32': os.path.getsize(fp32_path) / 1e6,
+            'int8': os.path.getsize(int8_path) / 1e6
+        }
+    }
+    
+    bench_images = calib_images[:50]
+    fp32_ms = benchmark(fp32_path, bench_images, args.imgsz)
+    int8_ms = benchmark(int8_path, bench_images, args.imgsz)
+    report['latency_ms'] = {
+        'fp32': fp32_ms,
+        'int8': int8_ms,
+        'speedup': fp32_ms / int8_ms if int8_ms else 0.0
+    }
+    
+    exit_code = 0
+    
+    if not args.skip_val:
+        fp32_metrics = validate(fp32_path, args.data, args.imgsz)
+        int8_metrics = validate(int8_path, args.data, args.imgsz)
+        report['metrics'] = {
+            'fp32': fp32_metrics,
+            'int8': int8_metrics,
+            'delta': {k: int8_metrics[k] - fp32_metrics[k] for k in fp32_metrics}
+        }
+        
+        if fp32_metrics['map50_95'] - int8_metrics['map50_95'] > args.max_map_drop:
+            exit_code = 1
+    
+    report_path = int8_path.with_suffix('.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    # Print report
+    print("\n" + "="*60)
+    print("INT8 QUANTIZATION REPORT")
+    print("="*60)
+    print(f"\nModel size:  fp32 {report['size_mb']['fp32']:.1f} MB -> int8 {report['size_mb']['int8']:.1f} MB")
+    print(f"CPU latency: fp32 {fp32_ms:.1f} ms -> int8 {int8_ms:.1f} ms ({report['latency_ms']['speedup']:.2f}x)")
+    
+    if 'metrics' in report:
+        for key in ('map50', 'map50_95'):
+            fp32_value = report['metrics']['fp32'][key]
+            int8_value = report['metrics']['int8'][key]
+            print(f"{key:<12} fp32 {fp32_value:.4f} -> int8 {int8_value:.4f} (delta {int8_value - fp32_value:+.4f})")
+    
+    print(f"\nINT8 model saved to: {int8_path}")
+    print(f"Detailed report saved to: {report_path}")
+    
+    if exit_code:
+        print(f"\n✗ mAP50-95 dropped by more than {args.max_map_drop}")
+    
+    return exit_code
+
+if __name__ == "__main__":
+    exit(main())